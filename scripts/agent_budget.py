@@ -0,0 +1,73 @@
+import time
+
+
+class AgentBudget:
+    """
+    Per-bug limits of an agent run, checked after every chunk of the agent stream: tool calls, wall time, tokens,
+    and progress. The run counts as looping once max_stale_steps retrieval steps in a row resolved no new method
+    (e.g. "You have already accessed this" or not-found replies) or the same request is repeated
+    max_repeated_requests times. Steps of progress_exempt_tools (analysis of an already retrieved method) neither
+    count as stale nor reset the count. exhausted() returns the reason to stop, or None.
+    """
+
+    def __init__(self, max_tool_calls=15, max_wall_seconds=600, max_tokens=250000, max_stale_steps=3, max_repeated_requests=2,
+                 progress_exempt_tools=()):
+        self.max_tool_calls = max_tool_calls
+        self.max_wall_seconds = max_wall_seconds
+        self.max_tokens = max_tokens
+        self.max_stale_steps = max_stale_steps
+        self.max_repeated_requests = max_repeated_requests
+        self.progress_exempt_tools = set(progress_exempt_tools)
+        self.usage = None
+        self.tool_calls = 0
+        self.stale_steps = 0
+        self.repeated_requests = 0
+        self._requests = set()
+        self._methods_known = 0
+        self._start_time = time.perf_counter()
+
+    def start(self, usage=None, methods_known=0):
+        """
+        usage is the session's get_openai_callback handler (tokens so far).
+        """
+        self.usage = usage
+        self._methods_known = methods_known
+        self._start_time = time.perf_counter()
+
+    def observe(self, chunk, methods_known):
+        """
+        Updates the counters from one agent stream chunk; methods_known is the number of distinct methods the
+        session has resolved so far (not-found placeholders excluded).
+        """
+        for action in chunk.get("actions", []) or []:
+            request = (action.tool, str(action.tool_input).strip().strip("'\"`"))
+            if request in self._requests:
+                self.repeated_requests += 1
+            self._requests.add(request)
+        for step in chunk.get("steps", []) or []:
+            # Counted once the tool has run, so a stop never discards a paid-for action
+            self.tool_calls += 1
+            if getattr(getattr(step, "action", None), "tool", None) in self.progress_exempt_tools:
+                continue
+            self.stale_steps = 0 if methods_known > self._methods_known else self.stale_steps + 1
+            self._methods_known = methods_known
+
+    def exhausted(self):
+        if self.tool_calls >= self.max_tool_calls:
+            return f"tool call budget ({self.max_tool_calls}) spent"
+        if time.perf_counter() - self._start_time >= self.max_wall_seconds:
+            return f"time budget ({self.max_wall_seconds}s) spent"
+        if self.usage is not None and self.usage.total_tokens >= self.max_tokens:
+            return f"token budget ({self.max_tokens}) spent"
+        if self.stale_steps >= self.max_stale_steps:
+            return f"no new methods in the last {self.stale_steps} steps"
+        if self.repeated_requests >= self.max_repeated_requests:
+            return f"{self.repeated_requests} repeated requests"
+        return None
+
+    def stats(self):
+        return {
+            "tool_calls": self.tool_calls,
+            "repeated_requests": self.repeated_requests,
+            "stale_steps": self.stale_steps,
+        }
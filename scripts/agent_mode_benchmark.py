@@ -0,0 +1,61 @@
+import os
+import json
+import statistics
+
+# Compares two runs of agentic_llm_generator.py on the same bugs, one per analysis_mode, using the
+# per-bug "agent_stats" (LLM calls, prompt/completion tokens, wall time) recorded in their outputs.
+project = "Zookeeper"
+runs = {
+    "llm": f"data/agentic_llm_bug_reports/{project}.json",
+    "structural": f"data/agentic_llm_bug_reports/structural/{project}.json",
+}
+output_file = f"results/agent_mode_benchmark/{project}.json"
+
+metrics = ["llm_calls", "prompt_tokens", "completion_tokens", "wall_time_seconds"]
+
+
+def load_stats(path):
+    if not os.path.exists(path):
+        print(f"Warning: File not found {path}")
+        return {}
+    with open(path, "r") as f:
+        data = json.load(f)
+    return {entry["filename"]: entry["agent_stats"] for entry in data if "agent_stats" in entry}
+
+
+def summarize(values):
+    return {
+        "total": round(sum(values), 2),
+        "mean": round(statistics.mean(values), 2),
+        "median": round(statistics.median(values), 2),
+    }
+
+
+stats_by_mode = {mode: load_stats(path) for mode, path in runs.items()}
+# Only bugs finished in every run are compared
+common_bugs = sorted(set.intersection(*(set(stats) for stats in stats_by_mode.values())))
+if not common_bugs:
+    raise SystemExit("No bug has agent_stats in every run; rerun agentic_llm_generator.py in each analysis_mode first.")
+
+per_bug = {
+    filename: {mode: {metric: stats_by_mode[mode][filename][metric] for metric in metrics} for mode in runs}
+    for filename in common_bugs
+}
+summary = {
+    mode: {metric: summarize([stats_by_mode[mode][filename][metric] for filename in common_bugs]) for metric in metrics}
+    for mode in runs
+}
+
+baseline, candidate = list(runs)
+print(f"{len(common_bugs)} bugs compared ({baseline} vs {candidate}), per bug:")
+print(f"{'metric':<20}{baseline + ' mean':>16}{candidate + ' mean':>20}{'ratio':>10}")
+for metric in metrics:
+    base_mean = summary[baseline][metric]["mean"]
+    candidate_mean = summary[candidate][metric]["mean"]
+    ratio = f"{candidate_mean / base_mean:.2f}x" if base_mean else "n/a"
+    print(f"{metric:<20}{base_mean:>16}{candidate_mean:>20}{ratio:>10}")
+
+os.makedirs(os.path.dirname(output_file), exist_ok=True)
+with open(output_file, "w") as f:
+    json.dump({"bugs": len(common_bugs), "summary": summary, "per_bug": per_bug}, f, indent=4)
+print(f"Benchmark saved to '{output_file}'")
@@ -0,0 +1,129 @@
+import os
+import json
+import asyncio
+import statistics
+from agent_trace import AgentTracer, load_traces, trace_result
+from agentic_llm_generator import (AgentSession, SnapshotPool, find_class_page, find_method_with_javalang,
+                                   get_commit_version, normalize_tool_input)
+
+# Replays the tool requests recorded by agentic_llm_generator.py (its <output_file>.traces/ sidecars) through the
+# retrieval stack without any LLM call: each request is resolved again against the bug's commit, in the recorded
+# order and with the session caches evolving as in the live run. Reports lookup latency and every step whose
+# resolution path or result changed, so retrieval changes can be benchmarked and regression-tested offline.
+# Replay with the retrieval settings of the recorded run (page_class_requests, class hierarchy); prefetching is
+# left out because its hits depend on LLM timing.
+project = "Zookeeper"
+input_file = f"data/source_code_data/{project}.json"
+recorded_trace_dir = f"data/agentic_llm_bug_reports/{project}.json.traces"
+output_file = f"results/agent_replay/{project}.json"
+
+repo_path = "Projects/zookeeper"
+codebase_dirs = ['Projects/zookeeper/src/java/main']
+git_branch = "master"
+use_class_hierarchy_index = False
+
+# Tools whose recorded request is re-resolved; the final report step has no retrieval
+RETRIEVAL_TOOLS = ("Provide Method", "Provide Methods", "Provide Class Page", "Analyze and Request Next")
+
+
+def replay_step(session, record):
+    """
+    Resolves one recorded request again and returns the new trace record.
+    """
+    tool, request = record["tool"], record["request"]
+    with session.trace_step(tool, request) as step:
+        if tool == "Provide Class Page":
+            result = find_class_page(request)
+        else:
+            result = find_method_with_javalang(normalize_tool_input(request), session.codebase_dirs, session.repo_path)
+        trace_result(result)
+    return step
+
+
+def replay_session(entry, records, snapshot_path, snapshot_dirs, class_hierarchy, trace_dir):
+    session = AgentSession(entry, snapshot_path, snapshot_dirs, class_hierarchy, trace_dir=trace_dir)
+    session.tracer = AgentTracer(session.trace_path())
+    steps = []
+    try:
+        with session.active():
+            for record in records:
+                if record["tool"] not in RETRIEVAL_TOOLS:
+                    continue
+                replayed = replay_step(session, record)
+                steps.append({
+                    "tool": record["tool"],
+                    "request": record["request"],
+                    "recorded_resolution": record["resolution"],
+                    "replayed_resolution": replayed["resolution"],
+                    # Recordings made before result digests were traced only compare resolution paths
+                    "result_changed": record.get("result_digest") is not None and record["result_digest"] != replayed["result_digest"],
+                    "recorded_seconds": round(record["wall_seconds"] - record["llm_seconds"], 4),
+                    "replayed_seconds": round(replayed["wall_seconds"], 4),
+                    "parse_count": replayed["parse_count"],
+                })
+    finally:
+        session.tracer.close()
+    return steps
+
+
+async def replay_all(entries, traces, trace_dir):
+    """
+    Replays the bugs one at a time so lookup latencies are not skewed by concurrent sessions.
+    """
+    snapshots = SnapshotPool(repo_path, codebase_dirs, use_class_hierarchy_index)
+    replayed = {}
+    for entry in entries:
+        bug = os.path.splitext(entry['filename'])[0]
+        if bug not in traces:
+            continue
+        commit_version = await asyncio.to_thread(get_commit_version, entry['creation_time'], repo_path, git_branch)
+        snapshot_path, snapshot_dirs, call_graph = await snapshots.acquire(commit_version)
+        try:
+            class_hierarchy = call_graph.hierarchy if call_graph is not None else None
+            replayed[bug] = await asyncio.to_thread(replay_session, entry, traces[bug], snapshot_path, snapshot_dirs, class_hierarchy, trace_dir)
+        except Exception as e:
+            print(f"Error replaying {entry['filename']}: {e}")
+        finally:
+            await snapshots.release(commit_version)
+    return replayed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+if __name__ == "__main__":
+    with open(input_file, "r") as f:
+        entries = json.load(f)
+    traces = load_traces(recorded_trace_dir)
+    replayed = asyncio.run(replay_all(entries, traces, f"{output_file}.traces"))
+
+    steps = [dict(step, bug=bug) for bug, bug_steps in replayed.items() for step in bug_steps]
+    if not steps:
+        raise SystemExit(f"No recorded retrieval steps found in {recorded_trace_dir}; run agentic_llm_generator.py with trace_agent_steps first.")
+    latencies = [step["replayed_seconds"] for step in steps]
+    regressions = [step for step in steps if step["result_changed"] or step["recorded_resolution"] != step["replayed_resolution"]]
+    summary = {
+        "bugs": len(replayed),
+        "steps": len(steps),
+        "changed_steps": len(regressions),
+        "total_seconds": round(sum(latencies), 3),
+        "mean_seconds": round(statistics.mean(latencies), 4),
+        "p50_seconds": round(percentile(latencies, 0.5), 4),
+        "p95_seconds": round(percentile(latencies, 0.95), 4),
+        "recorded_total_seconds": round(sum(step["recorded_seconds"] for step in steps), 3),
+    }
+
+    print(f"Replayed {summary['steps']} retrieval steps of {summary['bugs']} bugs in {summary['total_seconds']}s "
+          f"(mean {summary['mean_seconds']}s, p50 {summary['p50_seconds']}s, p95 {summary['p95_seconds']}s)")
+    print(f"Recorded run: {summary['recorded_total_seconds']}s in the same steps, LLM time excluded")
+    print(f"{summary['changed_steps']} steps resolved differently from the recording")
+    for step in regressions[:20]:
+        print(f"  {step['bug']}  {step['tool']}({step['request']}): {step['recorded_resolution']} -> {step['replayed_resolution']}"
+              + (" [result changed]" if step["result_changed"] else ""))
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump({"summary": summary, "changed_steps": regressions, "per_bug": replayed}, f, indent=4)
+    print(f"Replay report saved to '{output_file}'")
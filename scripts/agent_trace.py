@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+# Step being traced in the current context (set by AgentTracer.step, read by the instrumented helpers)
+_current_step = contextvars.ContextVar("agent_trace_step", default=None)
+
+
+class TraceStep(dict):
+    """
+    One trace record: tool, requested FQN, resolution path, cache hit/miss, parse time, LLM latency and tokens.
+    Helpers deeper in the call stack annotate the current step through current_step().
+    """
+
+    def __init__(self, tool, request):
+        super().__init__(tool=tool, request=request, resolution=None, cache=None, parse_seconds=0.0, parse_count=0,
+                         llm_seconds=0.0, llm_calls=0, prompt_tokens=0, completion_tokens=0, wall_seconds=0.0,
+                         result_digest=None, result_chars=0)
+        self._lock = threading.Lock()
+
+    def add(self, field, value):
+        with self._lock:
+            self[field] += value
+
+    @contextmanager
+    def timed(self, field, count_field=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(field, time.perf_counter() - start)
+            if count_field:
+                self.add(count_field, 1)
+
+
+def current_step():
+    return _current_step.get()
+
+
+def trace_resolution(resolution, cache_hit=False):
+    """
+    Records which path of a lookup answered the request. No-op outside a traced step.
+    """
+    step = _current_step.get()
+    if step is not None and step["resolution"] is None:
+        step["resolution"] = resolution
+        step["cache"] = "hit" if cache_hit else "miss"
+
+
+def trace_result(text):
+    """
+    Records a digest of what the retrieval returned, so replays (agent_replay.py) can detect changed results.
+    """
+    step = _current_step.get()
+    if step is not None and text is not None:
+        step["result_digest"] = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+        step["result_chars"] = len(text)
+
+
+@contextmanager
+def traced(field, count_field=None):
+    """
+    Adds the elapsed time of the block to a field of the current step (parse_seconds, llm_seconds).
+    """
+    step = _current_step.get()
+    if step is None:
+        yield
+        return
+    with step.timed(field, count_field):
+        yield
+
+
+class AgentTracer:
+    """
+    Writes one JSON line per agent step to a per-bug sidecar file. usage is the session's token counter
+    (get_openai_callback handler); each step records the tokens spent while it ran.
+    """
+
+    def __init__(self, path, usage=None):
+        self.path = path
+        self.usage = usage
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "w")
+        self._index = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, tool, request):
+        record = TraceStep(tool, request)
+        usage_before = self._usage()
+        token = _current_step.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            _current_step.reset(token)
+            record["wall_seconds"] = time.perf_counter() - start
+            usage_after = self._usage()
+            record["llm_calls"] = usage_after[0] - usage_before[0]
+            record["prompt_tokens"] = usage_after[1] - usage_before[1]
+            record["completion_tokens"] = usage_after[2] - usage_before[2]
+            self.write(record)
+
+    def _usage(self):
+        if self.usage is None:
+            return 0, 0, 0
+        return self.usage.successful_requests, self.usage.prompt_tokens, self.usage.completion_tokens
+
+    def write(self, record):
+        with self._lock:
+            line = {"step": self._index, **{key: round(value, 4) if isinstance(value, float) else value for key, value in record.items()}}
+            self._file.write(json.dumps(line) + "\n")
+            self._file.flush()
+            self._index += 1
+
+    def close(self):
+        self._file.close()
+
+
+def load_traces(trace_dir):
+    """
+    {bug filename: [records]} for every .jsonl sidecar in trace_dir.
+    """
+    traces = {}
+    for file_name in sorted(os.listdir(trace_dir)):
+        if file_name.endswith(".jsonl"):
+            with open(os.path.join(trace_dir, file_name), "r") as f:
+                traces[file_name[:-len(".jsonl")]] = [json.loads(line) for line in f if line.strip()]
+    return traces
+
+
+def summarize_traces(traces, top_n=10):
+    """
+    Time split (LLM / parsing / other), cache hit rate, time per resolution path, repeated requests and the slowest steps.
+    """
+    records = [dict(record, bug=bug) for bug, bug_records in traces.items() for record in bug_records]
+    wall = sum(record["wall_seconds"] for record in records)
+    llm = sum(record["llm_seconds"] for record in records)
+    parse = sum(record["parse_seconds"] for record in records)
+    lookups = [record for record in records if record["cache"] is not None]
+
+    by_resolution = {}
+    for record in records:
+        resolution = by_resolution.setdefault(record["resolution"] or "(none)", {"steps": 0, "wall_seconds": 0.0, "parse_seconds": 0.0})
+        resolution["steps"] += 1
+        resolution["wall_seconds"] += record["wall_seconds"]
+        resolution["parse_seconds"] += record["parse_seconds"]
+
+    request_counts = {}
+    for record in records:
+        if record["request"]:
+            key = (record["bug"], record["request"])
+            request_counts[key] = request_counts.get(key, 0) + 1
+
+    return {
+        "bugs": len(traces),
+        "steps": len(records),
+        "wall_seconds": round(wall, 2),
+        "llm_seconds": round(llm, 2),
+        "parse_seconds": round(parse, 2),
+        "other_seconds": round(wall - llm - parse, 2),
+        "prompt_tokens": sum(record["prompt_tokens"] for record in records),
+        "completion_tokens": sum(record["completion_tokens"] for record in records),
+        "cache_hit_rate": round(sum(record["cache"] == "hit" for record in lookups) / len(lookups), 3) if lookups else None,
+        "by_resolution": {name: {key: round(value, 2) for key, value in stats.items()} for name, stats in sorted(by_resolution.items(), key=lambda item: -item[1]["wall_seconds"])},
+        "repeated_requests": [{"bug": bug, "request": request, "count": count} for (bug, request), count in sorted(request_counts.items(), key=lambda item: -item[1]) if count > 1][:top_n],
+        "slowest_steps": sorted(records, key=lambda record: -record["wall_seconds"])[:top_n],
+    }
+
+
+if __name__ == "__main__":
+    # Sidecars written by agentic_llm_generator.py next to its output file
+    trace_dir = "data/agentic_llm_bug_reports/Zookeeper.json.traces"
+    top_n = 10
+
+    summary = summarize_traces(load_traces(trace_dir), top_n)
+    print(f"{summary['bugs']} bugs, {summary['steps']} steps, {summary['wall_seconds']}s in tool steps "
+          f"(LLM {summary['llm_seconds']}s, parsing {summary['parse_seconds']}s, other {summary['other_seconds']}s)")
+    print(f"Tokens: {summary['prompt_tokens']} prompt / {summary['completion_tokens']} completion; cache hit rate: {summary['cache_hit_rate']}")
+    print("\nTime by resolution path:")
+    for name, stats in summary["by_resolution"].items():
+        print(f"  {name:<28}{stats['steps']:>6} steps{stats['wall_seconds']:>10}s (parsing {stats['parse_seconds']}s)")
+    if summary["repeated_requests"]:
+        print("\nRepeated requests:")
+        for repeated in summary["repeated_requests"]:
+            print(f"  {repeated['bug']}: {repeated['request']} x{repeated['count']}")
+    print(f"\nSlowest {len(summary['slowest_steps'])} steps:")
+    for record in summary["slowest_steps"]:
+        print(f"  {record['wall_seconds']:>8}s  {record['bug']}  {record['tool']}({record['request']})  "
+              f"resolution={record['resolution']} cache={record['cache']} llm={record['llm_seconds']}s parse={record['parse_seconds']}s")
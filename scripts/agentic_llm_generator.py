@@ -1,16 +1,35 @@
-from langchain_openai import ChatOpenAI
 from langchain.agents import initialize_agent, Tool
 from langchain.tools import tool
 import json
 from langchain_core.runnables.utils import AddableDict
 from langchain import PromptTemplate
 from langchain_core.prompts import PromptTemplate
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import LLMChain
 import os
+import re
+import shutil
+import asyncio
 import javalang
 import subprocess
-import tiktoken
+import contextvars
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from langchain.callbacks import get_openai_callback
+from java_symbol_table import build_symbol_table, simple_class_name, top_level_class, type_name
+from call_graph_index import load_or_build_call_graph
+from method_line_index import build_method_line_index, interval_source
+from method_registry import MethodRegistry, RegistryDict
+from token_budget import PromptBudget, map_reduce, split_into_chunks
+from method_prefetcher import MethodPrefetcher
+from llm_gateway import get_gateway
+from context_packer import pack_methods
+from source_compaction import compact_source
+from prompt_layout import cacheable_template
+from structured_output import REPORT_SCHEMA, RawResponseLog, StructuredOutputError, parse_structured
+from class_pager import class_member, class_outline, class_page
+from chat_history_memory import ChatHistoryMemory
+from agent_budget import AgentBudget
+from agent_trace import AgentTracer, trace_resolution, trace_result, traced
 
 
 # Get the commit version before a specific timestamp
@@ -20,26 +39,303 @@ def get_commit_version(creation_time, repo_path, git_branch):
     commit_version = result.stdout.strip()
     return commit_version
 
-# Checkout to the specific commit version
-def checkout_to_commit(commit_version, repo_path, git_branch):
-    # Reset any local changes
-    subprocess.run('git reset --hard', shell=True, cwd=repo_path)
-    # Ensure a clean stash
-    subprocess.run('git stash push --include-untracked', shell=True, cwd=repo_path)
-    # Switch back to the main branch before checking out the commit
-    subprocess.run(f'git checkout {git_branch}', shell=True, cwd=repo_path)
-    # Ensure branch is up-to-date
-    subprocess.run('git pull', shell=True, cwd=repo_path)
-    # Checkout to the required commit
-    subprocess.run(f'git checkout {commit_version}', shell=True, cwd=repo_path)
-    # Drop the stash if it's no longer needed
-    subprocess.run('git stash drop', shell=True, cwd=repo_path)
+
+
+# Per-bug agent state. Tools run inside AgentSession.run, which binds the session to the current context
+_current_session = contextvars.ContextVar("agent_session")
+
+def current_session():
+    return _current_session.get()
+
+
+class AgentSession:
+    """
+    State of one bug's agent run: method and class-skeleton caches, the last accessed file, chat history and the
+    snapshot (checked-out worktree) its tool lookups read from. Sessions share nothing mutable, so many can run at once.
+    """
+
+    def __init__(self, entry, repo_path, codebase_dirs, class_hierarchy=None, call_graph=None, trace_dir=None):
+        self.filename = entry['filename']
+        self.creation_time = entry['creation_time']
+        self.bug_report = entry['bug_report']
+        self.stack_trace = entry['stack_trace']
+        self.source_code_dict = entry['source_code']
+        self.repo_path = repo_path
+        self.codebase_dirs = codebase_dirs
+        self.class_hierarchy = class_hierarchy
+
+        # Cache for storing method definitions
+        self.method_cache = RegistryDict()
+        self.class_skeleton_cache = RegistryDict()
+        self.source_code_registry = MethodRegistry(self.source_code_dict)
+        self.last_accessed_path = None
+        self.method_extracted_successfully = False # True if method requested by agent can be extracted
+        self.stack_frame_lines = parse_frame_lines(self.stack_trace)
+        # Recent turns verbatim, older ones rolled into summaries and facts when rendered into prompts
+        self.chat_history = ChatHistoryMemory(chat_history_recent_tokens)
+        # Warms the callees of each retrieved method while the agent waits on the LLM
+        self.prefetcher = MethodPrefetcher(call_graph, repo_path, extract_class_skeleton) if call_graph is not None else None
+        # Per-step trace records go to <trace_dir>/<bug>.jsonl
+        self.trace_dir = trace_dir
+        self.tracer = None
+        # Stops the agent loop early once a limit is reached or it stops discovering new methods
+        # Analysis steps re-read a method already retrieved: they are not judged on progress
+        self.budget = AgentBudget(max_tool_calls_per_bug, max_wall_seconds_per_bug, max_tokens_per_bug, max_steps_without_new_methods,
+                                  progress_exempt_tools=("Analyze and Request Next",))
+        self.stop_reason = None
+        # Prompt tokens saved by source compaction (tool results and the final report's code)
+        self.compaction_tokens_saved = 0
+
+    def compact(self, code):
+        """
+        Code as it goes into a prompt: compacted when compact_code is set (the method cache keeps the original).
+        """
+        if not compact_code:
+            return code
+        code, saved = compact_source(code, elide_log_statements)
+        self.compaction_tokens_saved += saved
+        return code
+
+    def resolved_method_count(self):
+        """
+        Distinct methods (and classes, pages) found so far; not-found placeholders are cached too but are no progress.
+        """
+        return sum(1 for value in self.method_cache.values() if value != "[Method not found in codebase]")
+
+    def prefetch_callees(self, method_name):
+        if self.prefetcher is not None:
+            self.prefetcher.schedule(method_name)
+
+    def trace_step(self, tool, request):
+        if self.tracer is None:
+            return nullcontext()
+        return self.tracer.step(tool, request)
+
+    def trace_path(self):
+        return os.path.join(self.trace_dir, f"{os.path.splitext(self.filename)[0]}.jsonl")
+
+    @contextmanager
+    def active(self):
+        """
+        Binds the session to the current context without running the agent (the tools find it with current_session()).
+        """
+        token = _current_session.set(self)
+        try:
+            yield self
+        finally:
+            _current_session.reset(token)
+
+    def run(self):
+        token = _current_session.set(self)
+        start_time = time.perf_counter()
+        try:
+            # Counts every LLM call of this session: the agent's own and those made inside tools
+            with get_openai_callback() as usage:
+                if self.trace_dir:
+                    self.tracer = AgentTracer(self.trace_path(), usage)
+                self.budget.start(usage, self.resolved_method_count())
+                output = self._run()
+            output["agent_stats"] = {
+                "analysis_mode": analysis_mode,
+                "llm_calls": usage.successful_requests,
+                "prompt_tokens": usage.prompt_tokens,
+                # Prompt tokens served from the provider's prefix cache (older callback handlers do not count them)
+                "cached_prompt_tokens": getattr(usage, "prompt_tokens_cached", 0),
+                "completion_tokens": usage.completion_tokens,
+                "wall_time_seconds": round(time.perf_counter() - start_time, 2),
+                "stop_reason": self.stop_reason,
+                "compaction_tokens_saved": self.compaction_tokens_saved,
+                **self.budget.stats(),
+            }
+            return output
+        finally:
+            _current_session.reset(token)
+            if self.tracer is not None:
+                self.tracer.close()
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+                print(f"Prefetch for {self.filename}: {self.prefetcher.hits}/{self.prefetcher.requests} lookups served")
+
+    def _run(self):
+        bug_report = self.bug_report
+
+        # Step 1: Parse the stack trace
+        parsed_stack_traces = get_agent_executor().stream({"input": self.stack_trace})
+
+        # Ensure parsed_stack_traces is iterable and extract traces
+        if isinstance(parsed_stack_traces, dict) or hasattr(parsed_stack_traces, "items"):
+            parsed_stack_traces = list(parsed_stack_traces.values())
+            print("parsed stack traces list:", parsed_stack_traces)
+
+        # Step 2: Sequentially request and analyze methods
+        for trace in parsed_stack_traces:
+            if isinstance(trace, dict) or isinstance(trace, AddableDict):
+                if 'messages' in trace and ('output' in trace or 'actions' in trace):
+                    agent_based_chat = trace['messages'][0].content
+                    self.chat_history.append(agent_based_chat)
+            else:
+                print(f"Unexpected trace format: {trace}")
+                continue
+
+            # Leave the loop (closing the agent stream) and go straight to the final report once the budget is spent
+            self.budget.observe(trace, self.resolved_method_count())
+            self.stop_reason = self.budget.exhausted()
+            if self.stop_reason:
+                print(f"Stopping the agent for {self.filename}: {self.stop_reason}")
+                break
+
+        # Step 3: Generate the final bug report
+        try:
+            # Manually trigger the final bug report generation
+            with self.trace_step("Generate Final Bug Report", None):
+                final_bug_report = generate_final_bug_report(self.method_cache, bug_report)
+            print("####################################")
+            print(f"Final bug report for {self.filename}:", final_bug_report)
+            print("####################################")
+
+            # Parse (repairing when needed) and include the generated bug report; keep the raw answer either way
+            try:
+                bug_report, outcome = parse_structured(final_bug_report, REPORT_SCHEMA)
+            except StructuredOutputError as e:
+                raw_responses.record(self.filename, final_bug_report, e.outcome, "final_report")
+                raise
+            raw_responses.record(self.filename, final_bug_report, outcome, "final_report")
+
+        except Exception as e:
+            print(f"Error generating final bug report: {e}")
+
+        return {
+            "filename": self.filename,
+            "creation_time": self.creation_time,
+            "analyzed_methods": self.method_cache,
+            "class_skeleton_cache": self.class_skeleton_cache,
+            "chat_history": self.chat_history.turns,
+            "method_extracted_successfully": self.method_extracted_successfully,
+            "bug_report": bug_report
+        }
+
+
+class SnapshotPool:
+    """
+    Read-only git worktrees of the commits being analyzed (Projects/.worktrees/<commit>/<repo>), shared by every
+    session of the same commit. Each bug is registered with expect() before it runs; a snapshot is removed once
+    the last expected bug of its commit is released, not whenever no session happens to hold it. The main checkout
+    is never switched. Worktrees and call graphs are built and removed outside the pool's lock, so sessions of
+    other commits keep running meanwhile.
+    """
+
+    def __init__(self, repo_path, codebase_dirs, load_call_graph=False):
+        self.repo_path = repo_path
+        self.codebase_dirs = codebase_dirs
+        self.load_call_graph = load_call_graph
+        # commit -> task building (path, snapshot_dirs, call_graph), awaited by every session of the commit
+        self._snapshots = {}
+        self._remaining = {}
+        self._lock = asyncio.Lock()
+
+    def _snapshot_path(self, commit_version):
+        return os.path.join(os.path.dirname(os.path.abspath(self.repo_path)), ".worktrees", commit_version, os.path.basename(os.path.abspath(self.repo_path)))
+
+    def _create(self, commit_version):
+        path = os.path.relpath(self._snapshot_path(commit_version))
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            subprocess.run(["git", "worktree", "prune"], cwd=self.repo_path)
+            subprocess.run(["git", "worktree", "add", "--detach", os.path.abspath(path), commit_version], cwd=self.repo_path, check=True)
+        snapshot_dirs = [os.path.join(path, os.path.relpath(d, self.repo_path)) for d in self.codebase_dirs]
+        call_graph = load_or_build_call_graph(path, commit_version, snapshot_dirs, self.repo_path) if self.load_call_graph else None
+        return path, snapshot_dirs, call_graph
+
+    def _remove(self, path):
+        subprocess.run(["git", "worktree", "remove", "--force", os.path.abspath(path)], cwd=self.repo_path)
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def expect(self, commit_version):
+        """
+        Registers one bug that will acquire (and then release) the snapshot of commit_version.
+        """
+        self._remaining[commit_version] = self._remaining.get(commit_version, 0) + 1
+
+    async def acquire(self, commit_version):
+        async with self._lock:
+            creation = self._snapshots.get(commit_version)
+            if creation is None:
+                creation = self._snapshots[commit_version] = asyncio.ensure_future(asyncio.to_thread(self._create, commit_version))
+        return await creation
+
+    async def release(self, commit_version):
+        """
+        Called once per expected bug, also when its acquire failed.
+        """
+        async with self._lock:
+            self._remaining[commit_version] = self._remaining.get(commit_version, 1) - 1
+            if self._remaining[commit_version] > 0:
+                return
+            del self._remaining[commit_version]
+            creation = self._snapshots.pop(commit_version, None)
+        if creation is not None and creation.done() and creation.exception() is None:
+            await asyncio.to_thread(self._remove, creation.result()[0])
+
+
+def write_output(output_file, output_data):
+    temp_file = f"{output_file}.tmp"
+    with open(temp_file, "w") as outfile:
+        json.dump(output_data, outfile, indent=4)
+    os.replace(temp_file, output_file)
+
+
+async def run_agent_sessions(entries, repo_path, codebase_dirs, git_branch, output_file, max_concurrent_sessions=4, use_class_hierarchy=False, use_prefetch=False, trace_dir=None):
+    """
+    Runs one AgentSession per bug, at most max_concurrent_sessions at a time, each against the snapshot of its
+    commit. Progress is saved after every finished bug, always in input order.
+    use_class_hierarchy and use_prefetch load the per-commit call graph index of each snapshot. With a trace_dir,
+    every tool step of a bug is recorded in <trace_dir>/<bug>.jsonl (see agent_trace.py).
+    """
+    snapshots = SnapshotPool(repo_path, codebase_dirs, use_class_hierarchy or use_prefetch)
+    semaphore = asyncio.Semaphore(max_concurrent_sessions)
+    results = [None] * len(entries)
+    # Commits are resolved up front so each snapshot is kept until the last bug of its commit has run
+    commit_versions = await asyncio.gather(*(asyncio.to_thread(get_commit_version, entry['creation_time'], repo_path, git_branch) for entry in entries))
+    for commit_version in commit_versions:
+        snapshots.expect(commit_version)
+
+    async def run_one(index, entry):
+        async with semaphore:
+            commit_version = commit_versions[index]
+            print(f"Commit Version for {entry['filename']}:", commit_version)
+            try:
+                snapshot_path, snapshot_dirs, call_graph = await snapshots.acquire(commit_version)
+            except Exception as e:
+                print(f"Error preparing snapshot {commit_version} for {entry['filename']}: {e}")
+                await snapshots.release(commit_version)
+                return
+            try:
+                class_hierarchy = call_graph.hierarchy if use_class_hierarchy and call_graph is not None else None
+                session = AgentSession(entry, snapshot_path, snapshot_dirs, class_hierarchy, call_graph if use_prefetch else None, trace_dir)
+                # The agent and its tools are synchronous; each session runs in its own worker thread
+                results[index] = await asyncio.to_thread(session.run)
+            except Exception as e:
+                print(f"Error running agent for {entry['filename']}: {e}")
+            finally:
+                await snapshots.release(commit_version)
+
+        # Write to output file after each bug report
+        write_output(output_file, [result for result in results if result is not None])
+        print(f"Progress saved to {output_file}")
+
+    await asyncio.gather(*(run_one(index, entry) for index, entry in enumerate(entries)))
+    return [result for result in results if result is not None]
+
+
+def parse_java(content):
+    # Parse time is charged to the traced step
+    with traced("parse_seconds", "parse_count"):
+        return javalang.parse.parse(content)
 
 
 # Find method in codebase and return its source code along with class skeleton
 def find_method_with_javalang(method_name, codebase_dirs, repo_path):
-    global last_accessed_path
-    global method_extracted_successfully
+    session = current_session()
     # if method_name in method_cache:
     #     return method_cache[method_name]
 
@@ -60,6 +356,7 @@ def find_method_with_javalang(method_name, codebase_dirs, repo_path):
                     found_name = True
                     break
         if not found_name:
+            trace_resolution("invalid_format")
             return "Invalid format. Please request a method using the fully qualified format: {package}.{class}.{method}"
 
     if method_name.endswith("()"):
@@ -84,103 +381,134 @@ def find_method_with_javalang(method_name, codebase_dirs, repo_path):
         class_method_name = method_name
         class_method_name_only = None
     
-    # Check method_cache first
-    for method_key, method_body in method_cache.items():
-        if method_key.endswith(f".{class_method_name}"):
-            class_path = "/".join(method_key.split(".")[:-1]) 
-            last_accessed_path = f"{repo_path}/{class_path}.java"
-            method_body = f"# You have already accessed this. Please avoid requesting it again. \n\n{method_body}"
-            return method_body
+    # Check method_cache first [suffix lookups go through the caches' reversed-token registries]
+    for method_key in session.method_cache.keys_ending_with(class_method_name, proper=True):
+        method_body = session.method_cache[method_key]
+        class_path = "/".join(method_key.split(".")[:-1]) 
+        session.last_accessed_path = f"{repo_path}/{class_path}.java"
+        method_body = f"{ALREADY_ACCESSED_NOTE} Please avoid requesting it again. \n\n{method_body}"
+        trace_resolution("method_cache", cache_hit=True)
+        return method_body
         
         
     # Check class_skeleton_cache if it is asking for a class
-    for class_key, class_body in class_skeleton_cache.items():
-        if class_key.endswith(f".{method_name_only}"):
-            class_path = "/".join(class_key.split(".")) 
-            last_accessed_path = f"{repo_path}/{class_path}.java"
-            # Access full content
-            if os.path.exists(last_accessed_path):
-                try:
-                    with open(last_accessed_path, 'r') as f:
-                        content = f.read()
-                        method_cache[class_key] = [content]
-                        method_extracted_successfully = True
-                        return content
-                except Exception as e:
-                        print(f"Error extracting class content from {last_accessed_path}: {e}")
+    for class_key in session.class_skeleton_cache.keys_ending_with(method_name_only, proper=True):
+        class_path = "/".join(class_key.split(".")) 
+        session.last_accessed_path = f"{repo_path}/{class_path}.java"
+        # Access the class [skeleton first; members and line windows through Provide Class Page]
+        if os.path.exists(session.last_accessed_path):
+            class_content = provide_class_content(session.last_accessed_path, class_key)
+            if class_content:
+                trace_resolution("class_skeleton_cache")
+                return class_content
             
         
     # If not in method_cache, search in source_code_dict [{class}.{method} first]
-    for method_key, method_body in source_code_dict.items():
-        if method_key.lower().endswith(f".{class_method_name}".lower()):
-            # Handle if class name is lower case
-            parts = method_key.split(".")
-            if parts[-2][0].islower():
-                parts[-2] = parts[-2][0].upper() + parts[-2][1:]
-                method_key = ".".join(parts)
-
-            class_path = "/".join(method_key.split(".")[:-1]) 
-            last_accessed_path = repo_path + '/' + class_path + '.java'
-            class_full_name = ".".join(method_key.split(".")[:-1])
+    for method_key in session.source_code_registry.suffix_matches(class_method_name, ignore_case=True, proper=True):
+        method_body = session.source_code_dict[method_key]
+        # Handle if class name is lower case
+        parts = method_key.split(".")
+        if parts[-2][0].islower():
+            parts[-2] = parts[-2][0].upper() + parts[-2][1:]
+            method_key = ".".join(parts)
+
+        class_path = "/".join(method_key.split(".")[:-1]) 
+        session.last_accessed_path = repo_path + '/' + class_path + '.java'
+        class_full_name = ".".join(method_key.split(".")[:-1])
+
+        class_skeleton = None
+        if class_full_name not in session.class_skeleton_cache:
+            if os.path.exists(session.last_accessed_path):
+                try:
+                    with open(session.last_accessed_path, 'r') as f:
+                        content = f.read()
+                        tree = parse_java(content)
+                        class_skeleton = extract_class_skeleton(tree)
+                        session.class_skeleton_cache[class_full_name] = class_skeleton
+                except Exception as e:
+                    print(f"Error extracting class skeleton from {session.last_accessed_path}: {e}")
 
-            class_skeleton = None
-            if class_full_name not in class_skeleton_cache:
-                if os.path.exists(last_accessed_path):
-                    try:
-                        with open(last_accessed_path, 'r') as f:
-                            content = f.read()
-                            tree = javalang.parse.parse(content)
-                            class_skeleton = extract_class_skeleton(tree)
-                            class_skeleton_cache[class_full_name] = class_skeleton
-                    except Exception as e:
-                        print(f"Error extracting class skeleton from {last_accessed_path}: {e}")
-
-            if class_skeleton:
-                method_cache[method_key] = method_body
-                method_body = f"# Class Skeleton: {class_skeleton}\n\n# Requested Method: {method_body}"
-            else:
-                method_cache[method_key] = method_body
-            method_extracted_successfully = True
-            return method_body
+        if class_skeleton:
+            session.method_cache[method_key] = method_body
+            method_body = f"# Class Skeleton: {class_skeleton}\n\n# Requested Method: {method_body}"
+        else:
+            session.method_cache[method_key] = method_body
+        session.method_extracted_successfully = True
+        trace_resolution("source_code_dict")
+        return method_body
 
     # If not in method_cache, search in source_code_dict [if {class}.{method} not found, then method_name only]
-    for method_key, method_body in source_code_dict.items():
-        if method_key.lower().endswith(f".{method_name_only}".lower()):
-            # Handle if class name is lower case
-            parts = method_key.split(".")
-            if parts[-2][0].islower():
-                parts[-2] = parts[-2][0].upper() + parts[-2][1:]
-                method_key = ".".join(parts)
-
-            class_path = "/".join(method_key.split(".")[:-1]) 
-            last_accessed_path = repo_path + '/' + class_path + '.java'
-            class_full_name = ".".join(method_key.split(".")[:-1])
+    for method_key in session.source_code_registry.suffix_matches(method_name_only, ignore_case=True, proper=True):
+        method_body = session.source_code_dict[method_key]
+        # Handle if class name is lower case
+        parts = method_key.split(".")
+        if parts[-2][0].islower():
+            parts[-2] = parts[-2][0].upper() + parts[-2][1:]
+            method_key = ".".join(parts)
+
+        class_path = "/".join(method_key.split(".")[:-1]) 
+        session.last_accessed_path = repo_path + '/' + class_path + '.java'
+        class_full_name = ".".join(method_key.split(".")[:-1])
+
+        class_skeleton = None
+        if class_full_name not in session.class_skeleton_cache:
+            if os.path.exists(session.last_accessed_path):
+                try:
+                    with open(session.last_accessed_path, 'r') as f:
+                        content = f.read()
+                        tree = parse_java(content)
+                        class_skeleton = extract_class_skeleton(tree)
+                        session.class_skeleton_cache[class_full_name] = class_skeleton
+                except Exception as e:
+                    print(f"Error extracting class skeleton from {session.last_accessed_path}: {e}")
 
-            class_skeleton = None
-            if class_full_name not in class_skeleton_cache:
-                if os.path.exists(last_accessed_path):
-                    try:
-                        with open(last_accessed_path, 'r') as f:
-                            content = f.read()
-                            tree = javalang.parse.parse(content)
-                            class_skeleton = extract_class_skeleton(tree)
-                            class_skeleton_cache[class_full_name] = class_skeleton
-                    except Exception as e:
-                        print(f"Error extracting class skeleton from {last_accessed_path}: {e}")
-
-            if class_skeleton:
-                method_cache[method_key] = method_body
-                method_body = f"# Class Skeleton: {class_skeleton}\n\n# Requested Method: {method_body}"
-            else:
-                method_cache[method_key] = method_body
-            method_extracted_successfully = True
-            return method_body
+        if class_skeleton:
+            session.method_cache[method_key] = method_body
+            method_body = f"# Class Skeleton: {class_skeleton}\n\n# Requested Method: {method_body}"
+        else:
+            session.method_cache[method_key] = method_body
+        session.method_extracted_successfully = True
+        trace_resolution("source_code_dict_method_name")
+        return method_body
         
     
+    # Callees warmed in the background while the agent was waiting on the LLM
+    if session.prefetcher is not None and class_method_name_only and method_name_only[0].islower():
+        prefetched = session.prefetcher.lookup(class_method_name)
+        if prefetched:
+            method_key, method_body, class_key, class_skeleton = prefetched
+            session.last_accessed_path = f"{repo_path}/{class_key.replace('.', '/')}.java"
+            session.method_cache[method_key] = method_body
+            session.method_extracted_successfully = True
+            trace_resolution("prefetch", cache_hit=True)
+            if class_skeleton and class_key not in session.class_skeleton_cache:
+                session.class_skeleton_cache[class_key] = class_skeleton
+                return f"# Class Skeleton: {class_skeleton}\n\n# Requested Method: {method_body}"
+            return method_body
+
+    # Calls through interfaces/abstract classes: resolve to the concrete implementation with one hierarchy lookup
+    if session.class_hierarchy is not None and class_method_name_only and method_name_only[0].islower():
+        requested_class = ".".join(method_name.split(".")[:-1])
+        for class_fqn in session.class_hierarchy.resolve_class_names(requested_class):
+            if session.class_hierarchy.declares_concrete(class_fqn, method_name_only):
+                break  # Implemented in the requested class itself
+            dispatch_classes = session.class_hierarchy.dispatch_targets(class_fqn, method_name_only)
+            for target_class_fqn in dispatch_classes:
+                target_file_path = os.path.join(repo_path, session.class_hierarchy.class_file(target_class_fqn))
+                found_method = search_method_in_file(target_file_path, method_name_only, repo_path)
+                if found_method:
+                    session.last_accessed_path = target_file_path
+                    other_classes = [c for c in dispatch_classes if c != target_class_fqn]
+                    if other_classes:
+                        found_method = f"# {class_fqn}.{method_name_only} is implemented in {target_class_fqn} (also in: {', '.join(other_classes)})\n\n{found_method}"
+                    trace_resolution("class_hierarchy")
+                    return found_method
+
     # If not in source_code_dict, search method in the last_accessed_path
-    if method_name_only[0].islower() and last_accessed_path:
-        found_method = search_method_in_file(last_accessed_path, method_name_only, repo_path)
+    if method_name_only[0].islower() and session.last_accessed_path:
+        found_method = search_method_in_file(session.last_accessed_path, method_name_only, repo_path)
         if found_method:
+            trace_resolution("last_accessed_path")
             return found_method
         else:
             # The file path might be wrong, search the correct file path
@@ -190,65 +518,81 @@ def find_method_with_javalang(method_name, codebase_dirs, repo_path):
                 if correct_file_path:
                     found_method = search_method_in_file(correct_file_path, method_name_only, repo_path)
                     if found_method:
-                        last_accessed_path = correct_file_path
+                        session.last_accessed_path = correct_file_path
+                        trace_resolution("class_file_search")
                         return found_method
 
     
     # If still not found, attempt caller method resolution
-    calling_method = resolve_caller_method(method_name_only, last_accessed_path)
-    if calling_method and last_accessed_path:
-        new_class_name = calling_method.split(".")[0]
-        # Replace the old class name in the path with the new one
-        dir_path, old_file_name = os.path.split(last_accessed_path)
-        new_file_path = os.path.join(dir_path, f"{new_class_name}.java")
+    calling_method = resolve_caller_method(method_name_only, session.last_accessed_path)
+    if calling_method and session.last_accessed_path:
+        owner_fqn = calling_method.rsplit(".", 1)[0]
+        new_file_path = find_class_file_by_fqn(owner_fqn, codebase_dirs)
+        if not new_file_path:
+            # Replace the old class name in the path with the new one
+            dir_path, old_file_name = os.path.split(session.last_accessed_path)
+            new_file_path = os.path.join(dir_path, f"{simple_class_name(owner_fqn)}.java")
         # Search method in the new path
         found_method = search_method_in_file(new_file_path, method_name_only, repo_path)
         if found_method:
-            last_accessed_path = new_file_path
+            session.last_accessed_path = new_file_path
+            trace_resolution("caller_resolution")
             return found_method
         
     # If the requested method name starts with upper case, it requested full class
     if method_name_only[0].isupper():
-        if last_accessed_path:
+        if session.last_accessed_path:
             # Replace the old class name in the path with the new one
-            dir_path, old_file_name = os.path.split(last_accessed_path)
+            dir_path, old_file_name = os.path.split(session.last_accessed_path)
             new_file_path = os.path.join(dir_path, f"{method_name_only}.java")
-            # Access full content
+            # Access the class [skeleton first; members and line windows through Provide Class Page]
             if os.path.exists(new_file_path):
-                try:
-                    with open(new_file_path, 'r') as f:
-                        content = f.read()
-                        new_class_key = new_file_path.replace(repo_path + '/', '').replace('/', '.')
-                        new_class_key = new_class_key[:-5]
-                        method_cache[new_class_key] = [content]
-                        method_extracted_successfully = True
-                        last_accessed_path = new_file_path
-                        return content
-                except Exception as e:
-                        print(f"Error extracting class content from {new_file_path}: {e}")
+                new_class_key = new_file_path.replace(repo_path + '/', '').replace('/', '.')
+                new_class_key = new_class_key[:-5]
+                class_content = provide_class_content(new_file_path, new_class_key)
+                if class_content:
+                    session.last_accessed_path = new_file_path
+                    trace_resolution("class_file_guess")
+                    return class_content
             else:
                 # If the file path is wrong, search for the correct file
                 correct_file_path = find_class_file(method_name_only, codebase_dirs)
                 if correct_file_path:
-                    try:
-                        with open(correct_file_path, 'r') as f:
-                            content = f.read()
-                            correct_class_key = correct_file_path.replace(repo_path + '/', '').replace('/', '.')
-                            correct_class_key = correct_class_key[:-5]
-                            method_cache[correct_class_key] = [content]
-                            method_extracted_successfully = True
-                            last_accessed_path = correct_file_path
-                            return content
-                    except Exception as e:
-                        print(f"Error extracting class content from {correct_file_path}: {e}")
+                    correct_class_key = correct_file_path.replace(repo_path + '/', '').replace('/', '.')
+                    correct_class_key = correct_class_key[:-5]
+                    class_content = provide_class_content(correct_file_path, correct_class_key)
+                    if class_content:
+                        session.last_accessed_path = correct_file_path
+                        trace_resolution("class_file_search")
+                        return class_content
                 else:
                     print(f"Class file {method_name_only}.java not found in the codebase.")
 
 
-    method_cache[method_name] = "[Method not found in codebase]"
+    session.method_cache[method_name] = "[Method not found in codebase]"
+    trace_resolution("not_found")
     return "[Method not found in codebase]"
 
 
+# Response to a class request: its skeleton with line spans [or the whole file with page_class_requests off]
+def provide_class_content(file_path, class_key):
+    session = current_session()
+    try:
+        with open(file_path, 'r') as f:
+            content = f.read()
+        if page_class_requests:
+            content = (
+                f"# Class Outline: {class_key}\n{class_outline(content, parse_java(content))}\n\n"
+                f"# Use Provide Class Page with `{{class}}#{{member}}` for a member's source or `{{class}}:{{start}}-{{end}}` for a line window."
+            )
+    except Exception as e:
+        print(f"Error extracting class content from {file_path}: {e}")
+        return None
+    session.method_cache[class_key] = [content]
+    session.method_extracted_successfully = True
+    return content
+
+
 def find_class_file(class_name, codebase_dirs):
     """
     Searches for a Java file with the given class name inside the provided codebase directories.
@@ -265,35 +609,56 @@ def find_class_file(class_name, codebase_dirs):
     return None  # File not found
 
 
+# Frame lines of the current stack trace: (file name, method) -> line of the top-most frame
+def parse_frame_lines(stack_trace):
+    frame_lines = {}
+    for class_method, file_name, line_number in re.findall(r"at (.+?)\((.+?):(\d+)\)", str(stack_trace)):
+        frame_lines.setdefault((os.path.basename(file_name), class_method.rsplit(".", 1)[-1]), int(line_number))
+    return frame_lines
+
+
 # Search for a method inside a Java file
 def search_method_in_file(file_path, method_name, repo_path):
-    global method_extracted_successfully
+    session = current_session()
     try:
         with open(file_path, 'r') as f:
             content = f.read()
-            tree = javalang.parse.parse(content)
+            tree = parse_java(content)
             class_name = file_path.replace(repo_path + '/', '').replace('/', '.')
             class_name = class_name[:-5]
             
             class_skeleton = None
             # Store class skeleton if not cached
-            if class_name not in class_skeleton_cache:
+            if class_name not in session.class_skeleton_cache:
                 class_skeleton = extract_class_skeleton(tree)
-                class_skeleton_cache[class_name] = class_skeleton
-            
-            for _, method in tree.filter(javalang.tree.MethodDeclaration):
-                if method.name == method_name:
-                    found_method = extract_method_code(content, method.position)
-                    
-                    # Cache the method
-                    method_key = f"{class_name}.{method_name}"
-                    if class_skeleton:
-                        method_cache[method_key] = found_method
-                        found_method = f"# Class Skeleton: {class_skeleton}\n\n# Requested Method: {found_method}"
-                    else:
-                        method_cache[method_key] = found_method
-                    method_extracted_successfully = True
-                    return found_method
+                session.class_skeleton_cache[class_name] = class_skeleton
+
+            found_method = None
+            # A stack frame in this file names the exact line: pick the enclosing overload (lambda$/access$ frames
+            # resolve to the method declaring them)
+            frame_line = session.stack_frame_lines.get((os.path.basename(file_path), method_name))
+            if frame_line is not None:
+                enclosing = build_method_line_index(content, tree).enclosing_method(frame_line)
+                if enclosing is not None and enclosing.kind == "method" and (enclosing.name == method_name or "$" in method_name):
+                    method_name = enclosing.name
+                    found_method = interval_source(content, enclosing)
+
+            if found_method is None:
+                for _, method in tree.filter(javalang.tree.MethodDeclaration):
+                    if method.name == method_name:
+                        found_method = extract_method_code(content, method.position)
+                        break
+
+            if found_method is not None:
+                # Cache the method
+                method_key = f"{class_name}.{method_name}"
+                if class_skeleton:
+                    session.method_cache[method_key] = found_method
+                    found_method = f"# Class Skeleton: {class_skeleton}\n\n# Requested Method: {found_method}"
+                else:
+                    session.method_cache[method_key] = found_method
+                session.method_extracted_successfully = True
+                return found_method
     except Exception as e:
         print(f"Error parsing file {file_path}: {e}")
     return None
@@ -301,35 +666,37 @@ def search_method_in_file(file_path, method_name, repo_path):
 
 # Resolve the caller method for a given method
 def resolve_caller_method(method_name, file_path):
+    """
+    Finds an invocation of method_name in file_path and returns '{owner FQN}.{method_name}',
+    resolving the qualifier through the file's symbol table (locals, parameters, fields, imports).
+    """
     try:
         with open(file_path, 'r') as f:
             content = f.read()
-            tree = javalang.parse.parse(content)
-
-            for _, call in tree.filter(javalang.tree.MethodInvocation):
-                if call.member == method_name:
-                    if call.qualifier:
-                        if call.qualifier[0].isupper():  # Ensure it's a class name
-                            return f"{call.qualifier}.{method_name}"
-                        elif call.qualifier[0].islower():  # It's likely an object, resolve its class type
-                            class_type = resolve_variable_type_with_javalang(call.qualifier, tree)
-                            if class_type:
-                                return f"{class_type}.{method_name}"
+            tree = parse_java(content)
+            symbols = build_symbol_table(tree)
+
+            # Every invocation in file order: methods, constructors, field initializers and initializer blocks
+            for path, call in tree.filter(javalang.tree.MethodInvocation):
+                if call.member == method_name and call.qualifier:
+                    owner_fqn = symbols.resolve_call_owner(call, symbols.scope_at(path))
+                    if owner_fqn:
+                        return f"{owner_fqn}.{method_name}"
 
     except Exception as e:
         print(f"Error resolving caller method in {file_path}: {e}")
     return None
 
 
-def resolve_variable_type_with_javalang(variable_name, tree):
+def find_class_file_by_fqn(class_fqn, codebase_dirs):
     """
-    Resolves the class type of a given variable by analyzing the AST with javalang.
+    Looks up the .java file of a fully qualified class name directly under the codebase directories.
     """
-    for path, local_var in tree.filter(javalang.tree.LocalVariableDeclaration):
-        for declarator in local_var.declarators:
-            if declarator.name == variable_name:
-                if hasattr(local_var.type, 'name'):
-                    return local_var.type.name
+    relative_class_path = top_level_class(class_fqn).replace(".", "/") + ".java"
+    for base_dir in codebase_dirs:
+        possible_path = os.path.join(base_dir, relative_class_path)
+        if os.path.exists(possible_path):
+            return possible_path
     return None
 
 
@@ -366,38 +733,189 @@ def extract_method_code(file_content, position):
 
 
 
+def normalize_tool_input(text):
+    return text.strip().replace("'", "").replace('"', '').replace("`", "")
+
+
 @tool
 def provide_method(method_name):
     """
     Provide the source code for a specific method given its name.
     """
-    method_name = method_name.strip().replace("'", "").replace('"', '').replace("`", "")
-    method_code = find_method_with_javalang(method_name, codebase_dirs, repo_path)
+    method_name = normalize_tool_input(method_name)
+    session = current_session()
+    with session.trace_step("Provide Method", method_name):
+        method_code = find_method_with_javalang(method_name, session.codebase_dirs, session.repo_path)
+        trace_result(method_code)
+        session.prefetch_callees(method_name)
     print("------- provide_method (start) ----------")
     print(f"Method '{method_name}' provided.")
     # print(method_code)
     print("------- provide_method (end) ----------")
-    return method_code
+    return session.compact(method_code)
 
 
 
 
-def count_tokens(text, model="gpt-4o-mini"):
-    encoder = tiktoken.encoding_for_model(model)
-    return len(encoder.encode(text))
+# Structural facts of a method for the single-LLM mode: resolved callees and exceptions, from one javalang parse
+def method_structure_facts(file_path, method_name):
+    facts = {"callees": [], "declared_throws": [], "thrown": [], "caught": []}
+
+    def add(kind, value):
+        if value and value not in facts[kind]:
+            facts[kind].append(value)
+
+    try:
+        with open(file_path, 'r') as f:
+            tree = parse_java(f.read())
+        symbols = build_symbol_table(tree)
+        for _, method in tree.filter(javalang.tree.MethodDeclaration):
+            if method.name != method_name:
+                continue
+            scope = symbols.scope_of(method)
+            for path, call in method.filter(javalang.tree.MethodInvocation):
+                # Chained calls (new Foo().bar(), a.b().c()) are selectors of another expression: owner unknown
+                chained = any(call in (getattr(node, 'selectors', None) or []) for node in path if isinstance(node, javalang.ast.Node))
+                owner = None if chained else symbols.resolve_call_owner(call, scope) or call.qualifier
+                add("callees", f"{owner}.{call.member}" if owner else call.member)
+            for exception in method.throws or []:
+                add("declared_throws", exception)
+            for _, statement in method.filter(javalang.tree.ThrowStatement):
+                if isinstance(statement.expression, javalang.tree.ClassCreator):
+                    add("thrown", type_name(statement.expression.type))
+            for _, clause in method.filter(javalang.tree.CatchClause):
+                for exception in clause.parameter.types:
+                    add("caught", exception)
+    except Exception as e:
+        print(f"Error extracting structural facts from {file_path}: {e}")
+    return facts
+
+
+def format_structural_analysis(method_name, method_body, facts):
+    """
+    Tool response of the single-LLM mode: the code plus its structural facts, left for the agent itself to analyze.
+    """
+    none = "(none)"
+    return (
+        f"Method: {method_name}\n"
+        f"Source Code:\n{method_body}\n\n"
+        f"# Structural facts\n"
+        f"- Callees (request the relevant ones next): {', '.join(facts['callees']) or none}\n"
+        f"- Declared throws: {', '.join(facts['declared_throws']) or none}\n"
+        f"- Thrown in body: {', '.join(facts['thrown']) or none}\n"
+        f"- Caught: {', '.join(facts['caught']) or none}\n"
+    )
+
+
+# Upper bound on methods returned by one `Provide Methods` call; the rest are left for the next batch
+MAX_METHODS_PER_BATCH = 8
+ALREADY_ACCESSED_NOTE = "# You have already accessed this."
+
+
+def split_method_names(method_names):
+    """
+    Splits a batch request ("a.B.c, d.E.f", one per line, or a JSON-style list) into method names, in order.
+    """
+    names = []
+    for name in re.split(r"[,;\s]+", method_names.strip().strip("[]")):
+        name = name.strip().strip("'\"`")
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+@tool
+def provide_methods(method_names):
+    """
+    Provide the source code for several methods at once given a comma-separated list of their names.
+    """
+    session = current_session()
+    names = split_method_names(method_names)
+    sections = []
+    for name in names[:MAX_METHODS_PER_BATCH]:
+        with session.trace_step("Provide Methods", name):
+            method_code = find_method_with_javalang(name, session.codebase_dirs, session.repo_path)
+            trace_result(method_code)
+            if method_code.startswith(ALREADY_ACCESSED_NOTE):
+                # Already in the conversation: do not repeat the body
+                method_code = "[Already retrieved earlier; refer to the previous result]"
+            else:
+                session.prefetch_callees(name)
+        sections.append(f"## {name}\n{session.compact(method_code)}")
+    if len(names) > MAX_METHODS_PER_BATCH:
+        sections.append(f"## Not retrieved (batch limit {MAX_METHODS_PER_BATCH}): {', '.join(names[MAX_METHODS_PER_BATCH:])}")
+    print("------- provide_methods (start) ----------")
+    print(f"Methods {names} provided.")
+    print("------- provide_methods (end) ----------")
+    return "\n\n".join(sections)
 
-# This model's maximum context length is 128000 tokens
-def split_into_chunks(text, max_tokens=100000, model="gpt-4o-mini"):
-    encoder = tiktoken.encoding_for_model(model)
-    tokens = encoder.encode(text)
-    
-    chunks = []
-    for i in range(0, len(tokens), max_tokens):
-        chunk_tokens = tokens[i:i+max_tokens]
-        chunk_text = encoder.decode(chunk_tokens)
-        chunks.append(chunk_text)
-    
-    return chunks
+
+PAGE_REQUEST_PATTERN = re.compile(r"^(?P<class_name>[\w.$]+?)(?:#(?P<member>[\w$<>]+)|:(?P<start>\d+)\s*-\s*(?P<end>\d+))$")
+
+
+@tool
+def provide_class_page(page_request):
+    """
+    Provide one member (`{class}#{member}`) or a line window (`{class}:{start}-{end}`) of a class.
+    """
+    session = current_session()
+    with session.trace_step("Provide Class Page", page_request.strip()):
+        page = find_class_page(page_request)
+        trace_result(page)
+        return session.compact(page)
+
+
+def find_class_page(page_request):
+    session = current_session()
+    page_request = normalize_tool_input(page_request).replace(" ", "")
+    match = PAGE_REQUEST_PATTERN.match(page_request)
+    if not match:
+        return "Invalid format. Please request a page as `{package}.{class}#{member}` or `{package}.{class}:{start}-{end}`."
+
+    class_name = match.group("class_name")
+    file_path = find_class_file_by_fqn(class_name, session.codebase_dirs) or find_class_file(simple_class_name(top_level_class(class_name)), session.codebase_dirs)
+    if not file_path:
+        trace_resolution("not_found")
+        return f"[Class {class_name} not found in codebase]"
+    try:
+        with open(file_path, 'r') as f:
+            content = f.read()
+    except Exception as e:
+        print(f"Error reading class page from {file_path}: {e}")
+        return f"[Class {class_name} not found in codebase]"
+
+    session.last_accessed_path = file_path
+    class_key = file_path.replace(session.repo_path + '/', '')[:-5].replace('/', '.')
+    if match.group("member"):
+        member = match.group("member")
+        page = class_member(content, member)
+        if page is None:
+            trace_resolution("not_found")
+            return f"[Member {member} not found in {class_name}]"
+        page_key = f"{class_key}.{member}"
+        session.prefetch_callees(f"{class_name}.{member}")
+    else:
+        start, end = int(match.group("start")), int(match.group("end"))
+        page = class_page(content, start, end)
+        page_key = f"{class_key}:{start}-{end}"
+    trace_resolution("class_member" if match.group("member") else "class_lines")
+    session.method_cache[page_key] = page
+    session.method_extracted_successfully = True
+    print("------- provide_class_page (start) ----------")
+    print(f"Page '{page_request}' provided.")
+    print("------- provide_class_page (end) ----------")
+    return page
+
+
+# Merges the analyses of a method that had to be split into several prompts
+CHUNKED_ANALYSIS_REDUCE_PROMPT = """
+The method below was too large for one request, so it was analyzed in parts. Merge the partial analyses into a single answer.
+Keep the same output format: either the next methods to request in fully qualified format `{{package}}.{{class}}.{{method}}`,
+or an observations summary:
+Observations: "Summary of findings and insights based on analyzed methods."
+
+{partial_results}
+"""
 
 
 @tool
@@ -405,17 +923,32 @@ def analyze_method_and_request_next(input_data):
     """
     Analyze the provided method and determine if further methods are required.
     """
+    with current_session().trace_step("Analyze and Request Next", input_data.strip()):
+        return analyze_method(input_data)
+
+
+def analyze_method(input_data):
     # Normalize input_data
-    input_data = input_data.strip().replace("'","").replace('"', '').replace("`","")
+    input_data = normalize_tool_input(input_data)
     
     # Retrieve the method source code using the cache-aware dynamic retrieval
-    method_body = find_method_with_javalang(input_data, codebase_dirs, repo_path)
+    session = current_session()
+    method_body = find_method_with_javalang(input_data, session.codebase_dirs, session.repo_path)
+    trace_result(method_body)
+    session.prefetch_callees(input_data)
     
     print("------- analyze_method_and_request_next (start) ----------")
     print(f"Method '{input_data}' provided.")
     
     if "Invalid format" in method_body or "[Method not found in codebase]" in method_body:
         return method_body
+    method_body = session.compact(method_body)
+
+    # Single-LLM mode: return code and structural facts; the agent's own reasoning step does the analysis
+    if analysis_mode == "structural":
+        method_name_only = input_data.split("(", 1)[0].rsplit(".", 1)[-1].strip()
+        facts = method_structure_facts(session.last_accessed_path, method_name_only)
+        return format_structural_analysis(input_data, method_body, facts)
     # print(method_body)
     # print("------- analyze_method_and_request_next (end) ----------")
     
@@ -460,24 +993,13 @@ def analyze_method_and_request_next(input_data):
 
     2. **Observations Summary**:
     Observations: "Summary of findings and insights based on analyzed methods."
-
-
-
-    # You are given the stack traces of the bug report below:
-    {stack_trace}
-
-
-    # You are given the agent based chat history below:
-    {chat_history}
-    
-    
-    
-    # You are given the current method below to analyze with the goal of diagnosing the root cause:
-    Method: {input_data}
-    Source Code:
-    {method_body}
-
     """
+    # Per-call inputs last, the one changing least first: every call of a bug shares the prefix up to the chat history
+    template = cacheable_template(template, [
+        ("You are given the stack traces of the bug report below", "{stack_trace}"),
+        ("You are given the agent based chat history below", "{chat_history}"),
+        ("You are given the current method below to analyze with the goal of diagnosing the root cause", "Method: {input_data}\nSource Code:\n{method_body}"),
+    ])
 
     # Non-META Prompt
     # template = """
@@ -514,41 +1036,39 @@ def analyze_method_and_request_next(input_data):
     # """
 
 
-    # Handle Max Token limit exceed cases
-    # Format the full prompt
-    full_prompt = template.format(
-        stack_trace=stack_trace, 
-        chat_history=chat_history, 
-        input_data=input_data, 
-        method_body=method_body
-    )
-
-    # Check token count
-    token_count = count_tokens(full_prompt)
-
-    if token_count > 100000:
-        print(f"Token count ({token_count}) exceeds limit! Splitting into chunks...")
-        prompt_chunks = split_into_chunks(full_prompt, max_tokens=100000)
-
-        responses = []
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
-        for chunk in prompt_chunks:
-            response = llm.invoke(chunk)
-            responses.append(response)
-
-        return "\n".join(responses)
+    # Handle Max Token limit exceed cases: measure each prompt section and trim the largest ones
+    # (oldest chat history first) so the prompt fits one call
+    budget = PromptBudget.for_template(template)
+    sections = {'stack_trace': session.stack_trace, 'chat_history': session.chat_history.render(), 'input_data': input_data, 'method_body': method_body}
+    keep_whole = ('input_data', 'method_body')
+    # The rendered history opens with its facts and summaries and ends with the recent turns: keep both ends
+    keep = {'chat_history': 'middle', 'stack_trace': 'middle'}
+
+    if budget.overflow(sections, keep_whole) > 0:
+        # The method alone does not fit: analyze its chunks concurrently and merge the partial analyses
+        method_chunks = split_into_chunks(method_body, max_tokens=budget.budget // 2)
+        print(f"Method '{input_data}' exceeds the token limit! Analyzing {len(method_chunks)} chunks...")
+        chunk_budget = PromptBudget(budget.template_tokens + budget.budget // 2, budget.budget)
+        context, _ = chunk_budget.fit({'stack_trace': session.stack_trace, 'chat_history': session.chat_history.render()}, keep=keep)
+        prompts = [template.format(input_data=input_data, method_body=chunk, **context) for chunk in method_chunks]
+        try:
+            with traced("llm_seconds"):
+                response = map_reduce(get_gateway().model("gpt-4o-mini"), prompts, CHUNKED_ANALYSIS_REDUCE_PROMPT)
+            print("response:", response)
+            print("------- analyze_method_and_request_next (end) ----------")
+            return response
+        except Exception as e:
+            print(f"Error during chunked LLM execution: {e}")
+            return "Error occurred during method analysis. Please try again."
     else:
-        # Run normally when within token limit
+        # Run in one call, trimming the context sections when needed
+        sections, _ = budget.fit(sections, keep_whole, keep)
         prompt = PromptTemplate.from_template(template)
-        
-        # Configure the LLM
-        llm = ChatOpenAI(model='gpt-4o-mini', temperature=0)
-        chain = LLMChain(llm=llm, prompt=prompt)
 
         try:
-            # Run the LLM chain
-            response = chain.run({'stack_trace': stack_trace, 'chat_history': chat_history, 'input_data': input_data, 'method_body': method_body})
+            # Run through the shared gateway (rate limits, retries, hedging)
+            with traced("llm_seconds"):
+                response = get_gateway().run(prompt, sections, model='gpt-4o-mini')
             print("response:", response)
             print("------- analyze_method_and_request_next (end) ----------")
             return response
@@ -563,6 +1083,10 @@ def analyze_method_and_request_next(input_data):
 
 
 
+# Verbatim chat-history window of the final report, relative to chat_history_recent_tokens
+FINAL_REPORT_HISTORY_SCALE = 3
+
+
 def generate_final_bug_report(method_cache, dev_written_bug_report):
     """Generate the final bug report based on analyzed methods."""
     # print("------------------- generate final bug report (start) --------------")
@@ -630,26 +1154,12 @@ def generate_final_bug_report(method_cache, dev_written_bug_report):
     - If certain fields cannot be improved due to insufficient data, retain the original content.
     - Keep responses **concise, structured, and fact-based**.
     - The final output should **strictly** follow the JSON format above.
-
-
-
-
-    # You are given the **Original Bug Report** below:
-
-    {bug_report}
-
-
-
-    # You are given the **Agent-Based Chat History** below:
-
-    {chat_history}
-
-
-
-    # You are given the **Source Code Methods** below:
-
-    {analyzed_methods}
     '''
+    template = cacheable_template(template, [
+        ("You are given the **Original Bug Report** below", "{bug_report}"),
+        ("You are given the **Agent-Based Chat History** below", "{chat_history}"),
+        ("You are given the **Source Code Methods** below", "{analyzed_methods}"),
+    ])
 
 
     # Non-META Prompt
@@ -704,26 +1214,29 @@ def generate_final_bug_report(method_cache, dev_written_bug_report):
     
 
     prompt = PromptTemplate.from_template(template)
-    llm = ChatOpenAI(model='gpt-4o-mini', temperature = 0)
-
-    chain = LLMChain(llm=llm, prompt=prompt)
-    if method_extracted_successfully:
-        return chain.run({'bug_report': dev_written_bug_report, 'chat_history': chat_history, 'analyzed_methods': method_cache})
-    else:
-        return chain.run({'bug_report': dev_written_bug_report, 'chat_history': chat_history, 'analyzed_methods': source_code_dict})
+    session = current_session()
+    # The final report gets a wider verbatim window than the per-step analysis
+    chat_history = session.chat_history.render(recent_tokens=FINAL_REPORT_HISTORY_SCALE * chat_history_recent_tokens)
+    # Most relevant methods first (stack frames, then lexical overlap with the report), within the context budget
+    methods = method_cache if session.method_extracted_successfully else session.source_code_dict
+    analyzed_methods, packed = pack_methods(methods, dev_written_bug_report, session.stack_trace, final_report_context_tokens,
+                                            compact_code, elide_log_statements)
+    session.compaction_tokens_saved += packed["tokens_saved"]
+    if packed["omitted"]:
+        print(f"Final report context: {len(packed['included'])} methods packed ({packed['tokens']} tokens), {len(packed['omitted'])} omitted")
+    with traced("llm_seconds"):
+        return get_gateway().run(prompt, {'bug_report': dev_written_bug_report, 'chat_history': chat_history, 'analyzed_methods': analyzed_methods}, model='gpt-4o-mini')
 
 # Tools for the agent
 tools = [
     # Tool(name="Parse Stack Trace", func=parse_stack_trace, description="Extract stack traces from the input JSON."),
     Tool(name="Provide Method", func=provide_method, description="Use this to request specific methods from the source code."),
+    Tool(name="Provide Methods", func=provide_methods, description="Use this to request several methods from the source code in one step: a comma-separated list of fully qualified method names. Prefer it over repeated Provide Method calls when you already know the next methods to inspect."),
+    Tool(name="Provide Class Page", func=provide_class_page, description="Class requests return an outline with member signatures and line spans. Use this to fetch one member as `{package}.{class}#{member}` or a line window as `{package}.{class}:{start}-{end}`."),
     Tool(name="Analyze and Request Next", func=analyze_method_and_request_next, description="Use this to analyze the provided method and determine if more methods are needed.")
     # Tool(name="Generate Final Bug Report", func=generate_final_bug_report, description="Generate the final bug report using analyzed methods.")
 ]
 
-# Initialize LLM
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
-
 # System Prompt for two tools
 system_prompt = """
 You are an intelligent assistant specialized in analyzing stack traces and source code to diagnose the root cause of issues. 
@@ -732,6 +1245,8 @@ Your goal is to iteratively analyze methods, extract insights, and ensure effici
 # Guidelines
 - **Tools Available**:
   - `provide_method`: Retrieves methods from the source code based on the call dependency of stack traces.
+  - `provide_methods`: Retrieves several methods in one step from a comma-separated list of fully qualified names. **Batch the methods you already know you need** (e.g., all stack-trace frames, or every callee of interest) instead of requesting them one by one.
+  - `provide_class_page`: Requesting a class returns its outline (fields, member signatures and line spans) rather than the whole file; use this to fetch a single member (`{{package}}.{{class}}#{{member}}`) or a line window (`{{package}}.{{class}}:{{start}}-{{end}}`).
   - `analyze_method_and_request_next`: Analyzes a method and requests additional methods from the call dependency if needed.
 - **Tracking Requested Methods**:
   - Keep track of all previously requested methods.
@@ -739,7 +1254,7 @@ Your goal is to iteratively analyze methods, extract insights, and ensure effici
   - If additional analysis is needed, refer to previous findings instead of making redundant requests.
 - **Iterative Process**:
   1. Start by analyzing the stack traces to identify the first method to request.
-  2. Use `provide_method` to obtain the required method in fully qualified format (`{{package}}.{{class}}.{{method}}`).
+  2. Use `provide_method` to obtain the required method in fully qualified format (`{{package}}.{{class}}.{{method}}`), or `provide_methods` to obtain several at once.
   3. Analyze the retrieved method using `analyze_method_and_request_next`.
   4. Based on the analysis, request additional methods from the call dependency if needed.
   5. Repeat this process until enough information is gathered to diagnose the root cause.
@@ -783,143 +1298,75 @@ Your goal is to iteratively analyze methods, extract insights, and ensure effici
 # """
 
 
-# Initialize the agent
-agent_executor = initialize_agent(
-    tools=tools,
-    llm=llm,
-    agent="zero-shot-react-description",  
-    verbose=True,
-    system_prompt=system_prompt
-)
+# Initialize the agent [on first use, so the retrieval tools can be imported and replayed without an LLM]
+@lru_cache(maxsize=None)
+def get_agent_executor():
+    # The agent's own calls go through the gateway too: rate limits, retries, adaptive concurrency and hedging
+    llm = get_gateway().langchain_model("gpt-4o-mini")
+    return initialize_agent(
+        tools=tools,
+        llm=llm,
+        agent="zero-shot-react-description",  
+        verbose=True,
+        # AgentBudget stops the loop first; this is only a backstop
+        max_iterations=max_tool_calls_per_bug + 1,
+        system_prompt=system_prompt
+    )
 
 
 # Read input and prepare output data
 input_file = "data/source_code_data/Zookeeper.json"
 output_file = "data/agentic_llm_bug_reports/Zookeeper.json"
+# Raw final-report answers with their parse outcome (parsed, repaired, repair_call, failed)
+raw_responses = RawResponseLog("data/agentic_llm_bug_reports/Zookeeper.raw.jsonl")
 
 # Path to source code and Git repository
 # For Zookeeper.json
 repo_path = "Projects/zookeeper"
 codebase_dirs = ['Projects/zookeeper/src/java/main']
 git_branch = "master"
-
-
-with open(input_file, "r") as file:
-    source_code_data = json.load(file)
-
-# Prepare output data
-output_data = []
-
-for entry in source_code_data:
-    filename = entry['filename']
-    creation_time = entry['creation_time']
-    bug_report = entry['bug_report']
-    stack_trace = entry['stack_trace']
-    source_code_dict = entry['source_code']
-
-
-    # Switch to the appropriate commit
-    commit_version = get_commit_version(creation_time, repo_path, git_branch)
-    print("Commit Version:", commit_version)
-    checkout_to_commit(commit_version, repo_path, git_branch)
-
-    # Cache for storing method definitions
-    method_cache = {}
-    class_skeleton_cache = {}
-    last_accessed_path = None
-    method_extracted_successfully = False # True if method requested by agent can be extracted
-
-
-    # Initialize an empty history object
-    chat_history = []
-
-    # Step 1: Parse the stack trace
-    current_source_code_dict = {}
-    parsed_stack_traces = agent_executor.stream({"input": stack_trace})
-    # print("================ parsed_stack_traces (start) ====================")
-    # print(f"parsed_stack_traces: {parsed_stack_traces} (type: {type(parsed_stack_traces)})")
-
-    # Ensure parsed_stack_traces is iterable and extract traces
-    if isinstance(parsed_stack_traces, dict) or hasattr(parsed_stack_traces, "items"):
-        parsed_stack_traces = list(parsed_stack_traces.values())
-        print("parsed stack traces list:", parsed_stack_traces)
-    # parsed_stack_traces = list(parsed_stack_traces)  # Fully consume the generator
-    # print("================ parsed_stack_traces (end) ====================")
-
-
-    # Step 2: Sequentially request and analyze methods
-    analyzed_methods = {}
-    for trace in parsed_stack_traces:
-        # print("================ trace in parsed_stack_traces (start) ====================")
-        # print(f"Trace: {trace}, Type: {type(trace)}, length: {len(trace)}")
-        # print(isinstance(trace, AddableDict))
-        # print("================ trace in parsed_stack_traces (end) ====================")
-        if isinstance(trace, dict) or isinstance(trace, AddableDict):
-            if 'output' in trace:
-                agent_based_source_code_analysis = trace['output']
-                # print("####################################")
-                # print("agent_based_source_code_analysis:", agent_based_source_code_analysis)
-                
-            if 'messages' in trace and ('output' in trace or 'actions' in trace):
-                agent_based_chat = trace['messages'][0].content
-                chat_history.append(agent_based_chat)
-                # print("chat_history length:", len(chat_history))
-                # print("chat_history:", chat_history)
-                # print("####################################")
-            
-        else:
-            print(f"Unexpected trace format: {trace}")
-            continue
-        
-
-
-    # Step 3: Generate the final bug report
-    try:
-        # Manually trigger the final bug report generation
-        final_bug_report = generate_final_bug_report(method_cache, bug_report)
-        print("####################################")
-        print("Final bug report called manually:", final_bug_report)
-        # print("method_cache:", method_cache)
-        print("####################################")
-
-        # Parse and include the generated bug report
-        bug_report = json.loads(final_bug_report.replace("```json\n", "").replace("\n```", ""))
-
-    except Exception as e:
-        print(f"Error generating final bug report: {e}")
-
-
-
-    # # Parse the bug report JSON from the generated string
-    # try:
-    #     # Remove any markdown-style code block indicators (` ```json `) if present
-    #     bug_report = json.loads(final_bug_report.replace("```json\n", "").replace("\n```", ""))
-    # except json.JSONDecodeError:
-    #     print(f"Failed to parse JSON for filename: {filename}")
-    #     continue  # Skip this entry if JSON parsing fails
-
-
-
-    # Add to output data
-    output_data.append({
-        "filename": filename,
-        "creation_time": creation_time,
-        "analyzed_methods": method_cache,
-        "class_skeleton_cache": class_skeleton_cache,
-        "chat_history": chat_history,
-        "method_extracted_successfully": method_extracted_successfully,
-        "bug_report": bug_report
-    })
-
-    # Write to output file after each bug report
-    with open(output_file, "w") as outfile:
-        json.dump(output_data, outfile, indent=4)
-    print(f"Progress saved to {output_file}")
-
-
-# # Write output JSON file
-# with open(output_file, "w") as outfile:
-#     json.dump(output_data, outfile, indent=4)
-
-
-print(f"Bug reports have been generated and saved to '{output_file}'")
+# Resolve interface/abstract method requests through the per-commit class hierarchy (Projects/.index/<repo>/<commit>)
+use_class_hierarchy_index = False
+
+
+# "llm": Analyze and Request Next runs its own LLM call; "structural": it returns code plus callees/exceptions
+# and leaves the analysis to the agent (one LLM call per step)
+analysis_mode = "llm"
+# Chat history kept verbatim in prompts, in tokens; older turns are rendered as summaries and extracted facts
+chat_history_recent_tokens = 6000
+# Source code of the final report prompt, in tokens (context_packer keeps the most relevant methods)
+final_report_context_tokens = 40000
+# Strip comments, Javadoc and indentation from the code in tool results and the final report (source_compaction
+# keeps line structure, so numbered class pages and frame lines still line up); elide_log_statements also drops
+# trace/debug/info log calls
+compact_code = False
+elide_log_statements = False
+# Class requests return an outline with line spans (members/line windows via Provide Class Page) instead of the whole file
+page_class_requests = True
+# Warm the callees of every retrieved method from the per-commit call graph while the agent waits on the LLM
+use_method_prefetch = False
+# Write per-step trace records (resolution path, cache hit, parse time, LLM latency and tokens) to <output_file>.traces/
+trace_agent_steps = True
+# Per-bug budgets: the agent loop stops and the final report is generated once one is spent, or when
+# max_steps_without_new_methods retrieval steps in a row resolve no new method (re-requests, names not in the codebase)
+max_tool_calls_per_bug = 15
+max_wall_seconds_per_bug = 600
+max_tokens_per_bug = 250000
+max_steps_without_new_methods = 3
+# Bugs analyzed concurrently [each session reads from a worktree of its commit under Projects/.worktrees]
+max_concurrent_sessions = 4
+
+if __name__ == "__main__":
+    with open(input_file, "r") as file:
+        source_code_data = json.load(file)
+
+    output_data = asyncio.run(run_agent_sessions(source_code_data, repo_path, codebase_dirs, git_branch, output_file, max_concurrent_sessions, use_class_hierarchy_index, use_method_prefetch, f"{output_file}.traces" if trace_agent_steps else None))
+
+    print(f"Bug reports have been generated and saved to '{output_file}'")
+    print(f"Parsed final reports: {raw_responses.summary()}")
+    stats = [entry["agent_stats"] for entry in output_data if "agent_stats" in entry]
+    prompt_tokens = sum(entry["prompt_tokens"] for entry in stats)
+    if compact_code:
+        print(f"Source compaction saved {sum(entry.get('compaction_tokens_saved', 0) for entry in stats)} prompt tokens")
+    if prompt_tokens:
+        print(f"Prompt prefix cache hit rate: {sum(entry.get('cached_prompt_tokens', 0) for entry in stats) / prompt_tokens:.1%}")
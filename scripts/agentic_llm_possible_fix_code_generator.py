@@ -1,9 +1,13 @@
 # prompt templating and chaining
 from langchain import PromptTemplate
 from langchain_core.prompts import PromptTemplate
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import LLMChain
+from llm_gateway import get_gateway
+from llm_batch import batch_request, run_batch
+from structured_output import FIX_SCHEMA, StructuredOutputError, parse_structured
+from context_packer import pack_methods
+from prompt_layout import cacheable_template, describe_prefix
 import json
+from collections import Counter
 
 
 
@@ -34,35 +38,20 @@ The output should be structured in **valid JSON** as follows:
         "<full method name>": "<The full fixed code here>"
     }}
 }}
-
-
-
-
-
-# You are given the **Agent-Based Bug Report** below:
-
-{bug_report}
-
-
-
-# You are given the **Agent-Based Chat History** below:
-
-{chat_history}
-
-
-
-# You are given the **Source Code Methods** below:
-
-{analyzed_methods}
+```
 '''
 
 
 
 
-prompt = PromptTemplate.from_template(template)
-llm = ChatOpenAI(model='gpt-4o-mini', temperature = 0)
-
-chain = LLMChain(llm=llm, prompt=prompt)
+prompt = PromptTemplate.from_template(cacheable_template(template, [
+    ("You are given the **Agent-Based Bug Report** below", "{bug_report}"),
+    ("You are given the **Agent-Based Chat History** below", "{chat_history}"),
+    ("You are given the **Source Code Methods** below", "{analyzed_methods}"),
+]))
+print(describe_prefix("Fix prompt", prompt.template))
+# Shared gateway: pooled connections, rate limits and retries
+gateway = get_gateway()
 
 
 
@@ -70,6 +59,16 @@ chain = LLMChain(llm=llm, prompt=prompt)
 agent_based_file = "data/agentic_llm_bug_reports/Zookeeper.json"
 fallback_source_file = "data/source_code_data/Zookeeper.json"
 output_file = "data/agentic_llm_possible_fix_full_code/Zookeeper.json"
+# Rendered requests (and their answers, in <name>.results.jsonl) for llm_batch; batch_mode is one of
+# llm_batch.BATCH_MODES: "sequential", "pool" (concurrent gateway calls) or "openai_batch" (Batch API job)
+batch_request_file = "data/batch_requests/agentic_llm_possible_fix_full_code/Zookeeper.jsonl"
+batch_mode = "pool"
+# Tokens of source code per prompt (context_packer ranks the methods by stack frame and relevance to the report)
+context_token_budget = 30000
+# Compact the analyzed methods (source_compaction); elide_log_statements also drops trace/debug/info log calls.
+# Off, as in the direct fix generator: compacted prompts yield compacted fixes, which CodeBLEU penalizes
+compact_code = False
+elide_log_statements = False
 
 
 # Load JSON data from a file
@@ -89,35 +88,52 @@ fallback_data = load_json(fallback_source_file)
 # Create a mapping from filename to bug_report for modified_dev_data
 fallback_map = {item["filename"]: item.get("source_code", {}) for item in fallback_data}
 
-# Prepare the output format
-output_data = []
-
+# Render every prompt up front (none depends on an earlier answer), complete them together, then join by filename
+requests = []
+tokens_saved = []
 for entry in agent_based_data:
     filename = entry['filename']
-    creation_time = entry['creation_time']
     analyzed_methods = entry['analyzed_methods']
-    class_skeleton_cache = entry['class_skeleton_cache']
-    chat_history = entry['chat_history']
-    bug_report = entry["bug_report"]
 
     # Fallback handling
     if all_methods_missing(analyzed_methods):
         # replace with fallback source_code (if available)
         # print('No Methods found!')
         analyzed_methods = fallback_map.get(filename, {})
-    
-    # Generate improved bug report
-    fix_code_str = chain.run({'bug_report': bug_report, 'chat_history': chat_history, 'analyzed_methods': analyzed_methods})
-    
+    # Frames come from the report's stack trace
+    analyzed_methods, packed = pack_methods(analyzed_methods, entry["bug_report"], budget=context_token_budget,
+                                            compact=compact_code, elide_logs=elide_log_statements)
+    tokens_saved.append(packed["tokens_saved"])
 
+    requests.append(batch_request(filename, prompt.format(bug_report=entry["bug_report"], chat_history=entry['chat_history'], analyzed_methods=analyzed_methods), model='gpt-4o-mini'))
+
+if compact_code:
+    print(f"Source compaction saved {sum(tokens_saved)} tokens ({sum(tokens_saved) / max(len(tokens_saved), 1):.0f} per prompt)")
+answers = run_batch(requests, batch_request_file, mode=batch_mode, gateway=gateway)
+print(f"Prompt prefix cache hit rate: {gateway.prefix_cache_hit_rate():.1%}")
+
+# Prepare the output format
+output_data = []
+outcomes = Counter()
 
-    # Parse the bug report JSON from the generated string
+for entry in agent_based_data:
+    filename = entry['filename']
+    creation_time = entry['creation_time']
+    bug_report = entry["bug_report"]
+    fix_code_str = answers.get(filename)
+    if fix_code_str is None:
+        print(f"No response for filename: {filename}")
+        continue
+
+
+    # Parse (and if needed repair) the fix JSON; unparsable answers remain in the batch results file
     try:
-        # Remove any markdown-style code block indicators (` ```json `) if present
-        fix_code_json = json.loads(fix_code_str.replace("```json\n", "").replace("\n```", ""))
-    except json.JSONDecodeError:
-        print(f"Failed to parse JSON for filename: {filename}")
+        fix_code_json, outcome = parse_structured(fix_code_str, FIX_SCHEMA, gateway=gateway)
+    except StructuredOutputError as e:
+        print(f"Failed to parse JSON for filename: {filename} ({e})")
+        outcomes[e.outcome] += 1
         continue  # Skip this entry if JSON parsing fails
+    outcomes[outcome] += 1
 
     
     # Add to output data
@@ -131,14 +147,8 @@ for entry in agent_based_data:
         "possible_fix_code": fix_code_json.get("possible_fix_code")
     })
 
-    # Write to output file after each bug report
-    with open(output_file, "w") as outfile:
-        json.dump(output_data, outfile, indent=4)
-    print(f"Progress saved to {output_file}")
-
-
-# # Write the summarized bug reports to a new JSON file
-# with open(f"{output_file}", "w") as outfile:
-#     json.dump(output_data, outfile, indent=4)
+with open(output_file, "w") as outfile:
+    json.dump(output_data, outfile, indent=4)
+print(f"Parsed responses: {dict(outcomes)}")
 
 print(f"Bug reports have been generated and saved to '{output_file}'")
\ No newline at end of file
@@ -0,0 +1,393 @@
+import os
+import glob
+import pickle
+import hashlib
+import subprocess
+from array import array
+from collections import deque
+import javalang
+from java_symbol_table import build_symbol_table, top_level_class
+from class_hierarchy_index import ClassHierarchyIndex
+
+
+CALL_GRAPH_FORMAT_VERSION = 2
+MAX_CACHED_FILES = 64
+
+
+def snapshot_index_dir(repo_path, commit):
+    """
+    Directory holding the persisted indexes of one commit, e.g. Projects/.index/zookeeper/<commit>.
+    Kept outside the working tree so `git stash push --include-untracked` in checkout_to_commit leaves it alone.
+    """
+    repo_path = os.path.abspath(repo_path)
+    return os.path.join(os.path.dirname(repo_path), ".index", os.path.basename(repo_path), commit)
+
+
+def relative_source_dirs(repo_path, codebase_dirs):
+    """
+    Normalizes codebase_dirs (relative to the working directory) to paths relative to repo_path.
+    """
+    if not codebase_dirs:
+        return []
+    repo_path = os.path.abspath(repo_path)
+    return sorted(os.path.relpath(os.path.abspath(d), repo_path) for d in codebase_dirs)
+
+
+def source_dirs_digest(source_dirs):
+    return hashlib.sha1("\n".join(source_dirs).encode("utf-8")).hexdigest()[:12]
+
+
+def list_java_files(repo_path, source_dirs):
+    """
+    Returns {relative .java path: content signature}. The signature is the git blob id when available,
+    so unchanged files can be reused across commits without reading them.
+    """
+    command = ["git", "ls-files", "-s", "--"] + (list(source_dirs) or ["."])
+    result = subprocess.run(command, capture_output=True, text=True, cwd=repo_path)
+    files = {}
+    if result.returncode == 0 and result.stdout:
+        for line in result.stdout.splitlines():
+            meta, _, path = line.partition("\t")
+            if path.endswith(".java"):
+                files[path] = meta.split()[1]
+        return files
+
+    # Not a git checkout: fall back to size and mtime
+    for source_dir in source_dirs or ["."]:
+        for root, _, names in os.walk(os.path.join(repo_path, source_dir)):
+            for name in names:
+                if name.endswith(".java"):
+                    full_path = os.path.join(root, name)
+                    stat = os.stat(full_path)
+                    files[os.path.relpath(full_path, repo_path)] = f"{stat.st_size}:{stat.st_mtime_ns}"
+    return files
+
+
+def extract_method_code(file_content, position):
+    lines = file_content.splitlines()
+    start_line = position.line - 1 if hasattr(position, 'line') else position - 1
+    method_lines = []
+    open_braces = 0
+    found_method_start = False
+
+    for i in range(start_line, len(lines)):
+        line = lines[i]
+        method_lines.append(line)
+        open_braces += line.count('{')
+        open_braces -= line.count('}')
+        if '{' in line and not found_method_start:
+            found_method_start = True
+        if found_method_start and open_braces == 0:
+            break
+    return "\n".join(method_lines)
+
+
+def parse_file_record(repo_path, relative_path, signature):
+    """
+    Parses one Java file into a picklable record:
+      package, classes (binary FQNs declared in the file), methods [(name, line)],
+      calls [(caller method index, candidate owner FQNs, member name)] and
+      types {class FQN: {"supertypes": [candidate FQNs per extends/implements], "methods": {name: has_body}}}.
+    """
+    record = {"signature": signature, "package": "", "classes": [], "methods": [], "calls": [], "types": {}}
+    try:
+        with open(os.path.join(repo_path, relative_path), "r", encoding="utf-8", errors="replace") as f:
+            content = f.read()
+        tree = javalang.parse.parse(content)
+    except Exception as e:
+        print(f"Error parsing {relative_path}: {e}")
+        return record
+
+    symbols = build_symbol_table(tree)
+    record["package"] = symbols.package
+    record["classes"] = sorted(set(symbols.declared_types.values()))
+    for class_fqn, supertype_names in symbols.supertype_names.items():
+        record["types"][class_fqn] = {
+            "supertypes": [symbols.candidate_type_fqns(name) for name in supertype_names],
+            "methods": symbols.type_methods.get(class_fqn, {})
+        }
+
+    method_index = {}
+    for _, method in tree.filter(javalang.tree.MethodDeclaration):
+        if method.name not in method_index:
+            method_index[method.name] = len(record["methods"])
+            record["methods"].append((method.name, method.position.line if method.position else 0))
+        caller = method_index[method.name]
+        scope = symbols.scope_of(method)
+        for _, call in method.filter(javalang.tree.MethodInvocation):
+            owner = symbols.resolve_call_owner(call, scope)
+            if not owner:
+                continue
+            candidates = [owner]
+            if call.qualifier and "." not in call.qualifier:
+                # Types that are neither imported nor declared here may come from a wildcard import
+                declared = call.qualifier if call.qualifier[0].isupper() else symbols.variable_type(call.qualifier, scope)
+                if declared:
+                    candidates += [c for c in symbols.candidate_type_fqns(declared) if c != owner]
+            record["calls"].append((caller, tuple(candidates), call.member))
+    return record
+
+
+def build_csr(num_nodes, edges):
+    """
+    Builds (offsets, targets) compressed sparse rows from an iterable of (source, target) pairs.
+    """
+    edges = sorted(set(edges))
+    offsets = array('i', [0]) * (num_nodes + 1)
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for node in range(num_nodes):
+        offsets[node + 1] += offsets[node]
+    targets = array('i', (target for _, target in edges))
+    return offsets, targets
+
+
+class CallGraphIndex:
+    """
+    Call graph over every method of one commit, with interned integer method ids.
+
+    Method names use the same key format as `source_code` in data/source_code_data:
+    '{path relative to repo, dotted, without .java}.{method}'. Edges are stored twice as CSR arrays:
+    forward (caller -> callees) and reverse (callee -> callers). Calls through an interface or superclass
+    also get edges to the concrete overrides found in `hierarchy` (virtual dispatch).
+    """
+
+    def __init__(self, commit, source_dirs):
+        self.version = CALL_GRAPH_FORMAT_VERSION
+        self.commit = commit
+        self.source_dirs = list(source_dirs)
+        self.files = {}
+        self.method_names = []
+        self.method_ids = {}
+        self.method_locations = []
+        self.class_files = {}
+        self.hierarchy = None
+        self.forward_offsets = array('i', [0])
+        self.forward_targets = array('i')
+        self.reverse_offsets = array('i', [0])
+        self.reverse_targets = array('i')
+        self._class_method_ids = None
+        self._content_cache = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_class_method_ids"] = None
+        state["_content_cache"] = {}
+        return state
+
+    # ---------------------------------------------------------------- linking
+
+    def link(self):
+        """
+        Interns method ids and resolves every recorded call to a method id, then rebuilds both CSR arrays.
+        """
+        self.method_names = []
+        self.method_ids = {}
+        self.method_locations = []
+        self.class_files = {}
+        file_method_ids = {}
+
+        for relative_path in sorted(self.files):
+            record = self.files[relative_path]
+            prefix = relative_path[:-5].replace("/", ".").replace(os.sep, ".")
+            ids = []
+            for name, line in record["methods"]:
+                key = f"{prefix}.{name}"
+                if key not in self.method_ids:
+                    self.method_ids[key] = len(self.method_names)
+                    self.method_names.append(key)
+                    self.method_locations.append((relative_path, line))
+                ids.append(self.method_ids[key])
+            file_method_ids[relative_path] = ids
+            for class_fqn in record["classes"]:
+                self.class_files.setdefault(top_level_class(class_fqn), relative_path)
+
+        self.hierarchy = ClassHierarchyIndex(self.files)
+
+        edges = []
+        for relative_path, record in self.files.items():
+            ids = file_method_ids[relative_path]
+            for caller, candidates, member in record["calls"]:
+                for owner in candidates:
+                    targets = [self.method_id_in_class(c, member) for c in self.hierarchy.dispatch_targets(owner, member)]
+                    targets = [t for t in targets if t is not None]
+                    if not targets:
+                        target = self.method_id_in_class(owner, member)
+                        targets = [target] if target is not None else []
+                    if targets:
+                        edges.extend((ids[caller], target) for target in targets)
+                        break
+
+        num_methods = len(self.method_names)
+        self.forward_offsets, self.forward_targets = build_csr(num_methods, edges)
+        self.reverse_offsets, self.reverse_targets = build_csr(num_methods, ((t, s) for s, t in edges))
+        self._class_method_ids = None
+
+    # ----------------------------------------------------------------- lookup
+
+    def __len__(self):
+        return len(self.method_names)
+
+    def class_file(self, class_fqn):
+        return self.class_files.get(top_level_class(class_fqn))
+
+    def method_id(self, method_key):
+        return self.method_ids.get(method_key)
+
+    def method_id_in_class(self, class_fqn, method_name):
+        """
+        Id of method_name declared in the file of class_fqn (an Outer$Inner binary name is mapped to its file).
+        """
+        relative_path = self.class_file(class_fqn)
+        if relative_path is None:
+            return None
+        return self.method_ids.get(f"{relative_path[:-5].replace('/', '.')}.{method_name}")
+
+    def method_ids_by_class_method(self, class_method):
+        """
+        Ids of methods whose key ends with 'Class.method', e.g. the format used in bug report problem_location.
+        """
+        if self._class_method_ids is None:
+            # Built aside and published at once: the index may be shared by concurrent agent sessions
+            class_method_ids = {}
+            for method_id, key in enumerate(self.method_names):
+                short = ".".join(key.rsplit(".", 2)[-2:])
+                class_method_ids.setdefault(short, []).append(method_id)
+            self._class_method_ids = class_method_ids
+        return self._class_method_ids.get(".".join(class_method.rsplit(".", 2)[-2:]), [])
+
+    def callees(self, method_id):
+        return self.forward_targets[self.forward_offsets[method_id]:self.forward_offsets[method_id + 1]]
+
+    def callers(self, method_id):
+        return self.reverse_targets[self.reverse_offsets[method_id]:self.reverse_offsets[method_id + 1]]
+
+    def method_code(self, method_id, repo_path):
+        relative_path, line = self.method_locations[method_id]
+        content = self._content_cache.get(relative_path)
+        if content is None:
+            with open(os.path.join(repo_path, relative_path), "r", encoding="utf-8", errors="replace") as f:
+                content = f.read()
+            if len(self._content_cache) >= MAX_CACHED_FILES:
+                self._content_cache.pop(next(iter(self._content_cache)))
+            self._content_cache[relative_path] = content
+        return extract_method_code(content, line)
+
+    # -------------------------------------------------------------- traversal
+
+    def bfs(self, seeds, max_hops=None, direction="forward"):
+        """
+        Breadth-first search from seed method ids. direction is 'forward' (callees), 'reverse' (callers)
+        or 'both' (undirected). Returns {method id: hop distance}.
+        """
+        adjacency = []
+        if direction in ("forward", "both"):
+            adjacency.append((self.forward_offsets, self.forward_targets))
+        if direction in ("reverse", "both"):
+            adjacency.append((self.reverse_offsets, self.reverse_targets))
+
+        distances = {}
+        queue = deque()
+        for seed in seeds:
+            if seed is not None and seed not in distances:
+                distances[seed] = 0
+                queue.append(seed)
+        while queue:
+            node = queue.popleft()
+            hops = distances[node]
+            if max_hops is not None and hops >= max_hops:
+                continue
+            for offsets, targets in adjacency:
+                for index in range(offsets[node], offsets[node + 1]):
+                    neighbour = targets[index]
+                    if neighbour not in distances:
+                        distances[neighbour] = hops + 1
+                        queue.append(neighbour)
+        return distances
+
+    def hop_distance(self, source_ids, target_ids, max_hops=None):
+        """
+        Fewest caller/callee hops between any source and any target method (undirected), or None.
+        """
+        targets = set(target_ids)
+        if not targets:
+            return None
+        distances = self.bfs(source_ids, max_hops=max_hops, direction="both")
+        reached = [distances[t] for t in targets if t in distances]
+        return min(reached) if reached else None
+
+
+def build_call_graph(repo_path, commit, codebase_dirs=None, previous=None):
+    """
+    Builds the call graph of the checked-out working tree. Files whose signature is unchanged since
+    `previous` (an index of another commit over the same source dirs) are reused without re-parsing.
+    """
+    source_dirs = relative_source_dirs(repo_path, codebase_dirs)
+    index = CallGraphIndex(commit, source_dirs)
+    reused = 0
+    for relative_path, signature in list_java_files(repo_path, source_dirs).items():
+        old_record = previous.files.get(relative_path) if previous is not None else None
+        if old_record is not None and old_record["signature"] == signature:
+            index.files[relative_path] = old_record
+            reused += 1
+        else:
+            index.files[relative_path] = parse_file_record(repo_path, relative_path, signature)
+    index.link()
+    print(f"Call graph for {commit}: {len(index)} methods, {len(index.forward_targets)} edges "
+          f"({len(index.files) - reused} files parsed, {reused} reused)")
+    return index
+
+
+def call_graph_path(repo_path, commit, codebase_dirs=None, index_repo_path=None):
+    """
+    index_repo_path: the main checkout when repo_path is a worktree of it, so worktrees share its indexes.
+    """
+    digest = source_dirs_digest(relative_source_dirs(repo_path, codebase_dirs))
+    return os.path.join(snapshot_index_dir(index_repo_path or repo_path, commit), f"call_graph-{digest}.pkl")
+
+
+def save_call_graph(index, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_call_graph(path):
+    with open(path, "rb") as f:
+        index = pickle.load(f)
+    if getattr(index, "version", None) != CALL_GRAPH_FORMAT_VERSION:
+        return None
+    return index
+
+
+def load_existing_call_graph(repo_path, commit, codebase_dirs=None):
+    """
+    Loads a previously built call graph without touching the working tree; None if it was never built.
+    """
+    path = call_graph_path(repo_path, commit, codebase_dirs)
+    return load_call_graph(path) if os.path.exists(path) else None
+
+
+def load_or_build_call_graph(repo_path, commit, codebase_dirs=None, index_repo_path=None):
+    """
+    Loads the persisted call graph for commit, or builds it (incrementally from the most recently
+    built commit of the same repository and source dirs) and stores it next to the snapshot.
+    The working tree at repo_path must already be checked out at commit when building.
+    """
+    path = call_graph_path(repo_path, commit, codebase_dirs, index_repo_path)
+    if os.path.exists(path):
+        index = load_call_graph(path)
+        if index is not None:
+            return index
+
+    previous = None
+    pattern = os.path.join(os.path.dirname(os.path.dirname(path)), "*", os.path.basename(path))
+    built = sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)
+    if built:
+        previous = load_call_graph(built[0])
+
+    index = build_call_graph(repo_path, commit, codebase_dirs, previous=previous)
+    save_call_graph(index, path)
+    return index
@@ -0,0 +1,123 @@
+import re
+from token_budget import count_tokens, trim_to_tokens
+
+
+# Verbatim window of recent turns and room for the summaries of older ones, in tokens
+DEFAULT_RECENT_TOKENS = 6000
+DEFAULT_SUMMARY_TOKENS = 1500
+# Longest summary kept for one rolled-out turn
+TURN_SUMMARY_TOKENS = 80
+MAX_ROOT_CAUSE_FACTS = 8
+
+ACTION_INPUT_PATTERN = re.compile(r"Action:\s*(?P<action>[^\n]+)\s*\n\s*Action Input:\s*(?P<input>[^\n]+)")
+ROOT_CAUSE_PATTERN = re.compile(r"[^\n]*(?:root cause|Observations:|Final Answer:)[^\n]*", re.IGNORECASE)
+
+
+def extractive_summary(turn, max_tokens=TURN_SUMMARY_TOKENS):
+    """
+    Summary of one agent turn without an LLM call: its requests and conclusions, else its first line.
+    """
+    lines = [f"{match.group('action').strip()}: {match.group('input').strip()}" for match in ACTION_INPUT_PATTERN.finditer(turn)]
+    lines += [match.group(0).strip() for match in ROOT_CAUSE_PATTERN.finditer(turn)]
+    if not lines:
+        lines = [next((line.strip() for line in turn.splitlines() if line.strip()), "")]
+    return trim_to_tokens(" | ".join(lines), max_tokens, keep="head")
+
+
+class ChatHistoryMemory:
+    """
+    Agent chat history whose prompt rendering is token-bounded: the most recent turns are kept verbatim, older
+    turns are rolled into one-line summaries (the oldest summaries are dropped first), and the facts extracted from
+    every turn (methods visited, suspected root causes) are always kept. All turns stay available in `turns` for
+    the output file.
+
+    summarizer(turn) -> str replaces the default extractive summary (e.g. with an LLM call).
+    """
+
+    def __init__(self, recent_tokens=DEFAULT_RECENT_TOKENS, summary_tokens=DEFAULT_SUMMARY_TOKENS, summarizer=extractive_summary):
+        self.recent_tokens = recent_tokens
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer
+        self.turns = []
+        self.methods_visited = []
+        self.suspected_root_causes = []
+        self._turn_tokens = []
+        self._summaries = {}
+
+    def append(self, turn):
+        turn = turn if isinstance(turn, str) else str(turn)
+        self.turns.append(turn)
+        self._turn_tokens.append(count_tokens(turn))
+        self._extract_facts(turn)
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __iter__(self):
+        return iter(self.turns)
+
+    def _extract_facts(self, turn):
+        for match in ACTION_INPUT_PATTERN.finditer(turn):
+            if "Provide" not in match.group("action") and "Analyze" not in match.group("action"):
+                continue
+            for name in re.split(r"[,;\s]+", match.group("input").strip().strip("[]")):
+                name = name.strip("'\"`")
+                if name and name not in self.methods_visited:
+                    self.methods_visited.append(name)
+        for match in ROOT_CAUSE_PATTERN.finditer(turn):
+            fact = trim_to_tokens(match.group(0).strip(), TURN_SUMMARY_TOKENS, keep="head")
+            if fact not in self.suspected_root_causes:
+                self.suspected_root_causes.append(fact)
+        del self.suspected_root_causes[:-MAX_ROOT_CAUSE_FACTS]
+
+    def _summary(self, index):
+        if index not in self._summaries:
+            self._summaries[index] = self.summarizer(self.turns[index])
+        return self._summaries[index]
+
+    def render(self, recent_tokens=None, summary_tokens=None):
+        """
+        Prompt text of the history within about recent_tokens + summary_tokens (plus the facts).
+        """
+        recent_tokens = self.recent_tokens if recent_tokens is None else recent_tokens
+        summary_tokens = self.summary_tokens if summary_tokens is None else summary_tokens
+
+        # Newest turns verbatim while they fit
+        first_recent = len(self.turns)
+        used = 0
+        while first_recent > 0 and used + self._turn_tokens[first_recent - 1] <= recent_tokens:
+            first_recent -= 1
+            used += self._turn_tokens[first_recent]
+        recent = self.turns[first_recent:]
+        if not recent and self.turns:
+            # The newest turn alone is over the window: keep its end
+            first_recent -= 1
+            recent = [trim_to_tokens(self.turns[-1], recent_tokens, keep="tail")]
+
+        # Older turns as summaries, newest first until the summary budget is spent
+        summaries = []
+        used = 0
+        for index in range(first_recent - 1, -1, -1):
+            summary = f"- Turn {index + 1}: {self._summary(index)}"
+            size = count_tokens(summary)
+            if used + size > summary_tokens:
+                summaries.insert(0, f"- ({index + 1} earlier turns omitted)")
+                break
+            summaries.insert(0, summary)
+            used += size
+
+        sections = []
+        if self.methods_visited or self.suspected_root_causes:
+            sections.append(
+                "## Facts so far\n"
+                f"- Methods visited: {', '.join(self.methods_visited) or '(none)'}\n"
+                f"- Suspected root causes: {'; '.join(self.suspected_root_causes) or '(none yet)'}"
+            )
+        if summaries:
+            sections.append("## Summary of earlier turns\n" + "\n".join(summaries))
+        if recent:
+            sections.append("## Recent turns\n" + "\n\n".join(recent))
+        return "\n\n".join(sections)
+
+    def __str__(self):
+        return self.render()
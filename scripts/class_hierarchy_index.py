@@ -0,0 +1,140 @@
+from collections import deque
+
+
+# Interfaces with more concrete implementations than this (e.g. Writable in Hadoop) are too generic to follow
+MAX_DISPATCH_TARGETS = 16
+
+
+def simple_type_name(fqn):
+    return fqn.rsplit(".", 1)[-1].rsplit("$", 1)[-1]
+
+
+class ClassHierarchyIndex:
+    """
+    extends/implements relations of every type declared in one commit, kept as interned class ids with
+    supertype and subtype adjacency lists. Types that are only referenced (e.g. JDK interfaces) are interned
+    too, without a file, so their in-repository implementations are still reachable.
+
+    Built from the per-file records of call_graph_index.parse_file_record:
+      record["types"][class_fqn] = {"supertypes": [[candidate FQNs], ...], "methods": {name: has_body}}
+    """
+
+    def __init__(self, file_records):
+        self.class_names = []
+        self.class_ids = {}
+        self.class_files = []
+        self.declared_methods = []
+        self.supertypes = []
+        self.subtypes = []
+        self.simple_names = {}
+        self._dispatch_cache = {}
+
+        for relative_path in sorted(file_records):
+            for class_fqn, type_info in sorted(file_records[relative_path].get("types", {}).items()):
+                class_id = self._intern(class_fqn)
+                if self.class_files[class_id] is None:
+                    self.class_files[class_id] = relative_path
+                    self.declared_methods[class_id] = dict(type_info["methods"])
+
+        supertypes = [set() for _ in self.class_names]
+        for relative_path in sorted(file_records):
+            for class_fqn, type_info in sorted(file_records[relative_path].get("types", {}).items()):
+                class_id = self.class_ids[class_fqn]
+                for candidates in type_info["supertypes"]:
+                    declared = [c for c in candidates if c in self.class_ids and self.class_files[self.class_ids[c]]]
+                    super_fqn = declared[0] if declared else candidates[0]
+                    super_id = self._intern(super_fqn)
+                    if super_id != class_id:
+                        if super_id >= len(supertypes):
+                            supertypes.append(set())
+                        supertypes[class_id].add(super_id)
+
+        self.supertypes = [tuple(sorted(ids)) for ids in supertypes]
+        subtypes = [[] for _ in self.class_names]
+        for class_id, super_ids in enumerate(self.supertypes):
+            for super_id in super_ids:
+                subtypes[super_id].append(class_id)
+        self.subtypes = [tuple(ids) for ids in subtypes]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_dispatch_cache"] = {}
+        return state
+
+    def _intern(self, class_fqn):
+        class_id = self.class_ids.get(class_fqn)
+        if class_id is None:
+            class_id = len(self.class_names)
+            self.class_ids[class_fqn] = class_id
+            self.class_names.append(class_fqn)
+            self.class_files.append(None)
+            self.declared_methods.append({})
+            self.simple_names.setdefault(simple_type_name(class_fqn), []).append(class_id)
+        return class_id
+
+    # ----------------------------------------------------------------- lookup
+
+    def __contains__(self, class_fqn):
+        return class_fqn in self.class_ids
+
+    def class_file(self, class_fqn):
+        class_id = self.class_ids.get(class_fqn)
+        return self.class_files[class_id] if class_id is not None else None
+
+    def resolve_class_names(self, class_name):
+        """
+        Fully qualified names for 'org.x.Foo', 'Foo' or 'Outer$Inner'; an exact FQN match wins.
+        """
+        if class_name in self.class_ids:
+            return [class_name]
+        return [self.class_names[i] for i in self.simple_names.get(simple_type_name(class_name), [])]
+
+    def _closure(self, class_id, adjacency):
+        seen = {class_id}
+        order = []
+        queue = deque(adjacency[class_id])
+        while queue:
+            other = queue.popleft()
+            if other in seen:
+                continue
+            seen.add(other)
+            order.append(other)
+            queue.extend(adjacency[other])
+        return order
+
+    def supertypes_of(self, class_fqn):
+        class_id = self.class_ids.get(class_fqn)
+        return [self.class_names[i] for i in self._closure(class_id, self.supertypes)] if class_id is not None else []
+
+    def subtypes_of(self, class_fqn):
+        class_id = self.class_ids.get(class_fqn)
+        return [self.class_names[i] for i in self._closure(class_id, self.subtypes)] if class_id is not None else []
+
+    def declares_concrete(self, class_fqn, method_name):
+        class_id = self.class_ids.get(class_fqn)
+        return class_id is not None and self.declared_methods[class_id].get(method_name, False)
+
+    def dispatch_targets(self, class_fqn, method_name):
+        """
+        Concrete implementations an invocation of class_fqn.method_name can reach, nearest first:
+        the class itself or its nearest supertype with a body (inherited implementation), followed by every
+        overriding subtype. Empty when the type is unknown or the fan-out exceeds MAX_DISPATCH_TARGETS.
+        """
+        key = (class_fqn, method_name)
+        if key in self._dispatch_cache:
+            return self._dispatch_cache[key]
+
+        targets = []
+        class_id = self.class_ids.get(class_fqn)
+        if class_id is not None:
+            for candidate in [class_id] + self._closure(class_id, self.supertypes):
+                if self.declared_methods[candidate].get(method_name):
+                    targets.append(candidate)
+                    break
+            overrides = [i for i in self._closure(class_id, self.subtypes) if self.declared_methods[i].get(method_name)]
+            if len(overrides) <= MAX_DISPATCH_TARGETS:
+                targets.extend(i for i in overrides if i not in targets)
+
+        result = [self.class_names[i] for i in targets]
+        self._dispatch_cache[key] = result
+        return result
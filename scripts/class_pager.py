@@ -0,0 +1,82 @@
+import javalang
+from javalang.tree import ConstructorDeclaration, FieldDeclaration, MethodDeclaration
+from java_symbol_table import TYPE_DECLARATIONS, simple_class_name, type_name
+from method_line_index import build_method_line_index, interval_source
+
+
+# Longest line window returned by one page request
+MAX_PAGE_LINES = 200
+
+
+def _type_text(type_node):
+    if type_node is None:
+        return "void"
+    return (type_name(type_node) or "?") + "[]" * len(getattr(type_node, "dimensions", None) or [])
+
+
+def _signature(node):
+    params = ", ".join(f"{_type_text(p.type)}{'...' if p.varargs else ''} {p.name}" for p in node.parameters)
+    throws = f" throws {', '.join(node.throws)}" if node.throws else ""
+    if isinstance(node, ConstructorDeclaration):
+        return f"{node.name}({params}){throws}"
+    return f"{_type_text(node.return_type)} {node.name}({params}){throws}"
+
+
+def class_outline(content, tree=None):
+    """
+    Compact skeleton of a Java file: every type with its fields and member signatures, each with its line span,
+    so single members or line windows can be requested afterwards instead of the whole file.
+    """
+    if tree is None:
+        tree = javalang.parse.parse(content)
+    line_index = build_method_line_index(content, tree)
+    spans = {(interval.start, interval.kind): interval for interval in line_index.intervals}
+
+    outline = []
+
+    def walk(declaration, depth):
+        indent = "    " * depth
+        line = declaration.position.line if declaration.position else None
+        interval = spans.get((line, "class"))
+        kind = type(declaration).__name__.replace("Declaration", "").lower()
+        name = interval.name if interval else declaration.name
+        outline.append(f"{indent}{kind} {name}" + (f"  [lines {interval.start}-{interval.end}]" if interval else ""))
+        for member in declaration.body or []:
+            if isinstance(member, FieldDeclaration):
+                names = ", ".join(declarator.name for declarator in member.declarators)
+                outline.append(f"{indent}    field {_type_text(member.type)} {names}")
+            elif isinstance(member, (MethodDeclaration, ConstructorDeclaration)):
+                kind = "method" if isinstance(member, MethodDeclaration) else "constructor"
+                member_line = member.position.line if member.position else None
+                span = spans.get((member_line, kind))
+                outline.append(f"{indent}    {_signature(member)}" + (f"  [lines {span.start}-{span.end}]" if span else ""))
+            elif isinstance(member, TYPE_DECLARATIONS):
+                walk(member, depth + 1)
+
+    for declaration in tree.types:
+        walk(declaration, 0)
+    return "\n".join(outline)
+
+
+def class_member(content, member_name, tree=None):
+    """
+    Source of every method or constructor named member_name (all overloads), or None. Constructors are
+    requested by their class name or '<init>'.
+    """
+    line_index = build_method_line_index(content, tree)
+    members = line_index.methods_named(member_name)
+    if not members:
+        members = [interval for interval in line_index.methods_named("<init>") if simple_class_name(interval.class_name) == member_name]
+    if not members:
+        return None
+    return "\n\n".join(interval_source(content, interval) for interval in members)
+
+
+def class_page(content, start_line, end_line):
+    """
+    Lines start_line..end_line (1-based, inclusive, at most MAX_PAGE_LINES) prefixed with their numbers.
+    """
+    lines = content.splitlines()
+    start_line = max(start_line, 1)
+    end_line = min(end_line, len(lines), start_line + MAX_PAGE_LINES - 1)
+    return "\n".join(f"{number}: {lines[number - 1]}" for number in range(start_line, end_line + 1))
@@ -6,6 +6,7 @@ import subprocess
 from pathlib import Path
 from codebleu import compute_codebleu
 import javalang
+from method_registry import MethodRegistry
 
 
 # Paths
@@ -113,24 +114,30 @@ def find_single_gt_match_for_candidate(cand_key: str, gt_methods_for_bug):
       1) try endswith(Class.method) using last two tokens of cand_key
       2) else try method-name-only
     Return the matched GT full name or None.
+    gt_methods_for_bug is a list of GT full names or a MethodRegistry built from it (reused across candidates).
+    The registry only narrows the GT names to those of the candidate's method; matching stays the plain string
+    comparison above, so scores are unchanged.
     """
     if not cand_key:
         return None
 
+    gt_registry = gt_methods_for_bug if isinstance(gt_methods_for_bug, MethodRegistry) else MethodRegistry(gt_methods_for_bug)
     ck = cand_key.strip()
     cand_parts = ck.split(".")
     cand_last_two = ".".join(cand_parts[-2:]) if len(cand_parts) >= 2 else ck
     cand_last_one = cand_parts[-1]
+    # Every GT name that can match ends with the method token; a bare method name may also end a longer token
+    same_method = gt_registry.suffix_matches(cand_last_one, ignore_case=True) if len(cand_parts) >= 2 else gt_registry.names
 
     # Prefer Class.method endswith match
-    two_token_matches = [gt for gt in gt_methods_for_bug if gt.endswith(cand_last_two)]
+    two_token_matches = [gt for gt in same_method if gt.endswith(cand_last_two)]
     if two_token_matches:
-        return sorted(two_token_matches)[0]
+        return min(two_token_matches)
 
     # Fallback: method-only exact match on last token
-    one_token_matches = [gt for gt in gt_methods_for_bug if gt.split(".")[-1] == cand_last_one]
+    one_token_matches = [gt for gt in same_method if gt.split(".")[-1] == cand_last_one]
     if one_token_matches:
-        return sorted(one_token_matches)[0]
+        return min(one_token_matches)
 
     return None
 
@@ -235,8 +242,9 @@ for repo_info in repositories:
 
         # Pre-check: build candidate -> single GT match mapping
         candidate_to_gt = {}
+        gt_registry = MethodRegistry(gt_methods_for_bug)
         for cand_key in possible_fix_code.keys():
-            matched_gt = find_single_gt_match_for_candidate(cand_key, gt_methods_for_bug)
+            matched_gt = find_single_gt_match_for_candidate(cand_key, gt_registry)
             if matched_gt is not None:
                 candidate_to_gt[cand_key] = matched_gt
 
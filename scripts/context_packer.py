@@ -0,0 +1,139 @@
+import re
+import json
+import math
+from functools import lru_cache
+from token_budget import count_tokens
+from method_registry import MethodRegistry
+from source_compaction import compact_source
+
+
+# Source code context of a prompt, in tokens, unless the script sets its own
+DEFAULT_CONTEXT_BUDGET = 30000
+# Weight of the lexical score (0..1) against the stack-frame score (1 for the top frame, 1/(1+i) for frame i)
+LEXICAL_WEIGHT = 0.5
+# Methods of a class in the stack trace, but not on it, count as this fraction of the frame
+SAME_CLASS_FRAME_WEIGHT = 0.5
+# Omitted methods are listed by name, up to this many
+OMITTED_NAMES_SHOWN = 20
+NOT_FOUND = "[Method not found in codebase]"
+
+FRAME_PATTERN = re.compile(r'((?:[a-zA-Z_][\w$]*\.)+[A-Z][\w$]*\.[a-zA-Z_<][\w$>]*)\s*\(')
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9]*")
+CAMEL_CASE_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+STOP_TERMS = {
+    "the", "and", "for", "with", "this", "that", "from", "not", "are", "was", "when", "null", "new", "return",
+    "public", "private", "protected", "static", "final", "void", "int", "long", "boolean", "string", "throws",
+    "throw", "try", "catch", "else", "java", "org", "com", "apache", "src", "main", "get", "set",
+}
+
+
+def identifier_terms(text):
+    """
+    Lower-cased identifier parts (camelCase and snake_case split), without stop words and very short parts.
+    """
+    terms = set()
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        for part in CAMEL_CASE_PATTERN.findall(identifier) + [identifier]:
+            part = part.lower()
+            if len(part) > 2 and part not in STOP_TERMS:
+                terms.add(part)
+    return terms
+
+
+def method_text(value):
+    """
+    Source text of a method dict value (class requests are cached as [file content]); None when not found.
+    """
+    if isinstance(value, list):
+        value = "\n".join(str(item) for item in value)
+    value = str(value)
+    return None if value.strip() == NOT_FOUND else value
+
+
+def render_method(name, code):
+    return f"### {name}\n```java\n{code.strip()}\n```\n"
+
+
+@lru_cache(maxsize=65536)
+def method_tokens(name, code):
+    """
+    Tokens of one rendered method, counted once per process however many prompts include it.
+    """
+    return count_tokens(render_method(name, code))
+
+
+@lru_cache(maxsize=65536)
+def _method_terms(code):
+    return frozenset(identifier_terms(code))
+
+
+def stack_frames(text):
+    """
+    Method frames ('pkg.Class.method') in order of appearance, top frame first.
+    """
+    return list(dict.fromkeys(FRAME_PATTERN.findall(text or "")))
+
+
+def frame_scores(names, frames):
+    """
+    1/(1+i) for a method at stack frame i, SAME_CLASS_FRAME_WEIGHT of that for another method of the frame's class.
+    """
+    registry = MethodRegistry(names)
+    scores = dict.fromkeys(names, 0.0)
+    for index, frame in enumerate(frames):
+        weight = 1 / (1 + index)
+        class_name = frame.rsplit(".", 1)[0].split("$")[0]
+        for name in registry.suffix_matches(frame):
+            scores[name] = max(scores[name], weight)
+        for name in names:
+            if name.rsplit(".", 1)[0].endswith(class_name):
+                scores[name] = max(scores[name], SAME_CLASS_FRAME_WEIGHT * weight)
+    return scores
+
+
+def lexical_scores(codes, report_text):
+    """
+    IDF-weighted share of the report's identifier terms found in each method (0..1).
+    """
+    report_terms = identifier_terms(report_text)
+    method_terms = {name: _method_terms(code) for name, code in codes.items()}
+    document_frequency = {term: sum(term in terms for terms in method_terms.values()) for term in report_terms}
+    idf = {term: math.log((1 + len(codes)) / (1 + frequency)) + 1 for term, frequency in document_frequency.items() if frequency}
+    total = sum(idf.values())
+    if not total:
+        return dict.fromkeys(codes, 0.0)
+    return {name: sum(weight for term, weight in idf.items() if term in terms) / total for name, terms in method_terms.items()}
+
+
+def pack_methods(methods, report, stack_trace=None, budget=DEFAULT_CONTEXT_BUDGET, compact=False, elide_logs=False):
+    """
+    Ranks the methods ({name: code}) by stack-frame distance and lexical relevance to the report (a dict or
+    text), and renders the best ones that fit budget tokens as "### name" + java code blocks, most relevant first.
+    Frames come from stack_trace, or from the report when there is none. With compact, the rendered code goes
+    through compact_source (ranking still sees the original), so more methods fit the budget.
+    Returns (text, stats) with the included and omitted method names, the packed token count and the tokens
+    saved by compaction on the included methods.
+    """
+    report_text = report if isinstance(report, str) else json.dumps(report, ensure_ascii=False)
+    codes = {name: code for name, code in ((str(name), method_text(value)) for name, value in (methods or {}).items()) if code}
+    frames = stack_frames(stack_trace if stack_trace is not None else report_text)
+    by_frame = frame_scores(list(codes), frames)
+    by_text = lexical_scores(codes, report_text)
+    order = {name: index for index, name in enumerate(codes)}
+    ranked = sorted(codes, key=lambda name: (-(by_frame[name] + LEXICAL_WEIGHT * by_text[name]), order[name]))
+
+    blocks, included, omitted, used, saved = [], [], [], 0, 0
+    for name in ranked:
+        code, code_saved = compact_source(codes[name], elide_logs) if compact else (codes[name], 0)
+        tokens = method_tokens(name, code)
+        if used + tokens > budget:
+            omitted.append(name)
+            continue
+        blocks.append(render_method(name, code))
+        included.append(name)
+        used += tokens
+        saved += code_saved
+    if omitted:
+        shown = ", ".join(omitted[:OMITTED_NAMES_SHOWN]) + (", ..." if len(omitted) > OMITTED_NAMES_SHOWN else "")
+        blocks.append(f"[{len(omitted)} less relevant methods omitted to fit the context budget: {shown}]\n")
+    return "\n".join(blocks), {"included": included, "omitted": omitted, "tokens": used, "tokens_saved": saved}
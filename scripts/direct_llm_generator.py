@@ -1,9 +1,14 @@
 import json
+from collections import Counter
 import re
 from langchain import PromptTemplate
 from langchain_core.prompts import PromptTemplate
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import LLMChain
+from llm_gateway import get_gateway
+from llm_batch import batch_request, run_batch
+from structured_output import REPORT_SCHEMA, StructuredOutputError, parse_structured
+from context_packer import pack_methods
+from prompt_layout import cacheable_template, describe_prefix
+from method_registry import MethodRegistry
 
 
 def extract_full_method_paths(stack_trace: str):
@@ -16,11 +21,15 @@ def extract_full_method_paths(stack_trace: str):
 
 
 def filter_source_code_by_full_paths(source_code_dict, full_paths):
+    """
+    Keeps the methods whose key ends with one of the stack-trace method paths (token aligned; an
+    Outer$Inner frame matches the methods of Outer.java).
+    """
+    registry = MethodRegistry(source_code_dict)
     filtered_dict = {}
-    for method_path in full_paths:
-        for key in source_code_dict:
-            if key.endswith(method_path):
-                filtered_dict[key] = source_code_dict[key]
+    for method_path in sorted(full_paths):
+        for key in registry.suffix_matches(method_path):
+            filtered_dict[key] = source_code_dict[key]
     return filtered_dict
 
 
@@ -52,26 +61,19 @@ Return the enhanced bug report in JSON format:
     }},
     "possible_fix": "[Suggested resolution, including code changes if necessary.]"
 }}
-
-
-
-## You are given the Developer-Written Bug Report below:
-
-{bug_report}
-
-
-
-## You are given the Source Code Methods below:
-
-{source_code_methods}
+```
 '''
 
 
 
-prompt = PromptTemplate.from_template(template)
-llm = ChatOpenAI(model='gpt-4o-mini', temperature = 0)
-
-chain = LLMChain(llm=llm, prompt=prompt)
+# Static instructions first and the per-bug inputs last, so every prompt shares a cacheable prefix
+prompt = PromptTemplate.from_template(cacheable_template(template, [
+    ("You are given the Developer-Written Bug Report below", "{bug_report}"),
+    ("You are given the Source Code Methods below", "{source_code_methods}"),
+]))
+print(describe_prefix("Report prompt", prompt.template))
+# Shared gateway: pooled connections, rate limits and retries
+gateway = get_gateway()
 
 
 
@@ -80,17 +82,26 @@ chain = LLMChain(llm=llm, prompt=prompt)
 # File paths
 input_file = "data/source_code_data/Zookeeper.json"
 output_file = "data/direct_llm_bug_reports/Zookeeper.json"
+# Rendered requests (and their answers, in <name>.results.jsonl) for llm_batch; batch_mode is one of
+# llm_batch.BATCH_MODES: "sequential", "pool" (concurrent gateway calls) or "openai_batch" (Batch API job)
+batch_request_file = "data/batch_requests/direct_llm_bug_reports/Zookeeper.jsonl"
+batch_mode = "pool"
+# Tokens of source code per prompt (context_packer ranks the methods by stack frame and relevance to the report)
+context_token_budget = 30000
+# Strip comments, Javadoc and indentation from the packed code (source_compaction keeps its line structure);
+# elide_log_statements also replaces trace/debug/info log calls with "/* log */;"
+compact_code = False
+elide_log_statements = False
 
 
 
 with open(input_file, 'r') as f:
     data = json.load(f)
 
-output_data = []
-
+# Render every prompt up front (none depends on an earlier answer), complete them together, then join by filename
+requests = []
+tokens_saved = []
 for item in data:
-    filename = item['filename']
-    creation_time = item['creation_time']
     dev_written_bug_report = item.get("bug_report", {})
     stack_trace = item.get("stack_trace", "")
     source_code = item.get("source_code", {})
@@ -98,32 +109,39 @@ for item in data:
     # Extract method paths from stack trace
     method_paths = extract_full_method_paths(stack_trace)
 
-    # Filter source code dictionary using endswith matching
+    # Filter source code dictionary using endswith matching, then pack the most relevant methods into the budget
     source_code_methods = filter_source_code_by_full_paths(source_code, method_paths)
+    source_code_methods, packed = pack_methods(source_code_methods, dev_written_bug_report, stack_trace, context_token_budget,
+                                               compact_code, elide_log_statements)
+    tokens_saved.append(packed["tokens_saved"])
 
-    # processed_data.append({
-    #     "filename": item.get("filename"),
-    #     "bug_report": bug_report,
-    #     "stack_trace": stack_trace,
-    #     "method_paths_from_stack": list(method_paths),
-    #     "relevant_source_code": source_code_methods
-    # })
+    requests.append(batch_request(item['filename'], prompt.format(bug_report=dev_written_bug_report, source_code_methods=source_code_methods), model='gpt-4o-mini'))
 
+if compact_code:
+    print(f"Source compaction saved {sum(tokens_saved)} tokens ({sum(tokens_saved) / max(len(tokens_saved), 1):.0f} per prompt)")
+answers = run_batch(requests, batch_request_file, mode=batch_mode, gateway=gateway)
+print(f"Prompt prefix cache hit rate: {gateway.prefix_cache_hit_rate():.1%}")
 
-    # Generate improved bug report
-    bug_report_str = chain.run({'bug_report': dev_written_bug_report, 'source_code_methods': source_code_methods})
-    # print("--------------------------------------------------------------------")
-    # print(bug_report_str)
-    # print("--------------------------------------------------------------------")
+output_data = []
+outcomes = Counter()
 
+for item in data:
+    filename = item['filename']
+    creation_time = item['creation_time']
+    bug_report_str = answers.get(filename)
+    if bug_report_str is None:
+        print(f"No response for filename: {filename}")
+        continue
 
-    # Parse the bug report JSON from the generated string
+    # Parse the JSON from the generated string, repairing it (locally, or with one cheap call) when needed;
+    # the raw answer stays in the batch results file either way
     try:
-        # Remove any markdown-style code block indicators (` ```json `) if present
-        bug_report = json.loads(bug_report_str.replace("```json\n", "").replace("\n```", ""))
-    except json.JSONDecodeError:
-        print(f"Failed to parse JSON for filename: {filename}")
+        bug_report, outcome = parse_structured(bug_report_str, REPORT_SCHEMA, gateway=gateway)
+    except StructuredOutputError as e:
+        print(f"Failed to parse JSON for filename: {filename} ({e})")
+        outcomes[e.outcome] += 1
         continue  # Skip this entry if JSON parsing fails
+    outcomes[outcome] += 1
 
     
     # Add to output data
@@ -133,15 +151,10 @@ for item in data:
         'bug_report': bug_report
     })
 
-    # Write to output file after each bug report
-    with open(output_file, "w") as outfile:
-        json.dump(output_data, outfile, indent=4)
-    print(f"Progress saved to {output_file}")
-
+with open(output_file, "w") as outfile:
+    json.dump(output_data, outfile, indent=4)
+print(f"Parsed responses: {dict(outcomes)}")
 
-# # Write the summarized bug reports to a new JSON file
-# with open(f"{output_file}", "w") as outfile:
-#     json.dump(output_data, outfile, indent=4)
 
 print(f"Bug reports have been generated and saved to '{output_file}'")
 
@@ -1,11 +1,16 @@
 # prompt templating and chaining
 from langchain import PromptTemplate
 from langchain_core.prompts import PromptTemplate
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import LLMChain
+from llm_gateway import get_gateway
+from llm_batch import batch_request, run_batch
+from structured_output import FIX_SCHEMA, StructuredOutputError, parse_structured
+from context_packer import pack_methods
+from prompt_layout import cacheable_template, describe_prefix
 import json
+from collections import Counter
 import re
 import os
+from method_registry import MethodRegistry
 
 
 template = '''
@@ -32,29 +37,20 @@ The output should be structured in **valid JSON** as follows:
         "<full method name>": "<The full fixed code here>"
     }}
 }}
-
-
-
-
-
-# You are given the **Enhanced Bug Report** below:
-
-{bug_report}
-
-
-
-# You are given the **Source Code Methods** below:
-
-{source_code_methods}
+```
 '''
 
 
 
 
-prompt = PromptTemplate.from_template(template)
-llm = ChatOpenAI(model='gpt-4o-mini', temperature = 0)
-
-chain = LLMChain(llm=llm, prompt=prompt)
+# The stack-trace methods are the same whichever report of the bug is fixed, so they precede the report
+prompt = PromptTemplate.from_template(cacheable_template(template, [
+    ("You are given the **Source Code Methods** below", "{source_code_methods}"),
+    ("You are given the **Enhanced Bug Report** below", "{bug_report}"),
+]))
+print(describe_prefix("Fix prompt", prompt.template))
+# Shared gateway: pooled connections, rate limits and retries
+gateway = get_gateway()
 
 
 
@@ -62,6 +58,17 @@ chain = LLMChain(llm=llm, prompt=prompt)
 non_agent_based_file = "data/direct_llm_bug_reports/Zookeeper.json"
 fallback_source_file = "data/source_code_data/Zookeeper.json"
 output_file = "data/direct_llm_possible_fix_full_code/Zookeeper.json"
+# Rendered requests (and their answers, in <name>.results.jsonl) for llm_batch; batch_mode is one of
+# llm_batch.BATCH_MODES: "sequential", "pool" (concurrent gateway calls) or "openai_batch" (Batch API job)
+batch_request_file = "data/batch_requests/direct_llm_possible_fix_full_code/Zookeeper.jsonl"
+batch_mode = "pool"
+# Tokens of source code per prompt (context_packer ranks the methods by stack frame and relevance to the report)
+context_token_budget = 30000
+# Strip comments, Javadoc and indentation from the packed code (source_compaction keeps its line structure);
+# elide_log_statements also replaces trace/debug/info log calls with "/* log */;".
+# Off: the fixed code is scored by CodeBLEU against uncompacted ground truth, comments and layout included
+compact_code = False
+elide_log_statements = False
 
 
 # Load JSON data from a file
@@ -79,11 +86,15 @@ def extract_full_method_paths(stack_trace: str):
 
 
 def filter_source_code_by_full_paths(source_code_dict, full_paths):
+    """
+    Keeps the methods whose key ends with one of the stack-trace method paths (token aligned; an
+    Outer$Inner frame matches the methods of Outer.java).
+    """
+    registry = MethodRegistry(source_code_dict)
     filtered_dict = {}
-    for method_path in full_paths:
-        for key in source_code_dict:
-            if key.endswith(method_path):
-                filtered_dict[key] = source_code_dict[key]
+    for method_path in sorted(full_paths):
+        for key in registry.suffix_matches(method_path):
+            filtered_dict[key] = source_code_dict[key]
     return filtered_dict
     
 
@@ -95,13 +106,11 @@ fallback_data = load_json(fallback_source_file)
 source_code_map = {item["filename"]: item.get("source_code", {}) for item in fallback_data}
 stack_trace_map = {item["filename"]: item.get("stack_trace", {}) for item in fallback_data}
 
-# Prepare the output format
-output_data = []
-
+# Render every prompt up front (none depends on an earlier answer), complete them together, then join by filename
+requests = []
+tokens_saved = []
 for entry in non_agent_based_data:
     filename = entry['filename']
-    creation_time = entry['creation_time']
-    bug_report = entry["bug_report"]
 
     # lookup maps
     source_code = source_code_map.get(filename, {})
@@ -111,25 +120,41 @@ for entry in non_agent_based_data:
     # Extract method paths from stack trace
     method_paths = extract_full_method_paths(stack_trace)
 
-    # Filter source code dictionary using endswith matching
+    # Filter source code dictionary using endswith matching, then pack the most relevant methods into the budget
     source_code_methods = filter_source_code_by_full_paths(source_code, method_paths)
+    source_code_methods, packed = pack_methods(source_code_methods, entry["bug_report"], stack_trace, context_token_budget,
+                                               compact_code, elide_log_statements)
+    tokens_saved.append(packed["tokens_saved"])
 
+    requests.append(batch_request(filename, prompt.format(bug_report=entry["bug_report"], source_code_methods=source_code_methods), model='gpt-4o-mini'))
 
-    
-    # Generate improved bug report
-    fix_code_str = chain.run({'bug_report': bug_report, 'source_code_methods': source_code_methods})
-    print("--------------------------------------------------------------------")
-    print(fix_code_str)
-    print("--------------------------------------------------------------------")
+if compact_code:
+    print(f"Source compaction saved {sum(tokens_saved)} tokens ({sum(tokens_saved) / max(len(tokens_saved), 1):.0f} per prompt)")
+answers = run_batch(requests, batch_request_file, mode=batch_mode, gateway=gateway)
+print(f"Prompt prefix cache hit rate: {gateway.prefix_cache_hit_rate():.1%}")
+
+# Prepare the output format
+output_data = []
+outcomes = Counter()
 
+for entry in non_agent_based_data:
+    filename = entry['filename']
+    creation_time = entry['creation_time']
+    bug_report = entry["bug_report"]
+    fix_code_str = answers.get(filename)
+    if fix_code_str is None:
+        print(f"No response for filename: {filename}")
+        continue
 
-    # Parse the bug report JSON from the generated string
+
+    # Parse (and if needed repair) the fix JSON; unparsable answers remain in the batch results file
     try:
-        # Remove any markdown-style code block indicators (` ```json `) if present
-        fix_code_json = json.loads(fix_code_str.replace("```json\n", "").replace("\n```", ""))
-    except json.JSONDecodeError:
-        print(f"Failed to parse JSON for filename: {filename}")
+        fix_code_json, outcome = parse_structured(fix_code_str, FIX_SCHEMA, gateway=gateway)
+    except StructuredOutputError as e:
+        print(f"Failed to parse JSON for filename: {filename} ({e})")
+        outcomes[e.outcome] += 1
         continue  # Skip this entry if JSON parsing fails
+    outcomes[outcome] += 1
 
     
     # Add to output data
@@ -142,14 +167,8 @@ for entry in non_agent_based_data:
         "possible_fix_code": fix_code_json.get("possible_fix_code")
     })
 
-    # Write to output file after each bug report
-    with open(output_file, "w") as outfile:
-        json.dump(output_data, outfile, indent=4)
-    print(f"Progress saved to {output_file}")
-
-
-# # Write the summarized bug reports to a new JSON file
-# with open(f"{output_file}", "w") as outfile:
-#     json.dump(output_data, outfile, indent=4)
+with open(output_file, "w") as outfile:
+    json.dump(output_data, outfile, indent=4)
+print(f"Parsed responses: {dict(outcomes)}")
 
 print(f"Bug reports have been generated and saved to '{output_file}'")  
\ No newline at end of file
@@ -10,6 +10,7 @@ from nltk.tokenize import word_tokenize
 from rank_bm25 import BM25Okapi
 from javalang.parse import parse
 from javalang.tree import MethodDeclaration, ClassDeclaration
+from method_line_index import build_method_line_index
 
 # Set SSL context to fix SSL certificate issue with nltk.download()
 try:
@@ -168,8 +169,16 @@ def extract_keywords(bug_report):
     return keywords
 
 
+def load_method_line_index(file_path):
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return build_method_line_index(f.read())
+    except Exception:
+        return None
+
+
 # Rank methods using BM25
-def rank_methods_with_bm25(bm25, method_list, keywords, stack_trace, codebase_dirs):
+def rank_methods_with_bm25(bm25, method_list, keywords, stack_trace, codebase_dirs, exact_frame_boost=5):
     if bm25 is None:  # Handle empty corpus case
         print("Warning: No indexed source code methods found. Returning empty rankings.")
         return []
@@ -178,13 +187,28 @@ def rank_methods_with_bm25(bm25, method_list, keywords, stack_trace, codebase_di
     scores = bm25.get_scores(query)
 
     method_scores = {method: score for method, score in zip(method_list, scores)}
+    methods_by_file = defaultdict(list)
+    for method in method_scores:
+        methods_by_file[method[0]].append(method)
+
+    line_indexes = {}
     for class_name, file_name, line_number in stack_trace:
-        package_path = os.sep.join(class_name.split('.')[:-1]) + ".java"
+        # Inner classes (Outer$Inner) live in Outer.java
+        package_path = class_name.rsplit('.', 1)[0].split('$', 1)[0].replace('.', os.sep) + ".java"
         for codebase_dir in codebase_dirs:
             full_path = os.path.join(codebase_dir, package_path)
-            for method in method_list:
-                if method[0] == full_path:
-                    method_scores[method] += 5
+            if full_path not in methods_by_file:
+                continue
+            for method in methods_by_file[full_path]:
+                method_scores[method] += 5
+
+            # The method whose line range contains the frame line gets an extra boost
+            if full_path not in line_indexes:
+                line_indexes[full_path] = load_method_line_index(full_path)
+            line_index = line_indexes[full_path]
+            enclosing = line_index.enclosing_method(int(line_number)) if line_index is not None else None
+            if enclosing is not None and (full_path, enclosing.name) in method_scores:
+                method_scores[(full_path, enclosing.name)] += exact_frame_boost
 
     ranked_methods = sorted(method_scores.items(), key=lambda x: x[1], reverse=True)
     return ranked_methods
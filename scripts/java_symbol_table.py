@@ -0,0 +1,300 @@
+import javalang
+from javalang.tree import (
+    AnnotationDeclaration, CatchClauseParameter, ClassDeclaration,
+    ConstructorDeclaration, EnumDeclaration, FieldDeclaration, FormalParameter,
+    InferredFormalParameter, InterfaceDeclaration, MethodDeclaration, TryResource,
+    VariableDeclaration
+)
+
+
+TYPE_DECLARATIONS = (ClassDeclaration, InterfaceDeclaration, EnumDeclaration, AnnotationDeclaration)
+
+
+def type_name(type_node):
+    """
+    Returns the source-level name of a javalang type node, e.g. 'Map.Entry' for Map.Entry<K, V>.
+    """
+    if type_node is None or not hasattr(type_node, 'name'):
+        return None
+    parts = [type_node.name]
+    sub_type = getattr(type_node, 'sub_type', None)
+    while sub_type is not None:
+        parts.append(sub_type.name)
+        sub_type = getattr(sub_type, 'sub_type', None)
+    return ".".join(parts)
+
+
+def declared_supertypes(type_node):
+    """
+    extends + implements of a class, interface or enum declaration as javalang type nodes.
+    """
+    extends = getattr(type_node, 'extends', None)
+    if extends is None:
+        extends = []
+    elif not isinstance(extends, list):
+        extends = [extends]
+    return extends + list(getattr(type_node, 'implements', None) or [])
+
+
+class MethodScope:
+    """
+    Parameters and local variables declared inside one method, constructor or anonymous-class method.
+    Locals keep every (line, type) declaration so that shadowing in sibling blocks resolves by position.
+    """
+
+    def __init__(self, class_fqn, name, line, parent=None):
+        self.class_fqn = class_fqn
+        self.name = name
+        self.line = line
+        self.parent = parent
+        self.variables = {}
+
+    def declare(self, name, declared_type, line):
+        if name and declared_type:
+            self.variables.setdefault(name, []).append((line or 0, declared_type))
+
+    def lookup(self, name, line=None):
+        declarations = self.variables.get(name)
+        if declarations:
+            if line is None:
+                return declarations[-1][1]
+            visible = [declared_type for declared_line, declared_type in declarations if declared_line <= line]
+            return visible[-1] if visible else declarations[0][1]
+        if self.parent is not None:
+            return self.parent.lookup(name, line)
+        return None
+
+
+class CompilationUnitSymbols:
+    """
+    Symbol table for one parsed Java file, built in a single walk of the AST.
+
+    - imports: simple class name -> fully qualified name
+    - static_imports: imported static member -> fully qualified owner class
+    - declared_types: simple name of every type declared in this file -> binary name (Outer$Inner)
+    - fields: binary class name -> {field name: declared type}
+    - supertype_names: binary class name -> source-level names of its extends/implements types
+    - type_methods: binary class name -> {method name: has a body}
+    - method scopes: keyed by the id() of the method/constructor node
+    """
+
+    def __init__(self, tree):
+        self.package = tree.package.name if tree.package else ""
+        self.imports = {}
+        self.static_imports = {}
+        self.wildcard_imports = []
+        self.static_wildcard_imports = []
+        self.declared_types = {}
+        self.fields = {}
+        self.supertype_names = {}
+        self.type_methods = {}
+        self.method_scopes = {}
+        self._current_line = 0
+
+        for imported in tree.imports:
+            if imported.static:
+                if imported.wildcard:
+                    self.static_wildcard_imports.append(imported.path)
+                else:
+                    owner, _, member = imported.path.rpartition(".")
+                    self.static_imports[member] = owner
+            elif imported.wildcard:
+                self.wildcard_imports.append(imported.path)
+            else:
+                self.imports[imported.path.rsplit(".", 1)[-1]] = imported.path
+
+        for declaration in tree.types:
+            self._walk(declaration, None, None)
+
+    # ---------------------------------------------------------------- building
+
+    def _declare_type(self, name, outer_fqn):
+        if outer_fqn:
+            fqn = f"{outer_fqn}${name}"
+        else:
+            fqn = f"{self.package}.{name}" if self.package else name
+        self.declared_types.setdefault(name, fqn)
+        self.fields.setdefault(fqn, {})
+        return fqn
+
+    def _walk(self, node, class_fqn, scope):
+        if getattr(node, 'position', None):
+            self._current_line = node.position.line
+
+        if isinstance(node, TYPE_DECLARATIONS):
+            class_fqn = self._declare_type(node.name, class_fqn)
+            self.supertype_names[class_fqn] = [type_name(t) for t in declared_supertypes(node) if type_name(t)]
+            self.type_methods.setdefault(class_fqn, {})
+            scope = None
+        elif isinstance(node, FieldDeclaration) and scope is None:
+            for declarator in node.declarators:
+                self.fields[class_fqn][declarator.name] = type_name(node.type)
+        elif isinstance(node, (MethodDeclaration, ConstructorDeclaration)):
+            if scope is None and isinstance(node, MethodDeclaration):
+                # Direct member (not inside an anonymous class body); overloads with any body count as concrete
+                has_body = node.body is not None
+                self.type_methods[class_fqn][node.name] = self.type_methods[class_fqn].get(node.name, False) or has_body
+            scope = MethodScope(class_fqn, node.name, self._current_line, parent=scope)
+            self.method_scopes[id(node)] = scope
+        elif scope is not None:
+            if isinstance(node, VariableDeclaration):
+                for declarator in node.declarators:
+                    scope.declare(declarator.name, type_name(node.type), self._current_line)
+            elif isinstance(node, (FormalParameter, TryResource)):
+                scope.declare(node.name, type_name(node.type), self._current_line)
+            elif isinstance(node, CatchClauseParameter):
+                # Multi-catch (A | B e) is typed by its first alternative
+                scope.declare(node.name, node.types[0] if node.types else None, self._current_line)
+            elif isinstance(node, InferredFormalParameter):
+                scope.declare(node.name, None, self._current_line)
+
+        for child in node.children:
+            self._walk_child(child, class_fqn, scope)
+
+    def _walk_child(self, child, class_fqn, scope):
+        if isinstance(child, javalang.ast.Node):
+            self._walk(child, class_fqn, scope)
+        elif isinstance(child, (list, tuple)):
+            for item in child:
+                self._walk_child(item, class_fqn, scope)
+
+    # -------------------------------------------------------------- resolution
+
+    def scope_of(self, method_node):
+        return self.method_scopes.get(id(method_node))
+
+    def scope_at(self, path):
+        """
+        Scope for a node reached by tree.filter() path: the innermost method or constructor, or a class-level
+        scope of the innermost type for code outside any (field initializers, initializer blocks).
+        """
+        for node in reversed(path):
+            if isinstance(node, (MethodDeclaration, ConstructorDeclaration)):
+                return self.scope_of(node)
+            if isinstance(node, TYPE_DECLARATIONS):
+                class_fqn = self.declared_types.get(node.name)
+                return MethodScope(class_fqn, None, 0) if class_fqn else None
+        return None
+
+    def resolve_type_fqn(self, simple_name):
+        """
+        Maps a source-level type name (Foo or Outer.Inner) to its most likely fully qualified name.
+        """
+        if not simple_name:
+            return None
+        head, _, rest = simple_name.partition(".")
+        if head in self.declared_types:
+            fqn = self.declared_types[head]
+        elif head in self.imports:
+            fqn = self.imports[head]
+        elif head[0].islower() and rest:
+            # Already package-qualified: org.apache.Foo
+            return simple_name
+        else:
+            fqn = f"{self.package}.{head}" if self.package else head
+        return f"{fqn}${rest.replace('.', '$')}" if rest else fqn
+
+    def candidate_type_fqns(self, simple_name):
+        """
+        All plausible fully qualified names for a type name, most likely first. Used as a fallback when the
+        primary guess does not exist on disk (wildcard imports).
+        """
+        primary = self.resolve_type_fqn(simple_name)
+        candidates = [primary] if primary else []
+        if simple_name and simple_name not in self.declared_types and simple_name not in self.imports:
+            for package in self.wildcard_imports:
+                candidates.append(f"{package}.{simple_name}")
+        return candidates
+
+    def _field_type(self, class_fqn, name):
+        while class_fqn:
+            field_type = self.fields.get(class_fqn, {}).get(name)
+            if field_type:
+                return field_type
+            if "$" not in class_fqn:
+                break
+            class_fqn = class_fqn.rsplit("$", 1)[0]
+        return None
+
+    def variable_type(self, name, scope=None, line=None):
+        """
+        Resolves the declared type of a local, parameter or field visible from scope.
+        """
+        if scope is not None:
+            declared = scope.lookup(name, line)
+            if declared:
+                return declared
+            return self._field_type(scope.class_fqn, name)
+        for class_fields in self.fields.values():
+            if name in class_fields:
+                return class_fields[name]
+        return None
+
+    def resolve_qualifier(self, qualifier, scope=None, line=None):
+        """
+        Resolves a MethodInvocation qualifier ('foo', 'Foo', 'this.foo', 'org.x.Foo') to the fully qualified
+        name of the receiver's type. Returns None if the receiver type cannot be determined.
+        """
+        if not qualifier:
+            return scope.class_fqn if scope is not None else None
+        parts = qualifier.split(".")
+        if parts[0] == "this":
+            parts = parts[1:]
+            if not parts:
+                return scope.class_fqn if scope is not None else None
+        head = parts[0]
+
+        declared = self.variable_type(head, scope, line)
+        if declared:
+            owner_fqn = self.resolve_type_fqn(declared)
+            # Follow field chains (a.b.c) through types declared in this file
+            for field_name in parts[1:]:
+                field_type = self.fields.get(owner_fqn, {}).get(field_name)
+                if not field_type:
+                    return None
+                owner_fqn = self.resolve_type_fqn(field_type)
+            return owner_fqn
+
+        if head[0].isupper():
+            type_parts = [head]
+            for part in parts[1:]:
+                if not part[0].isupper():
+                    return None  # static field chain on a foreign type
+                type_parts.append(part)
+            return self.resolve_type_fqn(".".join(type_parts))
+
+        # Lower-case head that is not a variable: a package-qualified type name
+        for index, part in enumerate(parts):
+            if part[0].isupper():
+                return ".".join(parts[:index + 1]) + "".join(f"${p}" for p in parts[index + 1:])
+        return None
+
+    def resolve_call_owner(self, call, scope=None):
+        """
+        Resolves the fully qualified type that declares a MethodInvocation target.
+        Unqualified calls resolve to a matching static import, otherwise to the enclosing class.
+        """
+        line = call.position.line if call.position else None
+        if not call.qualifier:
+            if call.member in self.static_imports:
+                return self.static_imports[call.member]
+            return scope.class_fqn if scope is not None else None
+        return self.resolve_qualifier(call.qualifier, scope, line)
+
+
+def build_symbol_table(tree):
+    return CompilationUnitSymbols(tree)
+
+
+def simple_class_name(fqn):
+    """
+    'org.x.Outer$Inner' -> 'Inner'
+    """
+    return fqn.rsplit(".", 1)[-1].rsplit("$", 1)[-1] if fqn else fqn
+
+
+def top_level_class(fqn):
+    """
+    'org.x.Outer$Inner' -> 'org.x.Outer' (the class that names the .java file)
+    """
+    return fqn.split("$", 1)[0] if fqn else fqn
@@ -0,0 +1,269 @@
+import re
+import json
+import time
+import hashlib
+import threading
+from token_budget import count_tokens
+
+
+def token_usage(prompt_tokens, completion_tokens, cached_tokens=0):
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens, "cached_tokens": cached_tokens}
+
+
+class LLMBackend:
+    """
+    Where the gateway's requests go. complete() sends one prompt and returns (text, token_usage(...)), where
+    cached_tokens are the prompt tokens served from the provider's prefix cache; the text ends before the first
+    of the stop sequences. chat_model() returns the LangChain chat model the requests are sent with.
+    callback_counted: complete() runs a LangChain chat model, so get_openai_callback already sees its usage.
+    """
+
+    callback_counted = True
+
+    def chat_model(self, model="gpt-4o-mini", temperature=0, max_retries=0):
+        raise NotImplementedError
+
+    def complete(self, model, temperature, prompt, stop=None):
+        response = self.chat_model(model, temperature).invoke(prompt, stop=stop)
+        usage = getattr(response, "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens") or count_tokens(prompt)
+        completion_tokens = usage.get("output_tokens") or count_tokens(response.content)
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        return response.content, token_usage(prompt_tokens, completion_tokens, cached_tokens)
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    OpenAI (or any OpenAI-compatible server at base_url): ChatOpenAI instances per (model, temperature, retries)
+    sharing one pooled HTTP client with kept-alive connections.
+    """
+
+    def __init__(self, base_url=None, timeout_seconds=120, max_connections=32):
+        self.base_url = base_url
+        self.timeout_seconds = timeout_seconds
+        self.max_connections = max_connections
+        self._models = {}
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    def chat_model(self, model="gpt-4o-mini", temperature=0, max_retries=0):
+        key = (model, temperature, max_retries)
+        with self._lock:
+            if key not in self._models:
+                import httpx
+                from langchain_openai import ChatOpenAI
+                if self._http_client is None:
+                    limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+                    self._http_client = httpx.Client(limits=limits, timeout=self.timeout_seconds)
+                self._models[key] = ChatOpenAI(model=model, temperature=temperature, base_url=self.base_url,
+                                               http_client=self._http_client, max_retries=max_retries, timeout=self.timeout_seconds)
+            return self._models[key]
+
+
+# Granularity of the simulated prefix cache (about 128 tokens), and its minimum prompt length (about 1024 tokens)
+FAKE_PREFIX_BLOCK_CHARS = 512
+FAKE_PREFIX_MIN_CHARS = 4096
+
+# Fully qualified method names in prompts ('org.x.Foo.bar'), and stack frames ('at org.x.Foo.bar(Foo.java:12)')
+FQN_PATTERN = re.compile(r"\b((?:[a-z_][\w]*\.)+[A-Z][\w$]*\.[a-z_<][\w$>]*)")
+FRAME_PATTERN = re.compile(r"at\s+((?:[\w$]+\.)+[\w$<>]+)\(")
+REACT_TOOLS_PATTERN = re.compile(r"should be one of \[([^\]]*)\]")
+JUDGE_LEVELS = ["Precise", "Partial", "Missing"]
+JUDGE_SUB_CATEGORIES = ["Direct Caller/Callee", "2-Hop Caller/Callee", "Same Class or Module", "Shared Stack Trace Context", "Buggy Method"]
+FIX_CATEGORIES = ["Correct", "Alternative Fix", "Preventive", "Missing"]
+
+
+def _unique(values):
+    return list(dict.fromkeys(values))
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic offline backend: answers each pipeline prompt with schema-valid output that depends only on the
+    prompt: enhanced bug reports, possible_fix_code JSON, judge verdicts, Analyze and Request Next answers and
+    ReAct agent steps (requests stack-trace frames, then a Final Answer after max_agent_steps tool calls).
+
+    latency_seconds (+ up to latency_jitter_seconds, derived from the prompt hash) is slept per call; token
+    counts are measured on the texts unless prompt_tokens / completion_tokens fix them. A provider prefix cache
+    is simulated: the longest earlier-seen prompt prefix (in ~128-token blocks, from ~1024 tokens) is reported
+    as cached tokens.
+    """
+
+    def __init__(self, latency_seconds=0.2, latency_jitter_seconds=0.0, prompt_tokens=None, completion_tokens=None, max_agent_steps=6):
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.max_agent_steps = max_agent_steps
+        self.calls = 0
+        self.tokens = 0
+        self._models = {}
+        self._prefixes = set()
+        self._lock = threading.Lock()
+
+    def _cached_tokens(self, prompt):
+        """
+        Tokens of the longest prefix already sent (block-aligned); records this prompt's prefixes.
+        """
+        hasher = hashlib.sha1()
+        cached_chars = 0
+        seen = []
+        for end in range(FAKE_PREFIX_BLOCK_CHARS, len(prompt) + 1, FAKE_PREFIX_BLOCK_CHARS):
+            hasher.update(prompt[end - FAKE_PREFIX_BLOCK_CHARS:end].encode("utf-8"))
+            if end >= FAKE_PREFIX_MIN_CHARS:
+                seen.append(hasher.copy().digest())
+        with self._lock:
+            for index, digest in enumerate(seen):
+                if digest not in self._prefixes:
+                    break
+                cached_chars = FAKE_PREFIX_MIN_CHARS + index * FAKE_PREFIX_BLOCK_CHARS
+            self._prefixes.update(seen)
+        return count_tokens(prompt[:cached_chars]) if cached_chars else 0
+
+    def respond(self, prompt):
+        """
+        Returns (text, token_usage(...)) after the simulated latency.
+        """
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency_seconds + self.latency_jitter_seconds * (digest % 1000) / 1000)
+        text = self._text(prompt, digest)
+        prompt_tokens = self.prompt_tokens if self.prompt_tokens is not None else count_tokens(prompt)
+        completion_tokens = self.completion_tokens if self.completion_tokens is not None else count_tokens(text)
+        cached_tokens = min(self._cached_tokens(prompt), prompt_tokens)
+        with self._lock:
+            self.tokens += prompt_tokens + completion_tokens
+        return text, token_usage(prompt_tokens, completion_tokens, cached_tokens)
+
+    # respond() bypasses LangChain: callers report its usage themselves
+    callback_counted = False
+
+    def complete(self, model, temperature, prompt, stop=None):
+        text, usage = self.respond(prompt)
+        return truncate_at_stop(text, stop), usage
+
+    def chat_model(self, model="gpt-4o-mini", temperature=0, max_retries=0):
+        with self._lock:
+            if model not in self._models:
+                self._models[model] = fake_chat_model_class()(backend=self, model_name=model)
+            return self._models[model]
+
+    def _text(self, prompt, digest):
+        methods = _unique(FQN_PATTERN.findall(prompt))
+        if REACT_TOOLS_PATTERN.search(prompt):
+            return self._react_step(prompt, methods)
+        if "possible_fix_code" in prompt:
+            return self._fix(methods)
+        if "root_cause_identification" in prompt:
+            return self._verdict(digest)
+        if '"Title"' in prompt:
+            return self._report(methods)
+        if "request the next methods" in prompt:
+            # Alternate deterministically between asking for a callee and concluding
+            if methods and digest % 2:
+                return methods[digest % len(methods)]
+            return f'Observations: "The fault is likely in {methods[0] if methods else "the analyzed method"}."'
+        return f"Fake response to a {count_tokens(prompt)}-token prompt."
+
+    def _react_step(self, prompt, methods):
+        tools = [name.strip() for name in REACT_TOOLS_PATTERN.search(prompt).group(1).split(",")]
+        # The scratchpad after the question holds one Observation per finished tool call
+        steps = prompt.rsplit("Question:", 1)[-1].count("Observation:")
+        frames = _unique(FRAME_PATTERN.findall(prompt)) or methods
+        if steps >= self.max_agent_steps or not frames:
+            return f"Thought: I now know the final answer\nFinal Answer: The root cause is in {frames[0] if frames else 'the top stack frame'}."
+        frame = frames[(steps // 2) % len(frames)]
+        if steps % 2 == 0 or "Analyze and Request Next" not in tools:
+            action = "Provide Method" if "Provide Method" in tools else tools[0]
+        else:
+            action = "Analyze and Request Next"
+        return f"Thought: I should inspect {frame}.\nAction: {action}\nAction Input: {frame}"
+
+    def _report(self, methods):
+        classes = _unique(method.rsplit(".", 1)[0] for method in methods)
+        return "```json\n" + json.dumps({
+            "Title": "Fake enhanced bug report",
+            "Description": "Deterministic report produced by the fake LLM backend.",
+            "StackTrace": [f"at {method}" for method in methods[:5]],
+            "RootCause": f"Faulty state handling in {methods[0]}." if methods else "Unknown.",
+            "StepsToReproduce": ["Run the failing scenario."],
+            "ExpectedBehavior": "The operation completes without an exception.",
+            "ObservedBehavior": "The operation fails with the reported exception.",
+            "Suggestions": "Validate the state before use.",
+            "problem_location": {
+                "files": [f"{name.rsplit('.', 1)[-1].split('$')[0]}.java" for name in classes[:3]],
+                "classes": classes[:3],
+                "methods": [".".join(method.split(".")[-2:]) for method in methods[:3]],
+            },
+            "possible_fix": "Add a null check before the failing call.",
+        }, indent=4) + "\n```"
+
+    def _fix(self, methods):
+        fixes = {method: f"public void {method.rsplit('.', 1)[-1]}() {{\n    // fake fix\n}}" for method in methods[:2]}
+        return "```json\n" + json.dumps({"possible_fix_code": fixes}, indent=4) + "\n```"
+
+    def _verdict(self, digest):
+        return "```json\n" + json.dumps({
+            "root_cause_identification": {"level": JUDGE_LEVELS[digest % 3], "sub_category": JUDGE_SUB_CATEGORIES[digest % 5]},
+            "fix_suggestion": FIX_CATEGORIES[digest % 4],
+            "problem_location_identification": {"level": JUDGE_LEVELS[(digest // 3) % 3], "sub_category": JUDGE_SUB_CATEGORIES[(digest // 5) % 5]},
+            "wrong_information": "No" if digest % 7 else "Yes",
+            "explanation_of_judgement": "Deterministic verdict of the fake LLM backend.",
+        }, indent=4) + "\n```"
+
+
+def truncate_at_stop(text, stop=None):
+    for stop_sequence in stop or []:
+        text = text.split(stop_sequence, 1)[0]
+    return text
+
+
+def chat_result(text, usage, model_name):
+    """
+    LangChain ChatResult of a completion. With usage, tokens are reported like ChatOpenAI does (cached prompt
+    tokens included) so get_openai_callback counts the call; usage=None leaves the result uncounted.
+    """
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    if usage is None:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+    message = AIMessage(content=text, usage_metadata={
+        "input_tokens": usage["prompt_tokens"], "output_tokens": usage["completion_tokens"], "total_tokens": usage["total_tokens"],
+        "input_token_details": {"cache_read": usage["cached_tokens"]},
+    })
+    token_usage_field = {
+        "prompt_tokens": usage["prompt_tokens"], "completion_tokens": usage["completion_tokens"], "total_tokens": usage["total_tokens"],
+        "prompt_tokens_details": {"cached_tokens": usage["cached_tokens"]},
+    }
+    return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": token_usage_field, "model_name": model_name})
+
+
+_fake_chat_model_class = None
+
+
+def fake_chat_model_class():
+    """
+    LangChain chat model over a FakeBackend (built on first use so this module does not need LangChain).
+    Reports token usage like ChatOpenAI (cached prompt tokens included), so get_openai_callback counts its calls.
+    """
+    global _fake_chat_model_class
+    if _fake_chat_model_class is None:
+        from typing import Any
+        from langchain_core.language_models.chat_models import BaseChatModel
+
+        class FakeChatModel(BaseChatModel):
+            backend: Any
+            model_name: str = "gpt-4o-mini"
+
+            @property
+            def _llm_type(self):
+                return "fake-chat"
+
+            def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+                text, usage = self.backend.complete(self.model_name, 0, "\n".join(str(message.content) for message in messages), stop)
+                return chat_result(text, usage, self.model_name)
+
+        _fake_chat_model_class = FakeChatModel
+    return _fake_chat_model_class
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_gateway import get_gateway
+from llm_cache import cache_key
+
+
+# sequential: one call after the other; pool: concurrent calls through the gateway (rate limited, retried);
+# openai_batch: one OpenAI Batch API job (half price, results within the completion window)
+BATCH_MODES = ("sequential", "pool", "openai_batch")
+BATCH_FINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+_results_lock = threading.Lock()
+
+
+def batch_request(custom_id, prompt, model="gpt-4o-mini", temperature=0):
+    """
+    One line of a request file, in the OpenAI Batch API format.
+    """
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": model, "temperature": temperature, "messages": [{"role": "user", "content": prompt}]},
+    }
+
+
+def request_prompt(request):
+    return request["body"]["messages"][-1]["content"]
+
+
+def request_key(request):
+    """
+    Content address of the request, so answers to an older version of a prompt are not reused.
+    """
+    body = request["body"]
+    return cache_key(body["model"], body.get("temperature", 0), request_prompt(request))
+
+
+def write_jsonl(path, rows):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def results_path(request_file):
+    return os.path.splitext(request_file)[0] + ".results.jsonl"
+
+
+def _append_result(path, request, text):
+    with _results_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"custom_id": request["custom_id"], "key": request_key(request), "text": text}, ensure_ascii=False) + "\n")
+
+
+def run_requests(requests, mode, result_file, gateway, max_workers):
+    """
+    Completes the requests through the gateway (one at a time, or max_workers at once); every answer is appended
+    to result_file as it arrives, so an interrupted run resumes where it stopped.
+    """
+    def complete(request):
+        body = request["body"]
+        return gateway.complete(request_prompt(request), body["model"], body.get("temperature", 0))
+
+    workers = 1 if mode == "sequential" else max_workers
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(complete, request): request for request in requests}
+        for future in as_completed(futures):
+            request = futures[future]
+            try:
+                _append_result(result_file, request, future.result())
+            except Exception as e:
+                print(f"Request {request['custom_id']} failed: {type(e).__name__}: {e}")
+
+
+def run_openai_batch(requests, request_file, result_file, gateway, completion_window="24h", poll_seconds=60):
+    """
+    Uploads the requests as one Batch API job, waits for it and appends the answers to result_file (and to the
+    gateway's response cache, so later runs reuse them).
+    """
+    from openai import OpenAI
+    client = OpenAI()
+    write_jsonl(request_file, requests)
+    with open(request_file, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions", completion_window=completion_window)
+    print(f"Submitted batch {batch.id} with {len(requests)} requests")
+    while batch.status not in BATCH_FINAL_STATES:
+        time.sleep(poll_seconds)
+        batch = client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.status} {batch.request_counts}")
+    if batch.output_file_id is None:
+        print(f"Batch {batch.id} ended as {batch.status} without output")
+        return
+
+    by_id = {request["custom_id"]: request for request in requests}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        response = row.get("response") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            print(f"Request {row['custom_id']} failed: {row.get('error') or response.get('status_code')}")
+            continue
+        text = response["body"]["choices"][0]["message"]["content"]
+        request = by_id.get(row["custom_id"])
+        if request is None:
+            continue
+        _append_result(result_file, request, text)
+        if gateway.cache is not None:
+            gateway.cache.put(request["body"]["model"], request["body"].get("temperature", 0), request_prompt(request), text)
+
+
+def run_batch(requests, request_file, mode="pool", gateway=None, max_workers=16, **batch_options):
+    """
+    Writes the rendered requests to request_file (JSONL), completes the ones without an answer in its results
+    file (<request_file>.results.jsonl) and returns {custom_id: completion text} for every answered request.
+    """
+    if mode not in BATCH_MODES:
+        raise ValueError(f"Unknown batch mode {mode!r}; expected one of {BATCH_MODES}")
+    gateway = gateway or get_gateway()
+    write_jsonl(request_file, requests)
+    result_file = results_path(request_file)
+    answered = {(row["custom_id"], row["key"]) for row in read_jsonl(result_file)}
+    pending = [request for request in requests if (request["custom_id"], request_key(request)) not in answered]
+    print(f"{len(requests)} requests in '{request_file}', {len(pending)} to run ({mode})")
+
+    if pending and mode == "openai_batch":
+        # Answers already in the response cache are not paid for again
+        uncached = []
+        for request in pending:
+            body = request["body"]
+            cached = gateway.cache.get(body["model"], body.get("temperature", 0), request_prompt(request)) if gateway.cache is not None else None
+            if cached is None:
+                uncached.append(request)
+            else:
+                _append_result(result_file, request, cached)
+        if uncached:
+            run_openai_batch(uncached, os.path.splitext(request_file)[0] + ".pending.jsonl", result_file, gateway, **batch_options)
+    elif pending:
+        run_requests(pending, mode, result_file, gateway, max_workers)
+
+    wanted = {(request["custom_id"], request_key(request)) for request in requests}
+    return {row["custom_id"]: row["text"] for row in read_jsonl(result_file) if (row["custom_id"], row["key"]) in wanted}
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+DEFAULT_CACHE_PATH = ".llm_cache/responses.sqlite"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Eviction frees space down to this fraction of max_bytes, so it does not run on every write
+EVICTION_TARGET = 0.9
+
+# read_write: read-through and write-through; write_only: always call and refresh the entry;
+# cache_only: offline, a miss raises CacheMissError; off: no caching
+CACHE_MODES = ("read_write", "write_only", "cache_only", "off")
+
+
+class CacheMissError(LookupError):
+    pass
+
+
+def cache_key(model, temperature, prompt):
+    """
+    Content address of a call: sha256 of (model, temperature, fully rendered prompt).
+    """
+    return hashlib.sha256(json.dumps([model, float(temperature), prompt], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent LLM response cache in SQLite, shared by every script that calls through llm_gateway. Entries are
+    evicted least recently used first once the stored responses exceed max_bytes. Safe to use from several
+    threads and processes (WAL journal).
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, mode="read_write", max_bytes=DEFAULT_MAX_BYTES):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}; expected one of {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, temperature REAL, response TEXT, size INTEGER, "
+            "created REAL, last_access REAL, hits INTEGER DEFAULT 0)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._connection.commit()
+        self._size = self.total_bytes()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, model, temperature, prompt):
+        """
+        Cached response or None (raises CacheMissError on a miss in cache_only mode).
+        """
+        if self.mode in ("off", "write_only"):
+            return None
+        key = cache_key(model, temperature, prompt)
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                self._connection.commit()
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+        if self.mode == "cache_only":
+            raise CacheMissError(f"No cached response for this {model} prompt (cache_only mode)")
+        return None
+
+    def put(self, model, temperature, prompt, response):
+        if self.mode not in ("read_write", "write_only"):
+            return
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        key = cache_key(model, temperature, prompt)
+        with self._lock:
+            # A replaced entry gives back its size
+            replaced = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, temperature, response, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, float(temperature), response, size, now, now),
+            )
+            self._connection.commit()
+            self._size += size - (replaced[0] if replaced else 0)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self, target_bytes=None):
+        """
+        Deletes least recently used entries until the cache holds at most target_bytes (default 90% of max_bytes).
+        """
+        target_bytes = int(self.max_bytes * EVICTION_TARGET) if target_bytes is None else target_bytes
+        with self._lock:
+            # Other processes write to the same file: start from the exact size
+            size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            evicted = 0
+            rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+            for key, entry_size in rows:
+                if size <= target_bytes:
+                    break
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                size -= entry_size
+                evicted += 1
+            self._connection.commit()
+            self._size = size
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"mode": self.mode, "entries": entries, "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,409 @@
+import os
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from token_budget import count_tokens
+from llm_cache import ResponseCache
+from llm_backends import OpenAIBackend, FakeBackend, chat_result
+
+
+# Errors worth another attempt: throttling, timeouts, dropped connections and server-side failures
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+                         "TimeoutException", "ConnectError", "ReadTimeout", "RemoteProtocolError"}
+# Completion tokens reserved per request before the actual usage is known
+EXPECTED_COMPLETION_TOKENS = 1024
+
+
+def error_status(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_throttled(error):
+    return error_status(error) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_retryable(error):
+    return error_status(error) in RETRYABLE_STATUS_CODES or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def retry_after_seconds(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets, refilled continuously. acquire() blocks until both
+    have room; settle() corrects the token bucket once a request's actual usage is known.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def try_acquire(self, tokens):
+        """
+        Takes one request and tokens if both are available now; returns the seconds to wait otherwise (0 on success).
+        """
+        # A prompt larger than the whole per-minute budget waits for a full bucket instead of forever
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            self._refill()
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0
+            request_wait = (1 - self._requests) * 60 / self.requests_per_minute if self._requests < 1 else 0
+            token_wait = (tokens - self._tokens) * 60 / self.tokens_per_minute if self._tokens < tokens else 0
+            return max(request_wait, token_wait, 0.001)
+
+    def acquire(self, tokens):
+        while True:
+            delay = self.try_acquire(tokens)
+            if delay == 0:
+                return
+            time.sleep(delay)
+
+    def settle(self, reserved_tokens, used_tokens):
+        with self._lock:
+            self._tokens = min(self.tokens_per_minute, self._tokens + reserved_tokens - used_tokens)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted by AIMD: +1 after a full window of successful requests, halved on throttling
+    (at most once per cooldown, since one burst of 429s is a single signal).
+    """
+
+    def __init__(self, initial, minimum=1, maximum=32, cooldown_seconds=2.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, *_):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify()
+
+    def on_throttle(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown_seconds:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._last_decrease = now
+            self._successes = 0
+
+
+class GatewayModel:
+    """
+    One model of the gateway with the invoke(prompt) interface of a chat model (returns the text).
+    """
+
+    def __init__(self, gateway, model, temperature):
+        self.gateway = gateway
+        self.model = model
+        self.temperature = temperature
+
+    def invoke(self, prompt):
+        return self.gateway.complete(prompt, self.model, self.temperature)
+
+
+class LLMGateway:
+    """
+    Single entry point for LLM calls of every script:
+    - requests go to a backend (llm_backends): OpenAI by default, whose chat models share one pooled HTTP
+      client (kept-alive connections) and are reused per (model, temperature);
+    - requests and tokens per minute are rate limited before sending;
+    - retryable failures (429, timeouts, 5xx, dropped connections) are retried with full-jitter exponential
+      backoff, honouring Retry-After;
+    - concurrency adapts to throttling (AIMD);
+    - a request still running after hedge_after_seconds (default: the observed p95 latency) is sent once more
+      while there is headroom, and the first answer wins.
+
+    Calls run in a copy of the caller's context, so get_openai_callback still counts their usage.
+    langchain_model() wraps the gateway as a LangChain chat model for callers that need one (the agent executor).
+    base_url points the default backend at any OpenAI-compatible server (e.g. llm_stub_server.py);
+    backend=FakeBackend() runs the whole pipeline offline. With a cache (llm_cache.ResponseCache), prompts
+    already answered are served without a call.
+    """
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200000, initial_concurrency=4, max_concurrency=16,
+                 max_retries=6, backoff_base_seconds=1.0, backoff_cap_seconds=60.0, hedge_after_seconds=None,
+                 hedge_percentile=0.95, min_hedge_samples=20, base_url=None, timeout_seconds=120, max_connections=32,
+                 cache=None, backend=None):
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_cap_seconds = backoff_cap_seconds
+        self.hedge_after_seconds = hedge_after_seconds
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_samples = min_hedge_samples
+        self.backend = backend if backend is not None else OpenAIBackend(base_url, timeout_seconds, max_connections)
+        self.cache = cache
+        self.counters = {"requests": 0, "retries": 0, "throttled": 0, "hedged": 0, "hedge_wins": 0, "failures": 0,
+                         "prompt_tokens": 0, "cached_prompt_tokens": 0}
+        self._latencies = deque(maxlen=500)
+        self._langchain_models = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2 * max_concurrency, thread_name_prefix="llm-gateway")
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def chat_model(self, model="gpt-4o-mini", temperature=0, max_retries=0):
+        """
+        Shared chat model of the backend, bypassing the gateway. Gateway calls retry themselves (max_retries=0);
+        direct callers let the client retry instead.
+        """
+        return self.backend.chat_model(model, temperature, max_retries)
+
+    def model(self, model="gpt-4o-mini", temperature=0):
+        return GatewayModel(self, model, temperature)
+
+    def langchain_model(self, model="gpt-4o-mini", temperature=0):
+        """
+        LangChain chat model whose calls go through this gateway (rate limits, retries, concurrency, hedging).
+        """
+        key = (model, temperature)
+        with self._lock:
+            if key not in self._langchain_models:
+                self._langchain_models[key] = gateway_chat_model_class()(gateway=self, model_name=model, temperature=temperature)
+            return self._langchain_models[key]
+
+    def _send(self, model, temperature, prompt, stop=None):
+        """
+        One request; returns (text, token usage).
+        """
+        return self.backend.complete(model, temperature, prompt, stop)
+
+    def _hedge_delay(self):
+        if self.hedge_after_seconds is not None:
+            return self.hedge_after_seconds
+        with self._lock:
+            if len(self._latencies) < self.min_hedge_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(int(self.hedge_percentile * len(ordered)), len(ordered) - 1)]
+
+    def _submit(self, model, temperature, prompt, reserved_tokens, stop):
+        future = self._executor.submit(contextvars.copy_context().run, self._send, model, temperature, prompt, stop)
+        # The slot is held until the request really ends, even when its answer is no longer needed
+        future.add_done_callback(self.concurrency.release)
+        future.add_done_callback(lambda done: self._settle(done, reserved_tokens))
+        return future
+
+    def _settle(self, future, reserved_tokens):
+        """
+        Corrects the token bucket with the usage of a finished request, winner or not (a failed one used none).
+        """
+        if future.exception() is not None:
+            self.rate_limiter.settle(reserved_tokens, 0)
+            return
+        usage = future.result()[1]
+        self.rate_limiter.settle(reserved_tokens, usage["total_tokens"])
+        self._count("prompt_tokens", usage["prompt_tokens"])
+        self._count("cached_prompt_tokens", usage["cached_tokens"])
+
+    def _attempt(self, model, temperature, prompt, reserved_tokens, stop):
+        self.concurrency.acquire()
+        start = time.perf_counter()
+        primary = self._submit(model, temperature, prompt, reserved_tokens, stop)
+        pending = {primary}
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None:
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done and self.concurrency.try_acquire():
+                if self.rate_limiter.try_acquire(reserved_tokens) == 0:
+                    self._count("hedged")
+                    pending.add(self._submit(model, temperature, prompt, reserved_tokens, stop))
+                else:
+                    self.concurrency.release()
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    with self._lock:
+                        self._latencies.append(time.perf_counter() - start)
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def complete(self, prompt, model="gpt-4o-mini", temperature=0):
+        """
+        Sends one prompt and returns the completion text, retrying retryable failures.
+        """
+        return self.generate(prompt, model, temperature)[0]
+
+    def generate(self, prompt, model="gpt-4o-mini", temperature=0, stop=None):
+        """
+        complete() returning (text, token usage), usage being None for an answer from the response cache. The
+        text ends before the first stop sequence; such truncated answers are not cached.
+        """
+        cache = self.cache if stop is None else None
+        if cache is not None:
+            cached = cache.get(model, temperature, prompt)
+            if cached is not None:
+                return cached, None
+        reserved_tokens = count_tokens(prompt) + EXPECTED_COMPLETION_TOKENS
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(reserved_tokens)
+            self._count("requests")
+            try:
+                text, usage = self._attempt(model, temperature, prompt, reserved_tokens, stop)
+            except Exception as e:
+                if is_throttled(e):
+                    self._count("throttled")
+                    self.concurrency.on_throttle()
+                if not is_retryable(e) or attempt == self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_cap_seconds, self.backoff_base_seconds * 2 ** attempt))
+                self._count("retries")
+                print(f"LLM request failed ({type(e).__name__}: {e}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.concurrency.on_success()
+            if cache is not None:
+                cache.put(model, temperature, prompt, text)
+            return text, usage
+
+    def run(self, prompt, inputs, model="gpt-4o-mini", temperature=0):
+        """
+        Renders a PromptTemplate (or a template string) with inputs and completes it; replaces LLMChain.run.
+        """
+        return self.complete(prompt.format(**inputs), model, temperature)
+
+    def prefix_cache_hit_rate(self):
+        """
+        Share of the prompt tokens sent that the provider served from its prefix cache (cached-input pricing).
+        """
+        with self._lock:
+            prompt_tokens = self.counters["prompt_tokens"]
+            return round(self.counters["cached_prompt_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0
+
+    def stats(self):
+        stats = dict(self.counters, concurrency_limit=self.concurrency.limit, hedge_after_seconds=self._hedge_delay(),
+                     prefix_cache_hit_rate=self.prefix_cache_hit_rate())
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+
+_gateway_chat_model_class = None
+
+
+def gateway_chat_model_class():
+    """
+    LangChain chat model over an LLMGateway (built on first use so this module does not need LangChain). Usage is
+    reported only for backends that get_openai_callback does not already see (the fake backend), so calls are
+    counted once.
+    """
+    global _gateway_chat_model_class
+    if _gateway_chat_model_class is None:
+        from typing import Any
+        from langchain_core.language_models.chat_models import BaseChatModel
+
+        class GatewayChatModel(BaseChatModel):
+            gateway: Any
+            model_name: str = "gpt-4o-mini"
+            temperature: float = 0
+
+            @property
+            def _llm_type(self):
+                return "llm-gateway"
+
+            def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+                # The ReAct agent renders its whole prompt into a single message
+                prompt = "\n".join(str(message.content) for message in messages)
+                text, usage = self.gateway.generate(prompt, self.model_name, self.temperature, stop)
+                return chat_result(text, None if self.gateway.backend.callback_counted else usage, self.model_name)
+
+        _gateway_chat_model_class = GatewayChatModel
+    return _gateway_chat_model_class
+
+
+_default_gateway = None
+_default_gateway_lock = threading.Lock()
+
+
+def configure_gateway(**options):
+    """
+    Replaces the process-wide gateway, e.g. configure_gateway(base_url="http://127.0.0.1:8765/v1") or, for an
+    offline re-run, configure_gateway(cache=ResponseCache(mode="cache_only")).
+    """
+    global _default_gateway
+    with _default_gateway_lock:
+        _default_gateway = LLMGateway(**options)
+        return _default_gateway
+
+
+def get_gateway():
+    """
+    Process-wide gateway. LLM_BACKEND=fake swaps in the deterministic FakeBackend (latency from
+    FAKE_LLM_LATENCY_SECONDS) so any script runs end to end without an API key.
+    """
+    global _default_gateway
+    with _default_gateway_lock:
+        if _default_gateway is None and os.environ.get("LLM_BACKEND", "openai") == "fake":
+            # Fake answers never go into the shared response cache
+            backend = FakeBackend(latency_seconds=float(os.environ.get("FAKE_LLM_LATENCY_SECONDS", 0.2)))
+            _default_gateway = LLMGateway(backend=backend, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)
+        if _default_gateway is None:
+            # All calls are temperature 0: re-runs reuse the responses already paid for
+            _default_gateway = LLMGateway(cache=ResponseCache())
+        return _default_gateway
@@ -5,26 +5,15 @@ from datetime import datetime
 from pathlib import Path
 import javalang
 from openai import OpenAI
-from langchain_openai import ChatOpenAI
 from langchain import PromptTemplate
 from langchain_core.prompts import PromptTemplate
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import LLMChain
+from llm_gateway import get_gateway
+from context_packer import pack_methods
+from prompt_layout import cacheable_template
+from structured_output import JUDGE_SCHEMA, RawResponseLog, StructuredOutputError, parse_structured
+from call_graph_index import load_existing_call_graph
 
 
-
-
-# Source Code Methods [from call graph of Stack Trace]
-def get_source_code_dict(filename, source_code_file_path):
-    with open(source_code_file_path, 'r') as f:
-        data = json.load(f)
-    
-    for entry in data:
-        if entry['filename'] == filename:
-            return entry.get('source_code', {})
-    
-    return {}
-
 # Code difference methods previously extracted [before and after commit]
 def get_code_diff_from_file(filename, input_file_path):
     with open(input_file_path, "r") as f:
@@ -38,6 +27,43 @@ def get_code_diff_from_file(filename, input_file_path):
 
 
 
+# Get the commit version before a specific timestamp
+def get_commit_version(creation_time, repo_path, git_branch):
+    command = f'git rev-list -n 1 --before="{creation_time}" {git_branch}'
+    result = subprocess.run(command, shell=True, capture_output=True, text=True, cwd=repo_path)
+    return result.stdout.strip()
+
+# Caller/callee hops between the reported problem location and the ground truth [from the persisted call graph]
+def call_graph_hop_distances(bug_report, ground_truth_methods, call_graph):
+    """
+    For each method in the report's problem_location, the fewest call-graph hops (callers or callees)
+    to any ground-truth method; None when no path exists or the method is not in the graph.
+    """
+    problem_location = bug_report.get("problem_location") if isinstance(bug_report, dict) else None
+    reported_methods = problem_location.get("methods", []) if isinstance(problem_location, dict) else []
+    target_ids = [call_graph.method_id(method) for method in ground_truth_methods]
+    target_ids = [method_id for method_id in target_ids if method_id is not None]
+
+    hops = {}
+    for method in reported_methods:
+        if isinstance(method, str):
+            hops[method] = call_graph.hop_distance(call_graph.method_ids_by_class_method(method), target_ids)
+    return hops
+
+
+
+
+
+# Inputs after the static rubric, most shared first: the same bug is judged for every report variant, so only the
+# bug report differs between those runs
+JUDGE_SECTIONS = [
+    ("Ground Truth Method Names", "{ground_truth_methods}"),
+    ("Ground Truth Methods (Before and After Code)", "{code_difference}"),
+    ("Source Code Methods (from the call dependency of the methods of stack traces)", "{source_code_methods}"),
+    ("Bug Report", "{bug_report}"),
+]
+
+
 def call_llm_judge(bug_report, ground_truth_methods, code_difference, source_code_methods):
     template = """
     You are a software engineering expert evaluating a bug report based on its ability to accurately describe and diagnose a real bug. You will be given:
@@ -83,32 +109,6 @@ def call_llm_judge(bug_report, ground_truth_methods, code_difference, source_cod
     - **Yes**: The bug report contains statements that are completely unrelated or incorrect.
     - **No**: All information appears grounded in the context of the bug.
 
-    ---
-
-    ### Bug Report:
-    {bug_report}
-
-    ---
-
-    ### Ground Truth Method Names:
-    {ground_truth_methods}
-
-    ---
-
-    ### Ground Truth Methods (Before and After Code):
-
-    {code_difference}
-
-    ---
-
-    ### Source Code Methods (from the call dependency of the methods of stack traces):
-
-    {source_code_methods}
-
-    ---
-
-
-
     Provide your response in the following JSON format:
     ```json
     {{
@@ -124,14 +124,11 @@ def call_llm_judge(bug_report, ground_truth_methods, code_difference, source_cod
         "wrong_information": "[Yes | No]",
         "explanation_of_judgement": "<brief justification for each evaluation>"
     }}
-
+    ```
     """
 
-    prompt = PromptTemplate.from_template(template)
-    llm = ChatOpenAI(model='gpt-4o', temperature = 0)
-
-    chain = LLMChain(llm=llm, prompt=prompt)
-    return chain.run({'bug_report': bug_report, 'ground_truth_methods': ground_truth_methods, 'code_difference': code_difference, 'source_code_methods': source_code_methods})
+    prompt = PromptTemplate.from_template(cacheable_template(template, JUDGE_SECTIONS))
+    return get_gateway().run(prompt, {'bug_report': bug_report, 'ground_truth_methods': ground_truth_methods, 'code_difference': code_difference, 'source_code_methods': source_code_methods}, model='gpt-4o')
 
 
 
@@ -147,8 +144,21 @@ ground_truth_methods_path = "data/ground_truth/method_level/Zookeeper.json"
 code_difference_path = "results/llm_judge/developer_written_bug_reports/Zookeeper.json"
 source_code_methods_from_call_graph = "data/source_code_data/Zookeeper.json"
 
+# Project checkout whose persisted call graphs (built by source_code_extractor_from_call_graph.py) give hop distances
+repo_path = "Projects/zookeeper"
+codebase_dirs = ['Projects/zookeeper/src/java/main']
+git_branch = "master"
+
+# Tokens of call-dependency source code per judge prompt
+context_token_budget = 30000
+# Compact the call-dependency code before judging (no comments, Javadoc or indentation; see source_compaction).
+# Off: judgements made with compacted code are not comparable with earlier results
+compact_code = False
+elide_log_statements = False
+
 # Output File Path
 output_file = "results/llm_judge/direct_llm/Zookeeper.json"
+raw_responses = RawResponseLog("results/llm_judge/direct_llm/Zookeeper.raw.jsonl")
 
 
 
@@ -156,10 +166,16 @@ with open(bug_report_path) as f:
     bug_reports = json.load(f)
 with open(ground_truth_methods_path) as f:
     gt_methods = json.load(f)
+# Parsed once: the call-graph source code and the developer stack trace (ranks the methods given to the judge) of each bug
+with open(source_code_methods_from_call_graph) as f:
+    source_code_data = json.load(f)
+source_code_map = {entry['filename']: entry.get('source_code', {}) for entry in source_code_data}
+stack_trace_map = {entry['filename']: entry.get('stack_trace', "") for entry in source_code_data}
 
 
 
 output_data = []
+tokens_saved = []
 
 
 processed_files = {entry['filename'] for entry in output_data}
@@ -185,26 +201,42 @@ for report in bug_reports:
     method_list = gt_methods.get(filename, [])
     
 
-    source_code_methods = get_source_code_dict(filename, source_code_methods_from_call_graph)
+    # Ranked against the stack trace and ground truth (not the judged report), so every report of a bug gets the same context
+    source_code_methods, packed = pack_methods(source_code_map.get(filename, {}), method_list, stack_trace_map.get(filename, ""), context_token_budget,
+                                               compact_code, elide_log_statements)
+    tokens_saved.append(packed["tokens_saved"])
     code_diff = get_code_diff_from_file(filename, code_difference_path)
 
 
+    call_graph_hops = None
+    if os.path.isdir(repo_path):
+        commit_version = get_commit_version(creation_time, repo_path, git_branch)
+        call_graph = load_existing_call_graph(repo_path, commit_version, codebase_dirs) if commit_version else None
+        if call_graph is not None:
+            call_graph_hops = call_graph_hop_distances(bug_report, method_list, call_graph)
+
+
     judgement_str = call_llm_judge(bug_report, method_list, code_diff, source_code_methods)
-    # Parse the judgement reponse JSON from the generated string
+    # Parse the judgement reponse JSON from the generated string (repairing it when needed); the raw answer is
+    # logged whatever the outcome
     try:
-        # Remove any markdown-style code block indicators (` ```json `) if present
-        judgement = json.loads(judgement_str.replace("```json\n", "").replace("\n```", ""))
-    except json.JSONDecodeError:
-        print(f"Failed to parse JSON for filename: {filename}")
+        judgement, outcome = parse_structured(judgement_str, JUDGE_SCHEMA)
+    except StructuredOutputError as e:
+        raw_responses.record(filename, judgement_str, e.outcome, "judge")
+        print(f"Failed to parse JSON for filename: {filename} ({e})")
         continue  # Skip this entry if JSON parsing fails
+    raw_responses.record(filename, judgement_str, outcome, "judge")
 
 
     # Add to output data
-    output_data.append({
+    output_entry = {
         'filename': filename,
         'code_diff': code_diff,
         'llm_judgement': judgement
-    })
+    }
+    if call_graph_hops is not None:
+        output_entry['call_graph_hops'] = call_graph_hops
+    output_data.append(output_entry)
 
     # Write to output file after each bug report
     with open(output_file, "w") as outfile:
@@ -212,4 +244,8 @@ for report in bug_reports:
     print(f"Progress saved to {output_file}")
 
 
-print(f"LLM Judgement have been generated and saved to '{output_file}'")
\ No newline at end of file
+print(f"LLM Judgement have been generated and saved to '{output_file}'")
+print(f"Parsed responses: {raw_responses.summary()}")
+if compact_code:
+    print(f"Source compaction saved {sum(tokens_saved)} tokens ({sum(tokens_saved) / max(len(tokens_saved), 1):.0f} per prompt)")
+print(f"Prompt prefix cache hit rate: {get_gateway().prefix_cache_hit_rate():.1%}")
\ No newline at end of file
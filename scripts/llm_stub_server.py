@@ -0,0 +1,109 @@
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local OpenAI-compatible server (POST /v1/chat/completions) for exercising llm_gateway.py offline: configurable
+# latency with a slow tail, and injected 429s / 5xx to test retries, adaptive concurrency and hedging.
+# Point the gateway at it with configure_gateway(base_url="http://127.0.0.1:8765/v1") and any OPENAI_API_KEY.
+
+
+def approximate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def stub_reply(messages):
+    """
+    Default completion: a short, fixed text that depends only on the prompt size.
+    """
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    return f"Stub response to a {approximate_tokens(prompt)}-token prompt."
+
+
+def make_stub_server(host="127.0.0.1", port=8765, latency_seconds=0.2, slow_fraction=0.05, slow_latency_seconds=3.0,
+                     throttle_rate=0.0, error_rate=0.0, reply=stub_reply, seed=0):
+    """
+    Returns a ThreadingHTTPServer (not started). reply(messages) -> str produces the completion text.
+    """
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    stats = {"requests": 0, "throttled": 0, "errors": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}, {"id": "gpt-4o", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with rng_lock:
+                stats["requests"] += 1
+                draw = rng.random()
+                slow = rng.random() < slow_fraction
+            if draw < throttle_rate:
+                stats["throttled"] += 1
+                self._send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}}, {"Retry-After": "0.1"})
+                return
+            if draw < throttle_rate + error_rate:
+                stats["errors"] += 1
+                self._send_json(503, {"error": {"message": "Service unavailable (stub)", "type": "server_error"}})
+                return
+
+            time.sleep(slow_latency_seconds if slow else latency_seconds)
+            messages = request.get("messages", [])
+            content = reply(messages)
+            prompt_tokens = approximate_tokens("\n".join(str(message.get("content", "")) for message in messages))
+            completion_tokens = approximate_tokens(content)
+            self._send_json(200, {
+                "id": f"chatcmpl-stub-{stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+
+if __name__ == "__main__":
+    host = "127.0.0.1"
+    port = 8765
+    latency_seconds = 0.2
+    slow_fraction = 0.05
+    slow_latency_seconds = 3.0
+    throttle_rate = 0.1
+    error_rate = 0.02
+
+    server = make_stub_server(host, port, latency_seconds, slow_fraction, slow_latency_seconds, throttle_rate, error_rate)
+    print(f"LLM stub listening on http://{host}:{port}/v1 (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {server.stats}")
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import time
+import statistics
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from llm_backends import FakeBackend
+from llm_gateway import LLMGateway
+from method_registry import MethodRegistry
+
+# Offline throughput benchmark of the report -> fix -> judge stages: every bug of the project goes through the
+# three stage prompts on an LLMGateway backed by the deterministic FakeBackend (no network, no API key), once per
+# concurrency level. Reports calls/s, tokens/s, latency percentiles, peak Python memory, the simulated prefix
+# cache hit rate and the share of responses that parse as the stage's JSON schema. To run a generator itself offline, set LLM_BACKEND=fake.
+project = "Zookeeper"
+input_file = f"data/source_code_data/{project}.json"
+output_file = f"results/llm_throughput_benchmark/{project}.json"
+
+concurrency_levels = [1, 2, 4, 8, 16, 32]
+max_bugs = 50
+latency_seconds = 0.2
+latency_jitter_seconds = 0.1
+# None measures the token counts of the actual prompts and answers
+prompt_tokens = None
+completion_tokens = None
+
+FRAME_PATTERN = re.compile(r'((?:[a-zA-Z_][\w$]*\.)+[A-Z][\w$]*\.[a-zA-Z_][\w$]*)\s*\(.*?\)')
+
+# Stage prompts with the output schemas of the generators (direct_llm_generator.py,
+# direct_llm_possible_fix_code_generator.py, llm_judge.py), which run their work at import time
+REPORT_TEMPLATE = '''Enhance the bug report below. Return JSON with the keys "Title", "Description", "StackTrace", "RootCause",
+"StepsToReproduce", "ExpectedBehavior", "ObservedBehavior", "Suggestions", "problem_location" and "possible_fix".
+
+## Developer-Written Bug Report:
+{bug_report}
+
+## Source Code Methods:
+{source_code_methods}
+'''
+FIX_TEMPLATE = '''Return the fixed code of the faulty methods as JSON: {{"possible_fix_code": {{"<method>": "<code>"}}}}.
+
+## Bug Report:
+{bug_report}
+
+## Source Code Methods:
+{source_code_methods}
+'''
+JUDGE_TEMPLATE = '''Judge the generated bug report against the ground truth. Return JSON with "root_cause_identification",
+"fix_suggestion", "problem_location_identification", "wrong_information" and "explanation_of_judgement".
+
+## Ground Truth Methods:
+{ground_truth}
+
+## Generated Bug Report:
+{bug_report}
+'''
+STAGE_KEYS = {
+    "report": {"Title", "RootCause", "problem_location"},
+    "fix": {"possible_fix_code"},
+    "judge": {"root_cause_identification", "fix_suggestion", "wrong_information"},
+}
+
+
+def load_bugs(path, limit):
+    with open(path, "r") as f:
+        data = json.load(f)
+    bugs = []
+    for item in data[:limit]:
+        source_code = item.get("source_code", {})
+        registry = MethodRegistry(source_code)
+        methods = {}
+        for method_path in sorted(set(FRAME_PATTERN.findall(item.get("stack_trace", "")))):
+            for key in registry.suffix_matches(method_path):
+                methods[key] = source_code[key]
+        bugs.append({"filename": item["filename"], "bug_report": item.get("bug_report", {}), "source_code_methods": methods})
+    return bugs
+
+
+def parse_json(text):
+    try:
+        return json.loads(text.replace("```json\n", "").replace("\n```", ""))
+    except json.JSONDecodeError:
+        return None
+
+
+def run_bug(gateway, bug):
+    """
+    The three stages of one bug in order; returns [(stage, latency seconds, schema valid)].
+    """
+    results = []
+    stages = [
+        ("report", REPORT_TEMPLATE, lambda report: {"bug_report": bug["bug_report"], "source_code_methods": bug["source_code_methods"]}),
+        ("fix", FIX_TEMPLATE, lambda report: {"bug_report": report, "source_code_methods": bug["source_code_methods"]}),
+        ("judge", JUDGE_TEMPLATE, lambda report: {"ground_truth": list(bug["source_code_methods"]), "bug_report": report}),
+    ]
+    report = bug["bug_report"]
+    for stage, template, inputs in stages:
+        start = time.perf_counter()
+        answer = gateway.run(template, inputs(report), model="gpt-4o-mini")
+        parsed = parse_json(answer)
+        results.append((stage, time.perf_counter() - start, parsed is not None and STAGE_KEYS[stage] <= set(parsed)))
+        if stage == "report" and parsed is not None:
+            report = parsed
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def benchmark(bugs, concurrency):
+    backend = FakeBackend(latency_seconds, latency_jitter_seconds, prompt_tokens, completion_tokens)
+    # Limits high enough that only the concurrency level bounds throughput
+    gateway = LLMGateway(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9, initial_concurrency=concurrency,
+                         max_concurrency=concurrency, backend=backend)
+    tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = [result for bug_results in pool.map(lambda bug: run_bug(gateway, bug), bugs) for result in bug_results]
+    elapsed = time.perf_counter() - start
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = [latency for _, latency, _ in results]
+    return {
+        "calls": len(results),
+        "seconds": round(elapsed, 2),
+        "calls_per_second": round(len(results) / elapsed, 2),
+        "tokens_per_second": round(backend.tokens / elapsed, 1),
+        "latency_p50_seconds": round(statistics.median(latencies), 3),
+        "latency_p95_seconds": round(percentile(latencies, 0.95), 3),
+        "peak_memory_mb": round(peak_bytes / 1024 ** 2, 2),
+        "schema_valid": {stage: round(statistics.mean(valid for name, _, valid in results if name == stage), 3) for stage in STAGE_KEYS},
+        "gateway": gateway.stats(),
+    }
+
+
+if __name__ == "__main__":
+    bugs = load_bugs(input_file, max_bugs)
+    print(f"{len(bugs)} {project} bugs x {len(STAGE_KEYS)} stages, fake latency {latency_seconds}s (+{latency_jitter_seconds}s)")
+    print(f"{'concurrency':>12}{'calls/s':>10}{'tokens/s':>12}{'p50 s':>8}{'p95 s':>8}{'peak MB':>9}{'cached':>8}{'speedup':>9}")
+    levels = {}
+    for concurrency in concurrency_levels:
+        levels[concurrency] = benchmark(bugs, concurrency)
+        result = levels[concurrency]
+        speedup = result["calls_per_second"] / levels[concurrency_levels[0]]["calls_per_second"]
+        print(f"{concurrency:>12}{result['calls_per_second']:>10}{result['tokens_per_second']:>12}{result['latency_p50_seconds']:>8}"
+              f"{result['latency_p95_seconds']:>8}{result['peak_memory_mb']:>9}{result['gateway']['prefix_cache_hit_rate']:>8.1%}{speedup:>8.1f}x")
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump({"project": project, "bugs": len(bugs), "latency_seconds": latency_seconds, "levels": levels}, f, indent=4)
+    print(f"Benchmark saved to '{output_file}'")
@@ -0,0 +1,208 @@
+import bisect
+from array import array
+from collections import namedtuple
+import javalang
+from javalang.tokenizer import Keyword, Operator, Separator
+from javalang.tree import (
+    AnnotationDeclaration, ClassDeclaration, ConstructorDeclaration, EnumDeclaration,
+    InterfaceDeclaration, MethodDeclaration
+)
+
+
+TYPE_DECLARATIONS = (ClassDeclaration, InterfaceDeclaration, EnumDeclaration, AnnotationDeclaration)
+OPENING_BRACKETS = {"(": ")", "[": "]", "{": "}"}
+
+# kind: 'class' (named or anonymous type body), 'method', 'constructor' or 'lambda'
+# class_name: binary name of the enclosing class (Outer$Inner, Outer$1); method_name: enclosing method
+LineInterval = namedtuple("LineInterval", "start end kind name class_name method_name")
+
+
+class MethodLineIndex:
+    """
+    Line intervals of every type body, method, constructor and lambda in one Java file, sorted by start line.
+    A stack frame's (file, line) resolves to its innermost enclosing interval by bisecting the start-line
+    array and walking up the (usually very short) parent chain.
+    """
+
+    def __init__(self, intervals, parents):
+        self.intervals = intervals
+        self.starts = array('i', (interval.start for interval in intervals))
+        self.ends = array('i', (interval.end for interval in intervals))
+        self.parents = array('i', parents)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def innermost(self, line):
+        """
+        The innermost method, lambda or class body containing line, or None.
+        """
+        index = bisect.bisect_right(self.starts, line) - 1
+        while index >= 0:
+            if self.ends[index] >= line:
+                return self.intervals[index]
+            index = self.parents[index]
+        return None
+
+    def enclosing_method(self, line):
+        """
+        The nearest method or constructor containing line (lambdas resolve to the method that declares them).
+        """
+        index = bisect.bisect_right(self.starts, line) - 1
+        while index >= 0:
+            interval = self.intervals[index]
+            if self.ends[index] >= line and interval.kind in ("method", "constructor"):
+                return interval
+            index = self.parents[index]
+        return None
+
+    def methods_named(self, method_name):
+        return [interval for interval in self.intervals if interval.kind in ("method", "constructor") and interval.name == method_name]
+
+
+def _match_brackets(tokens):
+    matching = {}
+    stack = []
+    for index, token in enumerate(tokens):
+        if not isinstance(token, Separator):
+            continue
+        if token.value in OPENING_BRACKETS:
+            stack.append(index)
+        elif token.value in (")", "]", "}") and stack:
+            matching[stack.pop()] = index
+    return matching
+
+
+def _token_index_at(tokens, token_positions, position):
+    index = bisect.bisect_left(token_positions, (position.line, position.column))
+    return min(index, len(tokens) - 1)
+
+
+def _declaration_end(tokens, matching, index):
+    """
+    Index of the token closing a declaration that starts at index: the '}' of its body, or ';' when it has none.
+    """
+    while index < len(tokens):
+        value = tokens[index].value if isinstance(tokens[index], Separator) else None
+        if value == "{":
+            return matching.get(index, len(tokens) - 1)
+        if value == ";":
+            return index
+        if value in ("(", "[") and index in matching:
+            index = matching[index]
+        index += 1
+    return len(tokens) - 1
+
+
+def _expression_end(tokens, index):
+    """
+    Index of the last token of an expression starting at index (ends before ',', ';' or an unmatched closer).
+    """
+    depth = 0
+    last = index
+    while index < len(tokens):
+        token = tokens[index]
+        if isinstance(token, Separator):
+            if token.value in OPENING_BRACKETS:
+                depth += 1
+            elif token.value in (")", "]", "}"):
+                if depth == 0:
+                    return last
+                depth -= 1
+            elif token.value in (",", ";") and depth == 0:
+                return last
+        last = index
+        index += 1
+    return last
+
+
+def build_method_line_index(content, tree=None):
+    """
+    Builds the line index of a Java source file. Pass an already parsed tree to avoid parsing twice.
+    """
+    tokens = list(javalang.tokenizer.tokenize(content))
+    if tree is None:
+        tree = javalang.parse.parse(content)
+    if not tokens:
+        return MethodLineIndex([], [])
+    token_positions = [(t.position.line, t.position.column) for t in tokens]
+    matching = _match_brackets(tokens)
+
+    # (start index, end index, kind, simple name)
+    raw = []
+    for _, node in tree:
+        if not isinstance(node, TYPE_DECLARATIONS + (MethodDeclaration, ConstructorDeclaration)) or not node.position:
+            continue
+        start = _token_index_at(tokens, token_positions, node.position)
+        kind = "class" if isinstance(node, TYPE_DECLARATIONS) else "method" if isinstance(node, MethodDeclaration) else "constructor"
+        raw.append((start, _declaration_end(tokens, matching, start), kind, node.name))
+
+    for index, token in enumerate(tokens):
+        if isinstance(token, Keyword) and token.value == "new":
+            # Anonymous class: new Type(args) { ... }
+            scan = index + 1
+            while scan < len(tokens) and not (isinstance(tokens[scan], Separator) and tokens[scan].value in ("(", "[", "{", ";")):
+                scan += 1
+            if scan < len(tokens) and tokens[scan].value == "(" and scan in matching:
+                body = matching[scan] + 1
+                if body < len(tokens) and tokens[body].value == "{" and body in matching:
+                    raw.append((index, matching[body], "anonymous", None))
+        elif isinstance(token, Operator) and token.value == "->":
+            body = index + 1
+            if body < len(tokens) and tokens[body].value == "{" and body in matching:
+                raw.append((index, matching[body], "lambda", None))
+            elif body < len(tokens):
+                raw.append((index, _expression_end(tokens, body), "lambda", None))
+
+    raw.sort(key=lambda r: (r[0], -r[1]))
+
+    package = tree.package.name if tree.package else ""
+    intervals = []
+    parents = []
+    stack = []
+    counters = {}
+    for start, end, kind, name in raw:
+        while stack and stack[-1][1] < start:
+            stack.pop()
+        parent = stack[-1][0] if stack else -1
+
+        enclosing_class = None
+        enclosing_method = None
+        ancestor = parent
+        while ancestor >= 0:
+            interval = intervals[ancestor]
+            if enclosing_method is None and interval.kind in ("method", "constructor"):
+                enclosing_method = interval.name
+            if interval.kind == "class":
+                enclosing_class = interval.name
+                break
+            ancestor = parents[ancestor]
+
+        if kind == "class":
+            class_name = f"{enclosing_class}${name}" if enclosing_class else (f"{package}.{name}" if package else name)
+            interval = LineInterval(token_positions[start][0], token_positions[end][0], "class", class_name, class_name, None)
+        elif kind == "anonymous":
+            counters[enclosing_class] = counters.get(enclosing_class, 0) + 1
+            class_name = f"{enclosing_class}${counters[enclosing_class]}"
+            interval = LineInterval(token_positions[start][0], token_positions[end][0], "class", class_name, class_name, None)
+        elif kind == "lambda":
+            key = (enclosing_class, "lambda")
+            counters[key] = counters.get(key, 0)
+            lambda_name = f"lambda${enclosing_method or 'static'}${counters[key]}"
+            counters[key] += 1
+            interval = LineInterval(token_positions[start][0], token_positions[end][0], "lambda", lambda_name, enclosing_class, enclosing_method)
+        else:
+            method_name = name if kind == "method" else "<init>"
+            interval = LineInterval(token_positions[start][0], token_positions[end][0], kind, method_name, enclosing_class, method_name)
+
+        intervals.append(interval)
+        parents.append(parent)
+        stack.append((len(intervals) - 1, end))
+    return MethodLineIndex(intervals, parents)
+
+
+def interval_source(content, interval):
+    """
+    Source lines of an interval (1-based, inclusive).
+    """
+    return "\n".join(content.splitlines()[interval.start - 1:interval.end])
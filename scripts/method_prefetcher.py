@@ -0,0 +1,89 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import javalang
+from call_graph_index import extract_method_code
+from method_registry import RegistryDict
+
+
+# Callees warmed per retrieved method; a method calling more than this is usually a dispatcher
+MAX_PREFETCHED_CALLEES = 16
+
+
+class MethodPrefetcher:
+    """
+    Speculatively resolves the callees of the method the agent just received, and the skeletons of their
+    classes, on a background thread while the agent waits on the LLM. The next `Provide Method` request for
+    one of them is then served from memory instead of walking and parsing files.
+
+    Callees come from the per-commit call graph (call_graph_index.CallGraphIndex); prefetched methods are
+    keyed like the agent's method_cache ('src.java.main.org.x.Foo.bar').
+    """
+
+    def __init__(self, call_graph, repo_path, skeleton_builder, max_callees=MAX_PREFETCHED_CALLEES):
+        self.call_graph = call_graph
+        self.repo_path = repo_path
+        self.skeleton_builder = skeleton_builder
+        self.max_callees = max_callees
+        self.methods = RegistryDict()
+        self.skeletons = {}
+        self.requests = 0
+        self.hits = 0
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="method-prefetch")
+
+    def schedule(self, method_name):
+        """
+        Queues the callees of method_name ('pkg.Class.method' or 'Class.method') for warming. Returns at once.
+        """
+        method_name = method_name.split("(", 1)[0].strip()
+        callee_ids = []
+        for method_id in self.call_graph.method_ids_by_class_method(method_name):
+            for callee_id in self.call_graph.callees(method_id):
+                if callee_id not in self._scheduled and len(callee_ids) < self.max_callees:
+                    self._scheduled.add(callee_id)
+                    callee_ids.append(callee_id)
+        if callee_ids:
+            self._executor.submit(self._warm, callee_ids)
+
+    def _warm(self, method_ids):
+        by_file = {}
+        for method_id in method_ids:
+            relative_path, line = self.call_graph.method_locations[method_id]
+            by_file.setdefault(relative_path, []).append((method_id, line))
+
+        for relative_path, methods in by_file.items():
+            class_key = relative_path[:-5].replace("/", ".")
+            try:
+                with open(os.path.join(self.repo_path, relative_path), "r") as f:
+                    content = f.read()
+                skeleton = None
+                if class_key not in self.skeletons:
+                    skeleton = self.skeleton_builder(javalang.parse.parse(content))
+            except Exception as e:
+                print(f"Error prefetching from {relative_path}: {e}")
+                continue
+            codes = [(self.call_graph.method_names[method_id], extract_method_code(content, line)) for method_id, line in methods]
+            with self._lock:
+                if skeleton is not None:
+                    self.skeletons[class_key] = skeleton
+                for method_key, code in codes:
+                    self.methods[method_key] = code
+
+    def lookup(self, class_method_name):
+        """
+        Returns (method key, code, class key, class skeleton) of a prefetched method, or None.
+        """
+        with self._lock:
+            self.requests += 1
+            matches = self.methods.keys_ending_with(class_method_name, proper=True)
+            if not matches:
+                return None
+            self.hits += 1
+            method_key = matches[0]
+            class_key = method_key.rsplit(".", 1)[0]
+            return method_key, self.methods[method_key], class_key, self.skeletons.get(class_key)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,104 @@
+def name_tokens(name):
+    """
+    'org.x.Outer$Inner.run' -> ['org', 'x', 'Outer', 'run']. Method keys are file based, so inner-class
+    suffixes are dropped from class tokens; synthetic method names (lambda$run$0) are kept whole.
+    """
+    tokens = name.strip().strip(".").split(".")
+    normalized = [token.split("$", 1)[0] or token for token in tokens[:-1]]
+    last = tokens[-1]
+    if last[:1].isupper():
+        last = last.split("$", 1)[0] or last
+    return normalized + [last]
+
+
+class MethodRegistry:
+    """
+    Interns fully qualified method/class names to integer ids and indexes them in a trie over their
+    reversed dot-separated tokens, so 'method', 'Class.method' or 'pkg.Class.method' suffix lookups cost
+    time proportional to the query length instead of a scan over every name.
+
+    Trie nodes are [ids, children]: ids lists, in interning order, every name whose token suffix leads
+    to the node; children maps the next (lower-cased) token to its node.
+    """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        self._tokens = []
+        self._trie = [[], {}]
+        for name in names:
+            self.intern(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def intern(self, name):
+        method_id = self.ids.get(name)
+        if method_id is None:
+            method_id = len(self.names)
+            self.ids[name] = method_id
+            self.names.append(name)
+            tokens = name_tokens(name)
+            self._tokens.append(tokens)
+            node = self._trie
+            for token in reversed(tokens):
+                node = node[1].setdefault(token.lower(), [[], {}])
+                node[0].append(method_id)
+        return method_id
+
+    def suffix_ids(self, suffix, ignore_case=False, proper=False):
+        """
+        Ids of the names ending with the token suffix ('run', 'Foo.run', 'Outer$Inner.run').
+        proper=True drops the names that are the suffix itself (the '.endswith(f".{suffix}")' semantics).
+        """
+        if not suffix or not suffix.strip().strip("."):
+            return []
+        query = name_tokens(suffix)
+        node = self._trie
+        for token in reversed(query):
+            node = node[1].get(token.lower())
+            if node is None:
+                return []
+        ids = node[0]
+        if not ignore_case:
+            ids = [i for i in ids if self._tokens[i][-len(query):] == query]
+        if proper:
+            ids = [i for i in ids if len(self._tokens[i]) > len(query)]
+        return ids
+
+    def suffix_matches(self, suffix, ignore_case=False, proper=False):
+        return [self.names[i] for i in self.suffix_ids(suffix, ignore_case, proper)]
+
+    def first_match(self, suffix, ignore_case=False, proper=False):
+        ids = self.suffix_ids(suffix, ignore_case, proper)
+        return self.names[ids[0]] if ids else None
+
+
+class RegistryDict(dict):
+    """
+    dict whose keys are interned in a MethodRegistry as they are inserted, for caches that are
+    looked up by name suffix. Keys are never removed from the registry.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.registry = MethodRegistry(self.keys())
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.registry.intern(key)
+
+    def setdefault(self, key, default=None):
+        self.registry.intern(key)
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        for key in self.keys():
+            self.registry.intern(key)
+
+    def keys_ending_with(self, suffix, ignore_case=False, proper=False):
+        return [key for key in self.registry.suffix_matches(suffix, ignore_case, proper) if key in self]
@@ -0,0 +1,41 @@
+import re
+import textwrap
+from token_budget import count_tokens
+
+
+# OpenAI caches prompt prefixes of at least 1024 tokens (in 128-token steps): only the identical leading bytes count
+PREFIX_CACHE_MIN_TOKENS = 1024
+PLACEHOLDER_PATTERN = re.compile(r"(?<!\{)\{(\w+)\}(?!\})")
+
+
+def cacheable_template(instructions, sections):
+    """
+    PromptTemplate text laid out for provider prefix caching: the static instructions first, dedented and
+    stripped so they are byte-identical however the source is indented, then one "# title" section per input.
+    sections is [(title, body)], body being template text such as "{bug_report}", ordered from the input shared
+    by most calls to the one that changes on every call. instructions is template text (literal braces escaped
+    as {{ }}) and must not contain placeholders.
+    """
+    instructions = textwrap.dedent(instructions).strip()
+    if PLACEHOLDER_PATTERN.search(instructions):
+        raise ValueError(f"Static instructions contain a placeholder: {PLACEHOLDER_PATTERN.search(instructions).group(0)}")
+    parts = [instructions] + [f"# {title}:\n\n{body}" for title, body in sections]
+    return "\n\n\n".join(parts) + "\n"
+
+
+def static_prefix(template):
+    """
+    The template text before its first placeholder, i.e. the part every rendered prompt shares.
+    """
+    match = PLACEHOLDER_PATTERN.search(template)
+    prefix = template[:match.start()] if match else template
+    return prefix.replace("{{", "{").replace("}}", "}")
+
+
+def describe_prefix(name, template):
+    """
+    One line on the shared prefix of a template, for the scripts to print at start-up.
+    """
+    tokens = count_tokens(static_prefix(template))
+    note = "cacheable" if tokens >= PREFIX_CACHE_MIN_TOKENS else f"below the {PREFIX_CACHE_MIN_TOKENS}-token caching minimum"
+    return f"{name}: static prompt prefix of {tokens} tokens ({note})"
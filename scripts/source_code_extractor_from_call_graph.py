@@ -1,9 +1,16 @@
 import os
 import json
+import heapq
+import shutil
+import itertools
 import subprocess
+import multiprocessing
 import javalang
 from collections import defaultdict
-from collections import deque
+from java_symbol_table import build_symbol_table, simple_class_name, top_level_class
+from call_graph_index import load_or_build_call_graph
+from method_line_index import build_method_line_index, interval_source
+from token_budget import count_tokens
 
 
 # Step 1: Read Stack Traces from JSON
@@ -57,22 +64,9 @@ def extract_method_code(file_content, method_position):
 
 
 
-def resolve_variable_type_with_javalang(variable_name, tree):
+def extract_methods_and_calls(file_path, repo_path):
     """
-    Resolves the class type of a given variable by analyzing the AST with javalang.
-    """
-    for path, local_var in tree.filter(javalang.tree.LocalVariableDeclaration):
-        for declarator in local_var.declarators:
-            if declarator.name == variable_name:
-                if hasattr(local_var.type, 'name'):
-                    return local_var.type.name
-    return None
-
-
-
-def extract_methods_and_calls(file_path):
-    """
-    Extracts method declarations and method calls from the provided Java file.
+    Extracts method declarations and method calls from the provided Java file; method keys are relative to repo_path.
     """
     methods = {}
     call_graph = {}
@@ -83,7 +77,8 @@ def extract_methods_and_calls(file_path):
 
         # Parse the Java file with javalang
         tree = javalang.parse.parse(content)
-        temp_tree = tree
+        # One pass over the compilation unit: scoped locals, parameters, fields and imports
+        symbols = build_symbol_table(tree)
 
         for _, method in tree.filter(javalang.tree.MethodDeclaration):
             method_name = method.name
@@ -100,15 +95,10 @@ def extract_methods_and_calls(file_path):
             method_code = extract_method_code(content, method.position)
             methods[method_key] = method_code
 
-            # Add method calls to call graph
+            # Add method calls to call graph, keyed by the fully qualified owner type where it resolves
+            scope = symbols.scope_of(method)
             for _, call in method.filter(javalang.tree.MethodInvocation):
-                qualifier_name = call.qualifier
-                if qualifier_name and qualifier_name[0].islower():  # Object detected
-                    actual_class_name = resolve_variable_type_with_javalang(qualifier_name, temp_tree)
-                    # print("actual_class_name:", actual_class_name)
-                    if actual_class_name:
-                        qualifier_name = actual_class_name
-                    # print("qualifier_name:", qualifier_name)
+                qualifier_name = symbols.resolve_call_owner(call, scope) or call.qualifier
                 call_graph.setdefault(method_key, []).append(f'{qualifier_name}.{call.member}')
                 # print(f'call.member: {qualifier_name}.{call.member}')
 
@@ -179,33 +169,104 @@ def parse_stack_trace(stack_trace, codebase_dirs):
     return method_files
 
 
+# Line index of a stack-frame file: (content, MethodLineIndex), or (None, None) if it does not parse
+def load_method_line_index(file_path):
+    try:
+        with open(file_path, 'r') as file:
+            content = file.read()
+        return content, build_method_line_index(content)
+    except Exception as e:
+        print(f"Error indexing lines of {file_path}: {e}")
+        return None, None
+
+
 # Step 6: Navigate code using the call graph
-def navigate_code(stack_trace, codebase_dirs):
+def navigate_code(stack_trace, codebase_dirs, max_hops=None, max_methods=None, max_tokens=None, class_hierarchy=None, repo_path=None):
+    """
+    Extracts methods reachable from the stack-trace frames. The queue is ordered by
+    (hops from the frames, rank of the originating frame, discovery order), so when a budget is set
+    the methods closest to the top frames are kept:
+      - max_hops: do not follow calls further than this many hops from a frame
+      - max_methods: stop after this many extracted methods
+      - max_tokens: skip methods that would push the extracted source over this token budget
+    With no budget every reachable method is extracted. With a class_hierarchy, calls through interfaces,
+    abstract classes and inherited methods are followed to their concrete implementations.
+    Method keys, and the class_hierarchy's file paths, are relative to repo_path (required).
+    Frames are resolved by their line number to the enclosing method, so overloads, lambdas and
+    anonymous classes map to the method the frame actually points at.
+    """
+    if repo_path is None:
+        raise ValueError("navigate_code needs the repo_path the method keys are relative to")
     method_files = parse_stack_trace(stack_trace, codebase_dirs)
+    frame_lines = {}
+    for class_name, method_name, _, line_number in parse_stack_frames(stack_trace):
+        if line_number is not None:
+            frame_lines.setdefault((method_name, class_name), line_number)
+    line_indexes = {}
     # print("method_files:", method_files)
     visited_methods = set()
     extracted_methods = {}
     call_graph = defaultdict(list)
+    parsed_files = {}
+    used_tokens = 0
+    discovery_order = itertools.count()
+    # Same-file callees waiting in the queue, by discovery order: (method key, source); stored when popped, not expanded
+    queued_callees = {}
+
+    def store_method(method_key, method_code):
+        nonlocal used_tokens
+        if max_tokens is not None:
+            method_tokens = count_tokens(method_code)
+            if used_tokens + method_tokens > max_tokens:
+                return False
+            used_tokens += method_tokens
+        extracted_methods[method_key] = method_code
+        return True
 
     # Step 1: Initialize priority queue with stack trace methods
-    priority_list = deque([(method_name, class_name) for (method_name, class_name) in method_files.keys()])
+    priority_list = [
+        (0, rank, next(discovery_order), method_name, class_name)
+        for rank, (method_name, class_name) in enumerate(method_files.keys())
+    ]
+    heapq.heapify(priority_list)
 
     while priority_list:
+        if max_methods is not None and len(extracted_methods) >= max_methods:
+            break
         # print("priority_list:", priority_list)
-        method_name, class_name = priority_list.popleft()  # Process the next method
-
+        hops, rank, order, method_name, class_name = heapq.heappop(priority_list)  # Process the next method
+        if order in queued_callees:
+            method_key, method_code = queued_callees.pop(order)
+            if method_key not in visited_methods:
+                visited_methods.add(method_key)
+                store_method(method_key, method_code)
+            continue
 
         # Get the file path where this method is defined
         file_path = method_files.get((method_name, class_name))
         if not file_path or not os.path.exists(file_path):
             continue  # Skip if file doesn't exist
 
-        # Step 2: Extract methods and call relationships
-        methods, calls = extract_methods_and_calls(file_path)
+        # Step 2: Extract methods and call relationships [each file is parsed once per stack trace]
+        if file_path not in parsed_files:
+            parsed_files[file_path] = extract_methods_and_calls(file_path, repo_path)
+        methods, calls = parsed_files[file_path]
         # print("methods:", methods)
         # print("calls:", calls)
         call_graph.update(calls)
 
+        # Resolve the frame line to its enclosing method [exact overload; lambda$/access$ frames to their declaring method]
+        frame_code = None
+        frame_line = frame_lines.get((method_name, class_name)) if hops == 0 else None
+        if frame_line is not None:
+            if file_path not in line_indexes:
+                line_indexes[file_path] = load_method_line_index(file_path)
+            content, line_index = line_indexes[file_path]
+            enclosing = line_index.enclosing_method(frame_line) if line_index is not None else None
+            if enclosing is not None and enclosing.kind == "method":
+                method_name = enclosing.name
+                frame_code = interval_source(content, enclosing)
+
         # Normalize method name to match extracted method format
         method_key = None
         for key in methods.keys():
@@ -217,50 +278,69 @@ def navigate_code(stack_trace, codebase_dirs):
             continue
 
         # Step 3: Store extracted method and mark as visited
-        extracted_methods[method_key] = methods[method_key]
         visited_methods.add(method_key)
+        if not store_method(method_key, frame_code or methods[method_key]):
+            continue  # Over the token budget
 
         # Step 4: Add all reachable methods to priority list if not visited
+        if max_hops is not None and hops + 1 > max_hops:
+            continue
         if method_key in call_graph:
             # print("method_key:", method_key)
             # print('methods.keys():', methods.keys())
-            for called_method in set(call_graph[method_key]):  # Ensure unique method names
+            for called_method in sorted(set(call_graph[method_key])):  # Ensure unique method names
                 # print("called_method:", called_method)
                 # print("set(call_graph[method_key]):", set(call_graph[method_key]))
                 # Find the full qualified name of the called method
-                called_class_name = called_method.split(".")[0]
-                called_method_name = called_method.split(".")[1]
+                called_class_fqn, _, called_method_name = called_method.rpartition(".")
+                called_class_name = simple_class_name(called_class_fqn)
                 called_method_key = None
                 for extracted_key in methods.keys():
                     if extracted_key.endswith(f".{called_method_name}"):
                         called_method_key = extracted_key
                         break
 
-                # Search for `called_class.java` in `codebase_dirs`
-                if not called_method_key:
+                # Virtual dispatch: queue the concrete implementations known to the class hierarchy
+                dispatch_classes = []
+                if not called_method_key and class_hierarchy is not None:
+                    dispatch_classes = class_hierarchy.dispatch_targets(called_class_fqn, called_method_name)
+                    for target_class_fqn in dispatch_classes:
+                        method_files[(called_method_name, target_class_fqn)] = os.path.join(repo_path, class_hierarchy.class_file(target_class_fqn))
+                        heapq.heappush(priority_list, (hops + 1, rank, next(discovery_order), called_method_name, target_class_fqn))
+
+                # Search for `called_class.java` in `codebase_dirs`: resolved FQN first, then the caller's package
+                if not called_method_key and not dispatch_classes:
                     package_name = "/".join(class_name.split(".")[:-1]) 
+                    candidate_paths = []
+                    if "." in called_class_fqn:
+                        candidate_paths.append(top_level_class(called_class_fqn).replace(".", "/") + ".java")
+                    candidate_paths.append(os.path.join(package_name, f"{called_class_name}.java"))
                     called_file_path = None
-                    for directory in codebase_dirs:
-                        possible_path = os.path.join(directory, package_name, f"{called_class_name}.java")
-                        # print("possible_path:", possible_path)
-                        if os.path.exists(possible_path):
-                            called_file_path = possible_path
-                            # print("called_file_path:", called_file_path)
-                            called_full_class_name = f'{package_name+called_class_name}'
-                            method_files_key = (called_method_name, called_full_class_name)
-                            method_files[method_files_key] = called_file_path
-                            # print("new method_files:", method_files)
-                            # Add to queue
-                            priority_list.append((called_method_name, called_full_class_name))
+                    for relative_class_path in candidate_paths:
+                        for directory in codebase_dirs:
+                            possible_path = os.path.join(directory, relative_class_path)
+                            # print("possible_path:", possible_path)
+                            if os.path.exists(possible_path):
+                                called_file_path = possible_path
+                                break
+                        if called_file_path:
                             break
+                    if called_file_path:
+                        # print("called_file_path:", called_file_path)
+                        called_full_class_name = called_class_fqn if "." in called_class_fqn else f"{package_name.replace('/', '.')}.{called_class_name}"
+                        method_files_key = (called_method_name, called_full_class_name)
+                        method_files[method_files_key] = called_file_path
+                        # print("new method_files:", method_files)
+                        # Add to queue
+                        heapq.heappush(priority_list, (hops + 1, rank, next(discovery_order), called_method_name, called_full_class_name))
 
                 if not called_method_key or called_method_key in visited_methods:
                     continue  # Skip if already processed
-                
-                # print("class_name:", class_name)
-                priority_list.append((called_method_name, class_name))  # Add to queue
-                visited_methods.add(called_method_key)  # Mark as visited immediately
-                extracted_methods[called_method_key] = methods[called_method_key]  # Store method
+
+                # Queued, not stored: only the queue order decides which methods fit the budgets
+                order = next(discovery_order)
+                queued_callees[order] = (called_method_key, methods[called_method_key])
+                heapq.heappush(priority_list, (hops + 1, rank, order, called_method_name, class_name))
 
     # print(f"call_graph: {call_graph}")
     # print(f"Final Extracted Methods: {list(extracted_methods.keys())}")
@@ -268,6 +348,81 @@ def navigate_code(stack_trace, codebase_dirs):
 
 
 
+# Parse 'at pkg.Class.method(File.java:123)' frames in stack-trace order
+def parse_stack_frames(stack_trace):
+    frames = []
+    for line in stack_trace.split("\n"):
+        line = line.strip()
+        if not line.startswith("at "):
+            continue
+        parts = line[3:].split("(", 1)
+        if len(parts) != 2:
+            continue
+        class_method_part, file_part = parts
+        method_parts = class_method_part.split(".")
+        if len(method_parts) < 2:
+            continue
+        file_part = file_part.rstrip(")")
+        file_name, _, line_number = file_part.partition(":")
+        frames.append((
+            ".".join(method_parts[:-1]),
+            method_parts[-1],
+            os.path.basename(file_name),
+            int(line_number) if line_number.isdigit() else None
+        ))
+    return frames
+
+
+# Step 6 (indexed): Navigate code using the precomputed whole-repository call graph
+def navigate_call_graph(stack_trace, call_graph, repo_path, max_hops=None, max_methods=None, max_tokens=None):
+    """
+    Extracts the methods reachable from the stack-trace frames over the call graph's CSR arrays,
+    in (hops from the frames, frame rank) order and under the same budgets as navigate_code.
+    """
+    priority_list = []
+    line_indexes = {}
+    for rank, (class_name, method_name, _, line_number) in enumerate(parse_stack_frames(stack_trace)):
+        method_id = call_graph.method_id_in_class(class_name, method_name)
+        relative_path = call_graph.class_file(class_name)
+        if method_id is None and line_number is not None and relative_path is not None:
+            # lambda$/access$ frames: fall back to the method enclosing the frame line
+            if relative_path not in line_indexes:
+                line_indexes[relative_path] = load_method_line_index(os.path.join(repo_path, relative_path))
+            line_index = line_indexes[relative_path][1]
+            enclosing = line_index.enclosing_method(line_number) if line_index is not None else None
+            if enclosing is not None:
+                method_id = call_graph.method_id_in_class(class_name, enclosing.name)
+        if method_id is not None:
+            priority_list.append((0, rank, method_id))
+    heapq.heapify(priority_list)
+
+    visited = set()
+    extracted_methods = {}
+    used_tokens = 0
+    while priority_list:
+        if max_methods is not None and len(extracted_methods) >= max_methods:
+            break
+        hops, rank, method_id = heapq.heappop(priority_list)
+        if method_id in visited:
+            continue
+        visited.add(method_id)
+
+        method_code = call_graph.method_code(method_id, repo_path)
+        if max_tokens is not None:
+            method_tokens = count_tokens(method_code)
+            if used_tokens + method_tokens > max_tokens:
+                continue
+            used_tokens += method_tokens
+        extracted_methods[call_graph.method_names[method_id]] = method_code
+
+        if max_hops is None or hops + 1 <= max_hops:
+            for callee in call_graph.callees(method_id):
+                if callee not in visited:
+                    heapq.heappush(priority_list, (hops + 1, rank, callee))
+    return extracted_methods
+
+
+
 # Step 7: Merge with developer written bug reports
 def merge_bug_reports(output_data, bug_reports_file):
     """
@@ -293,7 +448,149 @@ def merge_bug_reports(output_data, bug_reports_file):
     return output_data
 
 
-# Step 7: Main Execution
+# Step 7: Parallel extraction [one git worktree per worker, one part file per bug, merged in input order]
+def worktree_path(repo_path, worker_index):
+    """
+    Worktree of one extraction worker, e.g. Projects/.worktrees/1/zookeeper. Kept outside the working tree
+    like the per-commit indexes; the repository directory name is kept so key formats stay unchanged.
+    """
+    repo_path = os.path.abspath(repo_path)
+    return os.path.join(os.path.dirname(repo_path), ".worktrees", str(worker_index), os.path.basename(repo_path))
+
+
+def prepare_worktree(repo_path, worker_index):
+    path = worktree_path(repo_path, worker_index)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        subprocess.run(["git", "worktree", "prune"], cwd=repo_path)
+        subprocess.run(["git", "worktree", "add", "--detach", path], cwd=repo_path, check=True)
+    return path
+
+
+def checkout_worktree(commit_version, worktree):
+    subprocess.run(["git", "checkout", "--quiet", "--force", "--detach", commit_version], cwd=worktree, check=True)
+    subprocess.run(["git", "clean", "--quiet", "-fd"], cwd=worktree)
+
+
+def part_file_path(parts_dir, bug_index):
+    return os.path.join(parts_dir, f"{bug_index:06d}.json")
+
+
+def load_part_file(parts_dir, bug_index, entry):
+    """
+    Returns the stored record of a bug, or None if it is missing, truncated or belongs to another input.
+    """
+    try:
+        with open(part_file_path(parts_dir, bug_index), "r") as file:
+            record = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if record.get("filename") != entry["filename"] or record.get("creation_time") != entry["creation_time"]:
+        return None
+    return record
+
+
+def write_part_file(parts_dir, bug_index, record):
+    path = part_file_path(parts_dir, bug_index)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(record, file, indent=4)
+    os.replace(temp_path, path)
+
+
+def extract_bug_record(entry, commit_version, snapshot_path, snapshot_dirs, options, index_repo_path=None):
+    """
+    Extracts the source code of one bug from a snapshot that is already checked out at commit_version.
+    """
+    # Method keys are relative to the snapshot, so a worktree produces the same keys as the main checkout
+    stack_trace = entry['stack_trace']
+    if options["use_call_graph_index"]:
+        call_graph = load_or_build_call_graph(snapshot_path, commit_version, snapshot_dirs, index_repo_path)
+        relevant_methods = navigate_call_graph(stack_trace, call_graph, snapshot_path, options["max_hops"], options["max_methods"], options["max_tokens"])
+    else:
+        class_hierarchy = load_or_build_call_graph(snapshot_path, commit_version, snapshot_dirs, index_repo_path).hierarchy if options["use_class_hierarchy_index"] else None
+        relevant_methods = navigate_code(stack_trace, snapshot_dirs, options["max_hops"], options["max_methods"], options["max_tokens"], class_hierarchy, snapshot_path)
+    return {
+        'filename': entry['filename'],
+        'creation_time': entry['creation_time'],
+        'stack_trace': stack_trace,
+        'source_code': relevant_methods
+    }
+
+
+_worker_snapshot = None
+
+def init_extraction_worker(worktree_queue):
+    global _worker_snapshot
+    _worker_snapshot = worktree_queue.get()
+
+
+def extract_commit_group(task):
+    """
+    Worker task: every pending bug of one commit, extracted from the worker's own worktree.
+    Returns the indices of the bugs that were written.
+    """
+    commit_version, bugs, repo_path, codebase_dirs, parts_dir, options = task
+    snapshot_dirs = [os.path.join(_worker_snapshot, os.path.relpath(d, repo_path)) for d in codebase_dirs]
+    checkout_worktree(commit_version, _worker_snapshot)
+    written = []
+    for bug_index, entry in bugs:
+        try:
+            record = extract_bug_record(entry, commit_version, _worker_snapshot, snapshot_dirs, options, repo_path)
+        except Exception as e:
+            print(f"Error extracting {entry['filename']}: {e}")
+            continue
+        write_part_file(parts_dir, bug_index, record)
+        written.append(bug_index)
+    return written
+
+
+def run_extraction(stack_trace_data, repo_path, codebase_dirs, git_branch, output_file, options, num_workers=1):
+    """
+    Extracts the source code of every bug into per-bug part files next to output_file (<output_file>.parts/),
+    skipping bugs whose part file already exists, so an interrupted run resumes where it stopped.
+    Bugs are grouped by commit and the groups are sharded across num_workers processes, each with its own
+    git worktree. Returns the records in input order, or None while some bugs are still missing.
+    """
+    parts_dir = f"{output_file}.parts"
+    os.makedirs(parts_dir, exist_ok=True)
+
+    pending_by_commit = {}
+    for bug_index, entry in enumerate(stack_trace_data):
+        if load_part_file(parts_dir, bug_index, entry) is None:
+            commit_version = get_commit_version(entry['creation_time'], repo_path, git_branch)
+            pending_by_commit.setdefault(commit_version, []).append((bug_index, entry))
+    pending = sum(len(bugs) for bugs in pending_by_commit.values())
+    print(f"{len(stack_trace_data) - pending} bugs already extracted, {pending} pending in {len(pending_by_commit)} commits")
+
+    if num_workers <= 1:
+        for commit_version, bugs in pending_by_commit.items():
+            checkout_to_commit(commit_version, repo_path, git_branch)
+            for bug_index, entry in bugs:
+                record = extract_bug_record(entry, commit_version, repo_path, codebase_dirs, options)
+                write_part_file(parts_dir, bug_index, record)
+    elif pending_by_commit:
+        worktree_queue = multiprocessing.Manager().Queue()
+        for worker_index in range(num_workers):
+            worktree_queue.put(prepare_worktree(repo_path, worker_index))
+        # Largest commit groups first so one long group does not finish last
+        tasks = [
+            (commit_version, bugs, repo_path, codebase_dirs, parts_dir, options)
+            for commit_version, bugs in sorted(pending_by_commit.items(), key=lambda item: -len(item[1]))
+        ]
+        with multiprocessing.Pool(num_workers, initializer=init_extraction_worker, initargs=(worktree_queue,)) as pool:
+            for written in pool.imap_unordered(extract_commit_group, tasks):
+                print(f"Extracted {len(written)} bugs")
+
+    records = [load_part_file(parts_dir, bug_index, entry) for bug_index, entry in enumerate(stack_trace_data)]
+    missing = [entry['filename'] for record, entry in zip(records, stack_trace_data) if record is None]
+    if missing:
+        print(f"{len(missing)} bugs failed; rerun to retry them: {missing}")
+        return None
+    return records
+
+
+# Step 8: Main Execution
 if __name__ == "__main__":
     # stack_trace_file = "test.json"
     stack_trace_file = "data/stack_traces/Storm.json"
@@ -305,38 +602,37 @@ if __name__ == "__main__":
     git_branch = "master"
     # Path to developer-written bug reports
     dev_written_bug_reports_file = "data/developer_written_bug_reports/Storm.json"
+    # Navigate with the persisted per-commit call graph (Projects/.index/<repo>/<commit>) instead of re-parsing per bug
+    use_call_graph_index = False
+    # Follow calls through interfaces/abstract classes in navigate_code using the same per-commit index
+    use_class_hierarchy_index = False
+    # Extraction budgets [None = unbounded]: hops from the stack-trace frames, extracted methods, source tokens
+    max_hops = None
+    max_methods = None
+    max_tokens = None
+
+    # Worker processes for extraction [each gets its own git worktree under Projects/.worktrees]
+    num_workers = 1
+    # Write output to JSON
+    # output_file = 'test_output.json'
+    output_file = 'data/source_code_data/Storm.json'
 
-    # Prepare output
-    output_data = []
-
-    for entry in stack_trace_data:
-        filename = entry['filename']
-        creation_time = entry['creation_time']
-        stack_trace = entry['stack_trace']
-
-        commit_version = get_commit_version(creation_time, repo_path, git_branch)
-        checkout_to_commit(commit_version, repo_path, git_branch)
-
-        relevant_methods = navigate_code(stack_trace, codebase_dirs)
-
-        # print("Extracted Methods:", relevant_methods.keys())
-
-
-        # Add to output data
-        output_data.append({
-            'filename': filename,
-            'creation_time': creation_time,
-            'stack_trace': stack_trace,
-            'source_code': relevant_methods
-        })
+    options = {
+        "use_call_graph_index": use_call_graph_index,
+        "use_class_hierarchy_index": use_class_hierarchy_index,
+        "max_hops": max_hops,
+        "max_methods": max_methods,
+        "max_tokens": max_tokens,
+    }
+    output_data = run_extraction(stack_trace_data, repo_path, codebase_dirs, git_branch, output_file, options, num_workers)
+    if output_data is None:
+        raise SystemExit(1)
 
     # Merge developer-written bug reports into the output data
     output_data = merge_bug_reports(output_data, dev_written_bug_reports_file)
 
-    # Write output to JSON
-    # output_file = 'test_output.json'
-    output_file = 'data/source_code_data/Storm.json'
     with open(f"{output_file}", "w") as outfile:
         json.dump(output_data, outfile, indent=4)
+    shutil.rmtree(f"{output_file}.parts")
 
     print(f"Source code have been extracted and saved to '{output_file}'")
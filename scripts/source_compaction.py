@@ -0,0 +1,121 @@
+import re
+from functools import lru_cache
+from token_budget import count_tokens
+
+
+# Log calls elided with elide_logs: the chatty levels (warn/error messages often match the bug report's text)
+DEFAULT_ELIDED_LOG_LEVELS = ("trace", "debug", "info")
+# An empty statement, so a braceless "if (debug) LOG.debug(...);" keeps its own body
+ELIDED_LOG = "/* log */;"
+LOG_CALL_PATTERN = re.compile(r"\b(?:LOG|LOGGER|Log|Logger|log|logger)\s*\.\s*(\w+)\s*\(")
+HORIZONTAL_SPACE = re.compile(r"[ \t\f]+")
+
+
+def _lex(code):
+    """
+    Splits Java source into ("code" | "string" | "comment", text) segments. Strings cover "...", '...' and
+    text blocks; comments cover //, /* */ and Javadoc.
+    """
+    index = start = 0
+    length = len(code)
+    while index < length:
+        char = code[index]
+        if char == "/" and code.startswith("//", index):
+            end = code.find("\n", index)
+            kind, end = "comment", length if end == -1 else end
+        elif char == "/" and code.startswith("/*", index):
+            end = code.find("*/", index + 2)
+            kind, end = "comment", length if end == -1 else end + 2
+        elif code.startswith('"""', index):
+            end = code.find('"""', index + 3)
+            kind, end = "string", length if end == -1 else end + 3
+        elif char in "\"'":
+            end = index + 1
+            while end < length and code[end] not in (char, "\n"):
+                end += 2 if code[end] == "\\" else 1
+            kind, end = "string", min(end + 1, length)
+        else:
+            index += 1
+            continue
+        if start < index:
+            yield "code", code[start:index]
+        yield kind, code[index:end]
+        index = start = end
+    if start < length:
+        yield "code", code[start:]
+
+
+def _log_call_end(masked, open_paren):
+    """
+    Index after the ';' closing the call whose '(' is at open_paren, or None if it does not end cleanly.
+    """
+    depth = 0
+    for index in range(open_paren, len(masked)):
+        if masked[index] == "(":
+            depth += 1
+        elif masked[index] == ")":
+            depth -= 1
+            if depth == 0:
+                rest = masked[index + 1:]
+                stripped = rest.lstrip()
+                return index + 1 + len(rest) - len(stripped) + 1 if stripped.startswith(";") else None
+    return None
+
+
+@lru_cache(maxsize=65536)
+def compact_java(code, elide_log_levels=(), keep_lines=True):
+    """
+    Java source without comments and Javadoc, indentation and repeated spaces; log calls of elide_log_levels
+    become "/* log */;". With keep_lines, line i of the result is line i of the input (emptied lines stay), so
+    line numbers of stack frames still point at the same statement; otherwise empty lines are dropped.
+    """
+    text, masked, pending = [], [], []
+
+    def flush():
+        segment = HORIZONTAL_SPACE.sub(" ", "".join(pending))
+        text.append(segment)
+        masked.append(segment)
+        pending.clear()
+
+    for kind, segment in _lex(code):
+        if kind == "code":
+            pending.append(segment)
+        elif kind == "comment":
+            # A removed block comment keeps its line breaks
+            pending.append("\n" * segment.count("\n") or " ")
+        else:
+            flush()
+            text.append(segment)
+            # Same length, without the brackets and semicolons a string may contain
+            masked.append(segment[0] + re.sub(r"[^\n]", "_", segment[1:-1]) + segment[-1] if len(segment) > 1 else segment)
+    flush()
+    text, masked = "".join(text), "".join(masked)
+
+    if elide_log_levels:
+        pieces, position = [], 0
+        for match in LOG_CALL_PATTERN.finditer(masked):
+            if match.start() < position or match.group(1).lower() not in elide_log_levels:
+                continue
+            end = _log_call_end(masked, match.end() - 1)
+            if end is None:
+                continue
+            pieces.append(text[position:match.start()])
+            pieces.append(ELIDED_LOG + "\n" * text.count("\n", match.start(), end))
+            position = end
+        text = "".join(pieces) + text[position:]
+
+    lines = [line.strip() for line in text.split("\n")]
+    return "\n".join(lines if keep_lines else [line for line in lines if line])
+
+
+def compact_source(code, elide_logs=False, keep_lines=True):
+    """
+    Returns (compacted code, tokens saved).
+    """
+    compacted = compact_java(code, DEFAULT_ELIDED_LOG_LEVELS if elide_logs else (), keep_lines)
+    return compacted, max(0, _tokens(code) - _tokens(compacted))
+
+
+@lru_cache(maxsize=65536)
+def _tokens(text):
+    return count_tokens(text)
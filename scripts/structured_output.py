@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import Counter
+from llm_gateway import get_gateway
+
+
+# Required top-level keys (and their types) of each generated document; other keys are kept as they are
+REPORT_SCHEMA = {"Title": str, "Description": str}
+FIX_SCHEMA = {"possible_fix_code": dict}
+JUDGE_SCHEMA = {"root_cause_identification": dict, "fix_suggestion": str, "problem_location_identification": dict, "wrong_information": str}
+
+# An unterminated fence (truncated answer) runs to the end of the text
+FENCE_PATTERN = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n(.*?)(?:\n[ \t]*```|\Z)", re.S)
+STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+REPAIR_PROMPT = """The text below was meant to be a single JSON object{keys}, but it is not valid: {problem}.
+Return only the corrected JSON object in a ```json code block. Keep every value as it is; fix only the syntax
+(quotes, escapes, commas, brackets) and the structure.
+
+{text}
+"""
+
+
+class StructuredOutputError(ValueError):
+    outcome = "failed"
+
+
+class TruncatedOutputError(StructuredOutputError):
+    """
+    The answer's JSON ends inside a string or with brackets open: it was cut off, and closing it would pass a
+    partial document off as complete.
+    """
+    outcome = "truncated"
+
+
+def _object_span(text, start):
+    """
+    The JSON object opening at text[start] up to its matching brace (string aware), or to the end if unclosed.
+    """
+    depth = 0
+    in_string = escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return text[start:]
+
+
+def json_candidates(text):
+    """
+    Texts that may hold the answer's JSON, most likely first: fenced blocks, then the first bare object.
+    """
+    candidates = [match.group(1).strip() for match in FENCE_PATTERN.finditer(text)]
+    start = text.find("{")
+    if start != -1:
+        candidates.append(_object_span(text, start))
+    return list(dict.fromkeys(candidate for candidate in candidates if candidate))
+
+
+def repair_json(text):
+    """
+    Fixes the usual defects of generated JSON: raw newlines and tabs inside strings (code snippets) and trailing
+    commas. Returns (repaired text, truncated); truncated is True when the text ends inside a string or with
+    brackets open, which is reported rather than repaired.
+    """
+    output = []
+    closers = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char in STRING_ESCAPES:
+                char = STRING_ESCAPES[char]
+            elif ord(char) < 0x20:
+                continue
+            output.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            _drop_trailing_comma(output)
+            if closers:
+                closers.pop()
+        output.append(char)
+    return "".join(output), in_string or bool(closers)
+
+
+def _drop_trailing_comma(output):
+    index = len(output) - 1
+    while index >= 0 and output[index].isspace():
+        index -= 1
+    if index >= 0 and output[index] == ",":
+        del output[index]
+
+
+def schema_problems(value, schema):
+    if not isinstance(value, dict):
+        return [f"expected a JSON object, got {type(value).__name__}"]
+    problems = []
+    for key, expected in (schema or {}).items():
+        if key not in value:
+            problems.append(f"missing key '{key}'")
+        elif not isinstance(value[key], expected):
+            problems.append(f"'{key}' should be {getattr(expected, '__name__', expected)}")
+    return problems
+
+
+def parse_json_response(text, schema=None):
+    """
+    Returns (value, "parsed" | "repaired") without any LLM call; raises StructuredOutputError, or
+    TruncatedOutputError when the only JSON found is cut off.
+    """
+    problem = "no JSON object found"
+    truncated = False
+    for candidate in json_candidates(text):
+        repaired, candidate_truncated = repair_json(candidate)
+        truncated = truncated or candidate_truncated
+        for how, body in (("parsed", candidate), ("repaired", repaired)):
+            if how == "repaired" and candidate_truncated:
+                continue
+            try:
+                value = json.loads(body)
+            except json.JSONDecodeError as e:
+                problem = f"{e.msg} at line {e.lineno} column {e.colno}"
+                continue
+            problems = schema_problems(value, schema)
+            if not problems:
+                return value, how
+            problem = "; ".join(problems)
+    if truncated:
+        raise TruncatedOutputError(f"the JSON is truncated (unterminated string or unclosed brackets): {problem}")
+    raise StructuredOutputError(problem)
+
+
+def parse_structured(text, schema=None, repair_model="gpt-4o-mini", gateway=None):
+    """
+    Parses the JSON answer of a generator: locally when possible, otherwise with one repair call that only
+    fixes the syntax of the paid-for answer. Returns (value, "parsed" | "repaired" | "repair_call"); raises
+    StructuredOutputError when the repaired answer is still unusable. A truncated answer raises
+    TruncatedOutputError without a repair call, which could only make up the missing end.
+    """
+    try:
+        return parse_json_response(text, schema)
+    except TruncatedOutputError:
+        raise
+    except StructuredOutputError as e:
+        problem = str(e)
+    if repair_model is None:
+        raise StructuredOutputError(problem)
+    keys = f" with the keys {', '.join(schema)}" if schema else ""
+    gateway = gateway or get_gateway()
+    try:
+        repaired = gateway.complete(REPAIR_PROMPT.format(keys=keys, problem=problem, text=text), repair_model)
+    except Exception as e:
+        raise StructuredOutputError(f"{problem}; the repair call failed: {type(e).__name__}: {e}")
+    try:
+        return parse_json_response(repaired, schema)[0], "repair_call"
+    except StructuredOutputError as e:
+        raise StructuredOutputError(f"{problem}; after the repair call: {e}")
+
+
+class RawResponseLog:
+    """
+    Append-only JSONL of raw LLM answers (one line per answer, with how it was parsed), so a failed parse never
+    loses a paid call. The file is created on the first record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, filename, text, outcome, stage=None):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"filename": filename, "stage": stage, "outcome": outcome, "time": time.time(), "response": text}, ensure_ascii=False) + "\n")
+
+    def summary(self):
+        return ", ".join(f"{count} {outcome}" for outcome, count in sorted(self.outcomes.items())) or "no responses"
@@ -0,0 +1,131 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+
+# gpt-4o-mini has a 128k context; leave room for the completion
+DEFAULT_PROMPT_BUDGET = 100000
+TRIM_MARKER = "\n... [{} tokens trimmed to fit the context window] ...\n"
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model="gpt-4o-mini"):
+    """
+    Process-wide tiktoken encoder per model. Returns None without tiktoken (counts fall back to ~4 chars/token).
+    """
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def encode(text, model="gpt-4o-mini"):
+    encoder = get_encoder(model)
+    if encoder is None:
+        return None
+    return encoder.encode(text, disallowed_special=())
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    text = text if isinstance(text, str) else str(text)
+    tokens = encode(text, model)
+    return len(tokens) if tokens is not None else len(text) // 4 + 1
+
+
+def split_into_chunks(text, max_tokens=DEFAULT_PROMPT_BUDGET, model="gpt-4o-mini"):
+    tokens = encode(text, model)
+    if tokens is None:
+        step = max_tokens * 4
+        return [text[i:i + step] for i in range(0, len(text), step)] or [text]
+    encoder = get_encoder(model)
+    return [encoder.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)] or [text]
+
+
+def trim_to_tokens(text, max_tokens, keep="middle", model="gpt-4o-mini"):
+    """
+    Shortens text to about max_tokens. keep='tail' drops the oldest part (chat history), keep='head' the end,
+    and keep='middle' keeps the beginning and the end (stack traces, source code).
+    """
+    tokens = encode(text, model)
+    total = len(tokens) if tokens is not None else len(text) // 4 + 1
+    if total <= max_tokens:
+        return text
+    marker = TRIM_MARKER.format(total - max_tokens)
+    # The marker counts against the budget too
+    max_tokens = max(max_tokens - count_tokens(marker, model), 0)
+    if tokens is None:
+        decode = lambda start, end: text[start * 4:end * 4]
+    else:
+        decode = lambda start, end: get_encoder(model).decode(tokens[start:end])
+    if keep == "tail":
+        return marker.lstrip("\n") + decode(total - max_tokens, total)
+    if keep == "head":
+        return decode(0, max_tokens) + marker.rstrip("\n")
+    head = max_tokens * 2 // 3
+    return decode(0, head) + marker + decode(total - (max_tokens - head), total)
+
+
+class PromptBudget:
+    """
+    Measures every section of a prompt separately and fits them into one call: the largest trimmable section
+    is cut first until the whole prompt is within budget. Sections listed in keep_whole are never trimmed;
+    overflow() reports how far they alone exceed the budget so the caller can fan them out instead.
+    """
+
+    def __init__(self, template_tokens, budget=DEFAULT_PROMPT_BUDGET, model="gpt-4o-mini"):
+        self.template_tokens = template_tokens
+        self.budget = budget
+        self.model = model
+
+    @classmethod
+    def for_template(cls, template, budget=DEFAULT_PROMPT_BUDGET, model="gpt-4o-mini"):
+        return cls(count_tokens(template, model), budget, model)
+
+    def measure(self, sections):
+        return {name: count_tokens(text, self.model) for name, text in sections.items()}
+
+    def overflow(self, sections, keep_whole=()):
+        sizes = self.measure(sections)
+        return self.template_tokens + sum(sizes[name] for name in keep_whole) - self.budget
+
+    def fit(self, sections, keep_whole=(), keep=None):
+        """
+        Returns (fitted sections, token counts). keep maps a section name to its trim_to_tokens mode.
+        """
+        keep = keep or {}
+        sections = {name: text if isinstance(text, str) else str(text) for name, text in sections.items()}
+        sizes = self.measure(sections)
+        excess = self.template_tokens + sum(sizes.values()) - self.budget
+        trimmable = sorted((name for name in sections if name not in keep_whole), key=lambda name: -sizes[name])
+        for name in trimmable:
+            if excess <= 0:
+                break
+            target = max(sizes[name] - excess, 0)
+            sections[name] = trim_to_tokens(sections[name], target, keep.get(name, "middle"), self.model)
+            new_size = count_tokens(sections[name], self.model)
+            excess -= sizes[name] - new_size
+            sizes[name] = new_size
+        return sections, sizes
+
+
+def map_reduce(llm, prompts, reduce_prompt, max_workers=4):
+    """
+    Sends the chunk prompts concurrently and merges the answers with one more call. reduce_prompt is a
+    format string with a {partial_results} field. Returns the merged text.
+    """
+    def invoke(prompt):
+        response = llm.invoke(prompt)
+        return getattr(response, "content", response)
+
+    # Each call runs in a copy of the caller's context so usage callbacks (get_openai_callback) still see it
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, invoke, prompt) for prompt in prompts]
+        partial_results = [future.result() for future in futures]
+    if len(partial_results) == 1:
+        return partial_results[0]
+    numbered = "\n\n".join(f"## Part {index + 1} of {len(partial_results)}\n{result}" for index, result in enumerate(partial_results))
+    return invoke(reduce_prompt.format(partial_results=numbered))